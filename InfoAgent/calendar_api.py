@@ -1,12 +1,107 @@
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+# The Google client libraries are imported where they are used: they take a large part
+# of the agent's start-up time and are not needed with an injected service
 import pickle
 import os
+import json
+import hashlib
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 import dateutil.parser
 import dateutil.tz
-import requests
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+from singleflight import SingleFlight
+from location_resolver import resolve_location
+from recurrence import RecurrenceCache
+
+
+# Base URL of the Calendar API. When set (e.g. to a local stand-in such as
+# stubs/google_stub.py) requests go there without OAuth.
+CALENDAR_BASE_URL = os.environ.get("GOOGLE_CALENDAR_BASE_URL", "").rstrip("/")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _fetch_executor():
+    """The thread pool shared by all chunked calendar fetches, created on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=GoogleCalendarManager.MAX_FETCH_WORKERS,
+                                           thread_name_prefix="calendar-fetch")
+    return _executor
+
+
+class CalendarAuthError(Exception):
+    """There are no stored credentials that can be used without signing in."""
+
+
+# Itinerary item types that are not worth a calendar entry
+NON_EXPORTED_ITEM_TYPES = {'start', 'end', 'travel', 'error'}
+
+# Identical event listings of one account made at the same time (concurrent requests of
+# the same user) share one series of calls
+_inflight = SingleFlight("calendar")
+
+
+def _event_id(trip_key, index, item):
+    """
+    Build a deterministic Calendar event id for an itinerary item.
+
+    Google only accepts base32hex characters (0-9, a-v), which hex digests satisfy.
+    Re-exporting the same itinerary produces the same ids, so retries can't duplicate events.
+    """
+    seed = f"{trip_key}|{index}|{item.get('type')}|{item.get('time')}|{item.get('location')}"
+    return "ee" + hashlib.sha1(seed.encode('utf-8')).hexdigest()
+
+
+def itinerary_to_events(itinerary, time_zone, trip_key=None):
+    """
+    Convert itinerary items into Google Calendar event bodies.
+
+    Args:
+        itinerary: List of itinerary items (as in ItineraryResponse.itinerary)
+        time_zone: IANA time zone the item times are expressed in
+        trip_key: Stable key identifying the trip; defaults to a hash of the itinerary
+
+    Returns:
+        A list of (index, event_body) tuples for the items that become events
+    """
+    if trip_key is None:
+        trip_key = hashlib.sha1(json.dumps(itinerary, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    events = []
+    for index, item in enumerate(itinerary):
+        if item.get('type') in NON_EXPORTED_ITEM_TYPES or not item.get('time') or not item.get('end_time'):
+            continue
+        
+        start = dateutil.parser.parse(item['time']).replace(tzinfo=None)
+        end = dateutil.parser.parse(item['end_time']).replace(tzinfo=None)
+        
+        description = item.get('description', '')
+        if item.get('vicinity'):
+            description = f"{description}\n{item['vicinity']}".strip()
+        
+        event = {
+            'id': _event_id(trip_key, index, item),
+            'summary': item.get('location', 'Trip activity'),
+            'description': description,
+            'start': {'dateTime': start.isoformat(), 'timeZone': time_zone},
+            'end': {'dateTime': end.isoformat(), 'timeZone': time_zone}
+        }
+        coordinates = item.get('coordinates') or {}
+        if item.get('vicinity'):
+            event['location'] = item['vicinity']
+        elif coordinates.get('lat') or coordinates.get('lng'):
+            event['location'] = f"{coordinates.get('lat')},{coordinates.get('lng')}"
+        events.append((index, event))
+    
+    return events
 
 
 class GoogleCalendarManager:
@@ -19,15 +114,54 @@ class GoogleCalendarManager:
         'https://www.googleapis.com/auth/calendar'
     ]
     
-    def __init__(self, credentials_file='credentials.json', token_file='token.pickle'):
-        """Initialize the calendar manager and authenticate."""
+    BATCH_URI = f"{CALENDAR_BASE_URL or 'https://www.googleapis.com'}/batch/calendar/v3"
+    # Google accepts at most 50 calls per Calendar batch request
+    MAX_BATCH_SIZE = 50
+    
+    # Ranges longer than this many days are fetched in parallel windows; shorter ones
+    # take a single listing (usually a single call)
+    CHUNKED_FETCH_MIN_DAYS = 14
+    # Size of each window (in days) when chunking
+    CHUNK_DAYS = 7
+    # Maximum number of windows fetched concurrently, by one call and by all together
+    MAX_FETCH_WORKERS = 4
+    
+    def __init__(self, credentials_file='credentials.json', token_file='token.pickle', local_recurrence=False,
+                 service=None, interactive=True):
+        """
+        Initialize the calendar manager and authenticate.
+
+        With local_recurrence=True, recurring events are fetched once as unexpanded
+        series (RRULEs) and expanded locally for each requested window, instead of
+        having Google expand every instance on every call.
+
+        An already built Calendar service (or an object with the same interface, e.g. a
+        fake in benchmarks) can be passed as `service` to skip authentication; it is
+        then shared by all fetch threads.
+
+        With interactive=False (e.g. in a web request) authentication never opens the
+        browser sign-in flow: it raises CalendarAuthError when the stored token is
+        missing or cannot be refreshed.
+        """
         self.credentials_file = credentials_file
         self.token_file = token_file
-        self.service = None
-        self.authenticate()
+        self.local_recurrence = local_recurrence
+        self.recurrence_cache = RecurrenceCache()
+        self.creds = None
+        self.service = service
+        self._injected_service = service
+        self._local = threading.local()
+        self.interactive = interactive
+        if service is None:
+            self.authenticate()
     
     def authenticate(self):
         """Authenticate with Google and get an access token."""
+        if CALENDAR_BASE_URL:
+            # Stand-in servers don't check credentials
+            self.service = self._build_service()
+            return self.service
+        
         creds = None
         # The file token.pickle stores the user's access and refresh tokens, and is
         # created automatically when the authorization flow completes for the first time.
@@ -37,8 +171,18 @@ class GoogleCalendarManager:
         # If there are no (valid) credentials available, let the user log in.
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
+                from google.auth.transport.requests import Request
+                from google.auth.exceptions import RefreshError
+                try:
+                    creds.refresh(Request())
+                except RefreshError as e:
+                    if not self.interactive:
+                        raise CalendarAuthError(f"Could not refresh the stored Google token: {e}") from e
+                    raise
+            elif not self.interactive:
+                raise CalendarAuthError("No valid Google token is stored; sign in to Google Calendar first")
             else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
                 flow = InstalledAppFlow.from_client_secrets_file(
                     self.credentials_file, self.SCOPES)
                 creds = flow.run_local_server(port=0)
@@ -46,9 +190,29 @@ class GoogleCalendarManager:
             with open(self.token_file, 'wb') as token:
                 pickle.dump(creds, token)
         
-        self.service = build('calendar', 'v3', credentials=creds)
+        self.creds = creds
+        self.service = self._build_service()
         return self.service
     
+    def _build_service(self):
+        """Build a Calendar API service object from the stored credentials."""
+        if self._injected_service is not None:
+            return self._injected_service
+        from googleapiclient.discovery import build
+        if CALENDAR_BASE_URL:
+            import httplib2
+            return build('calendar', 'v3', http=httplib2.Http(),
+                         client_options={'api_endpoint': f"{CALENDAR_BASE_URL}/calendar/v3/"})
+        return build('calendar', 'v3', credentials=self.creds)
+    
+    def _thread_service(self):
+        """Get a service object for the current thread (service objects are not thread-safe)."""
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = self._build_service()
+            self._local.service = service
+        return service
+    
     def get_events(self, calendar_id='primary', max_results=10):
         """Get events from the Google Calendar API."""
         if not self.service:
@@ -56,13 +220,14 @@ class GoogleCalendarManager:
             
         # Call the Calendar API
         now = datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
-        events_result = self.service.events().list(
-            calendarId=calendar_id, 
-            timeMin=now,
-            maxResults=max_results, 
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+        with metrics.api_call("calendar"):
+            events_result = self._thread_service().events().list(
+                calendarId=calendar_id, 
+                timeMin=now,
+                maxResults=max_results, 
+                singleEvents=True,
+                orderBy='startTime'
+            ).execute()
         
         events = events_result.get('items', [])
         return events
@@ -72,68 +237,168 @@ class GoogleCalendarManager:
         if not self.service:
             self.authenticate()
             
-        event = self.service.events().insert(calendarId=calendar_id, body=event).execute()
+        with metrics.api_call("calendar"):
+            event = self._thread_service().events().insert(calendarId=calendar_id, body=event).execute()
+        self.recurrence_cache.invalidate(calendar_id)
         print('Event created: %s' % (event.get('htmlLink')))
         return event
     
-    def get_current_location(self):
-        """Get the current location using ipinfo.io API."""
-        try:
-            response = requests.get('https://ipinfo.io/json')
-            if response.status_code == 200:
-                data = response.json()
-                location = f"{data.get('city', '')}, {data.get('region', '')}, {data.get('country', '')}"
-                return location.strip(', ')
-            else:
-                return "Unknown Location"
-        except Exception as e:
-            print(f"Error getting location: {e}")
-            return "Unknown Location"
-    
-    def find_free_time(self, date_from, date_to, calendar_id='primary'):
+    def export_itinerary(self, itinerary, calendar_id='primary', time_zone=None, trip_key=None):
         """
-        Find free time slots in a Google Calendar between specified start and end dates,
-        including location information for each slot.
+        Export a whole itinerary to the calendar using batch requests.
+
+        Every item gets a deterministic event id, so exporting the same trip again only
+        reports the already existing events instead of creating duplicates.
         
         Args:
-            date_from: Start date and time in format "YYYY-MM-DD HH:MM"
-            date_to: End date and time in format "YYYY-MM-DD HH:MM"
-            calendar_id: ID of the calendar to check (e.g., 'primary')
+            itinerary: List of itinerary items (as in ItineraryResponse.itinerary)
+            calendar_id: ID of the calendar to write to (e.g., 'primary')
+            time_zone: Time zone of the itinerary times; defaults to the calendar's
+            trip_key: Stable key identifying the trip (see itinerary_to_events)
             
         Returns:
-            A list of dictionaries containing free time slots with start and end times and locations
+            A dictionary with created/existing/failed counts and a per-item result list
         """
         if not self.service:
             self.authenticate()
-            
-        # Get calendar's time zone
-        calendar_info = self.service.calendars().get(calendarId=calendar_id).execute()
-        calendar_timezone = calendar_info.get('timeZone', 'UTC')
+        service = self._thread_service()
         
-        # Convert input strings to datetime objects with the calendar's timezone
-        local_tz = dateutil.tz.gettz(calendar_timezone)
-        start_datetime = datetime.strptime(date_from, "%Y-%m-%d %H:%M").replace(tzinfo=local_tz)
-        end_datetime = datetime.strptime(date_to, "%Y-%m-%d %H:%M").replace(tzinfo=local_tz)
+        if time_zone is None:
+            with metrics.api_call("calendar"):
+                calendar_info = service.calendars().get(calendarId=calendar_id).execute()
+            time_zone = calendar_info.get('timeZone', 'UTC')
         
-        # Convert to RFC3339 format for Google Calendar API
-        time_min = start_datetime.isoformat()
-        time_max = end_datetime.isoformat()
+        events = itinerary_to_events(itinerary, time_zone, trip_key)
+        results = {}
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import BatchHttpRequest
         
-        # Get current location as fallback
-        current_location = self.get_current_location()
+        def make_callback(index, event_id):
+            def callback(request_id, response, exception):
+                if exception is None:
+                    results[index] = {
+                        'index': index,
+                        'status': 'created',
+                        'event_id': response.get('id', event_id),
+                        'html_link': response.get('htmlLink')
+                    }
+                elif isinstance(exception, HttpError) and exception.resp.status == 409:
+                    # The id is already taken: this item was exported by an earlier attempt
+                    results[index] = {'index': index, 'status': 'exists', 'event_id': event_id}
+                else:
+                    results[index] = {
+                        'index': index,
+                        'status': 'failed',
+                        'event_id': event_id,
+                        'error': str(exception)
+                    }
+            return callback
         
-        # Get events from the calendar
-        events_result = self.service.events().list(
-            calendarId=calendar_id,
-            timeMin=time_min,
-            timeMax=time_max,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+        for batch_start in range(0, len(events), self.MAX_BATCH_SIZE):
+            batch = BatchHttpRequest(batch_uri=self.BATCH_URI)
+            for index, event in events[batch_start:batch_start + self.MAX_BATCH_SIZE]:
+                batch.add(
+                    service.events().insert(calendarId=calendar_id, body=event),
+                    callback=make_callback(index, event['id'])
+                )
+            try:
+                with metrics.api_call("calendar_batch"):
+                    batch.execute()
+            except Exception as e:
+                # The whole batch failed; mark whatever didn't get a response
+                for index, event in events[batch_start:batch_start + self.MAX_BATCH_SIZE]:
+                    results.setdefault(index, {
+                        'index': index,
+                        'status': 'failed',
+                        'event_id': event['id'],
+                        'error': str(e)
+                    })
         
-        events = events_result.get('items', [])
+        self.recurrence_cache.invalidate(calendar_id)
         
-        # Create a list of busy slots from events with their locations
+        ordered = [results[index] for index, _ in events if index in results]
+        return {
+            'created': sum(1 for r in ordered if r['status'] == 'created'),
+            'existing': sum(1 for r in ordered if r['status'] == 'exists'),
+            'failed': sum(1 for r in ordered if r['status'] == 'failed'),
+            'results': ordered
+        }
+    
+    def get_current_location(self, preferred=None):
+        """
+        Get the current location.
+
+        Uses the supplied location when there is one; otherwise falls back to a cached,
+        time-limited IP lookup (see location_resolver).
+        """
+        return resolve_location(preferred)
+    
+    def _list_events(self, calendar_id, time_min, time_max, service=None, single_events=True):
+        """
+        List all events in a time range, following pagination.
+
+        With single_events=False recurring events are returned once, as series with
+        their recurrence rules, together with their moved or cancelled instances.
+        """
+        # The token file identifies the account; an injected service is its own account
+        account = self.token_file if self._injected_service is None else id(self._injected_service)
+        return _inflight.do((account, calendar_id, time_min, time_max, single_events),
+                            self._fetch_events, calendar_id, time_min, time_max, service or self._thread_service(),
+                            single_events)
+
+    def _fetch_events(self, calendar_id, time_min, time_max, service, single_events):
+        events = []
+        page_token = None
+        while True:
+            params = {
+                'calendarId': calendar_id,
+                'timeMin': time_min,
+                'timeMax': time_max,
+                'singleEvents': single_events,
+                'pageToken': page_token
+            }
+            if single_events:
+                params['orderBy'] = 'startTime'
+            with metrics.api_call("calendar"):
+                events_result = service.events().list(**params).execute()
+            events.extend(events_result.get('items', []))
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                return events
+    
+    def _list_instances(self, calendar_id, event_id, time_min, time_max):
+        """List the server-expanded instances of one recurring event."""
+        instances = []
+        page_token = None
+        while True:
+            with metrics.api_call("calendar"):
+                result = self._thread_service().events().instances(
+                    calendarId=calendar_id,
+                    eventId=event_id,
+                    timeMin=time_min,
+                    timeMax=time_max,
+                    pageToken=page_token
+                ).execute()
+            instances.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return instances
+    
+    def _local_events(self, calendar_id, start_datetime, end_datetime, calendar_timezone):
+        """Get the events of a range by expanding cached recurrence rules locally."""
+        return self.recurrence_cache.events_between(
+            calendar_id,
+            start_datetime,
+            end_datetime,
+            fetch_raw=lambda time_min, time_max: self._list_events(
+                calendar_id, time_min, time_max, single_events=False),
+            fetch_instances=lambda event_id, time_min, time_max: self._list_instances(
+                calendar_id, event_id, time_min, time_max),
+            default_timezone=calendar_timezone
+        )
+    
+    def _busy_slots(self, events):
+        """Convert calendar events into busy slots sorted by start time."""
         busy_slots = []
         for event in events:
             # Skip events with transparency set to 'transparent' (free)
@@ -142,75 +407,179 @@ class GoogleCalendarManager:
                 
             start = event['start'].get('dateTime')
             end = event['end'].get('dateTime')
-            event_timezone = event['start'].get('timeZone', calendar_timezone)
             location = event.get('location', '')
             
             if start and end:  # Only consider events with specific times (not all-day events)
                 # Use dateutil.parser to handle various ISO formats and preserve time zone
-                start_dt = dateutil.parser.isoparse(start)
-                end_dt = dateutil.parser.isoparse(end)
-                
                 busy_slots.append({
-                    'start': start_dt,
-                    'end': end_dt,
+                    'id': event.get('id'),
+                    'start': dateutil.parser.isoparse(start),
+                    'end': dateutil.parser.isoparse(end),
                     'location': location
                 })
         
-        # Sort busy slots by start time
         busy_slots.sort(key=lambda x: x['start'])
+        return busy_slots
+    
+    @staticmethod
+    def _split_range(start_datetime, end_datetime, chunk):
+        """Split [start, end) into consecutive windows of at most `chunk` length."""
+        windows = []
+        window_start = start_datetime
+        while window_start < end_datetime:
+            window_end = min(window_start + chunk, end_datetime)
+            windows.append((window_start, window_end))
+            window_start = window_end
+        return windows
+    
+    def _iter_busy_windows(self, calendar_id, start_datetime, end_datetime, chunk_days, max_workers):
+        """
+        Yield the busy slots of each window of the range, in chronological order.
+
+        Windows are fetched concurrently (at most max_workers at a time) but yielded
+        in order, so callers can start using early windows while later ones load.
+        """
+        if not chunk_days:
+            events = self._list_events(calendar_id, start_datetime.isoformat(), end_datetime.isoformat())
+            yield self._busy_slots(events)
+            return
         
-        # Find free time slots with location information
-        free_slots = []
-        current_time = start_datetime
+        windows = deque(self._split_range(start_datetime, end_datetime, timedelta(days=chunk_days)))
+        
+        def fetch_window(window):
+            events = self._list_events(
+                calendar_id,
+                window[0].isoformat(),
+                window[1].isoformat(),
+                service=self._thread_service()
+            )
+            return self._busy_slots(events)
         
-        for i, busy in enumerate(busy_slots):
-            busy_start = busy['start']
-            busy_end = busy['end']
+        executor = _fetch_executor()
+        futures = deque()
+        try:
+            # Keep at most max_workers windows in flight; copy the context so each
+            # window's API calls stay in the caller's trace
+            while windows or futures:
+                while windows and len(futures) < max(1, max_workers):
+                    futures.append(executor.submit(contextvars.copy_context().run, fetch_window, windows.popleft()))
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+    
+    def iter_free_time(self, date_from, date_to, calendar_id='primary', default_location=None,
+                       chunk_days=None, max_workers=None):
+        """
+        Generate free time slots in chronological order as the calendar is fetched.
+
+        Takes the same arguments as find_free_time, plus:
+            chunk_days: Size of the fetch windows in days (e.g. 7); by default ranges
+                longer than CHUNKED_FETCH_MIN_DAYS are split into CHUNK_DAYS windows
+            max_workers: Maximum number of windows fetched concurrently
+
+        Yields:
+            Free time slot dictionaries, as soon as each slot is known
+        """
+        if not self.service:
+            self.authenticate()
             
-            # If there's free time before this busy slot
-            if current_time < busy_start:
-                # Determine start location (from previous event or current location)
-                start_location = current_location
-                if i > 0 and busy_slots[i-1].get('location'):
-                    start_location = busy_slots[i-1].get('location')
-                
-                # Determine end location (from upcoming event or same as start)
-                end_location = busy.get('location') if busy.get('location') else start_location
+        # Get calendar's time zone
+        with metrics.api_call("calendar"):
+            calendar_info = self._thread_service().calendars().get(calendarId=calendar_id).execute()
+        calendar_timezone = calendar_info.get('timeZone', 'UTC')
+        
+        # Convert input strings to datetime objects with the calendar's timezone
+        local_tz = dateutil.tz.gettz(calendar_timezone)
+        start_datetime = datetime.strptime(date_from, "%Y-%m-%d %H:%M").replace(tzinfo=local_tz)
+        end_datetime = datetime.strptime(date_to, "%Y-%m-%d %H:%M").replace(tzinfo=local_tz)
+        
+        if chunk_days is None and end_datetime - start_datetime > timedelta(days=self.CHUNKED_FETCH_MIN_DAYS):
+            chunk_days = self.CHUNK_DAYS
+        
+        if self.local_recurrence:
+            # One unexpanded listing covers the whole range; expansion is local
+            busy_windows = iter([self._busy_slots(
+                self._local_events(calendar_id, start_datetime, end_datetime, calendar_timezone))])
+        else:
+            busy_windows = self._iter_busy_windows(calendar_id, start_datetime, end_datetime,
+                                                   chunk_days, max_workers or self.MAX_FETCH_WORKERS)
+        
+        # Get current location as fallback
+        current_location = self.get_current_location(default_location)
+        
+        def make_slot(slot_start, slot_end, start_location, end_location):
+            # Format times in local time zone
+            return {
+                'start': slot_start.astimezone(local_tz).strftime("%Y-%m-%d %H:%M"),
+                'end': slot_end.astimezone(local_tz).strftime("%Y-%m-%d %H:%M"),
+                'start_location': start_location,
+                'end_location': end_location
+            }
+        
+        current_time = start_datetime
+        previous_busy = None
+        # Events spanning a window boundary are returned by both windows
+        seen_event_ids = set()
+        
+        for busy_slots in busy_windows:
+            for busy in busy_slots:
+                if busy['id']:
+                    if busy['id'] in seen_event_ids:
+                        continue
+                    seen_event_ids.add(busy['id'])
                 
-                # Format times in local time zone
-                start_local = current_time.astimezone(local_tz)
-                end_local = busy_start.astimezone(local_tz)
+                # If there's free time before this busy slot
+                if current_time < busy['start']:
+                    # Determine start location (from previous event or current location)
+                    start_location = current_location
+                    if previous_busy and previous_busy.get('location'):
+                        start_location = previous_busy.get('location')
+                    
+                    # Determine end location (from upcoming event or same as start)
+                    end_location = busy.get('location') if busy.get('location') else start_location
+                    
+                    yield make_slot(current_time, busy['start'], start_location, end_location)
                 
-                free_slots.append({
-                    'start': start_local.strftime("%Y-%m-%d %H:%M"),
-                    'end': end_local.strftime("%Y-%m-%d %H:%M"),
-                    'start_location': start_location,
-                    'end_location': end_location
-                })
-            
-            # Move current time to the end of this busy slot
-            current_time = max(current_time, busy_end)
+                # Move current time to the end of this busy slot
+                current_time = max(current_time, busy['end'])
+                previous_busy = busy
         
         # Add any remaining free time after the last busy slot
         if current_time < end_datetime:
             # Determine start location (from last event or current location)
             start_location = current_location
-            if busy_slots and busy_slots[-1].get('location'):
-                start_location = busy_slots[-1].get('location')
-            
-            # Format times in local time zone
-            start_local = current_time.astimezone(local_tz)
-            end_local = end_datetime.astimezone(local_tz)
+            if previous_busy and previous_busy.get('location'):
+                start_location = previous_busy.get('location')
             
             # For the last slot, use the same location for both start and end if no other info
-            free_slots.append({
-                'start': start_local.strftime("%Y-%m-%d %H:%M"),
-                'end': end_local.strftime("%Y-%m-%d %H:%M"),
-                'start_location': start_location,
-                'end_location': start_location
-            })
+            yield make_slot(current_time, end_datetime, start_location, start_location)
+    
+    def find_free_time(self, date_from, date_to, calendar_id='primary', default_location=None,
+                       chunk_days=None, max_workers=None):
+        """
+        Find free time slots in a Google Calendar between specified start and end dates,
+        including location information for each slot.
         
-        return free_slots
+        Args:
+            date_from: Start date and time in format "YYYY-MM-DD HH:MM"
+            date_to: End date and time in format "YYYY-MM-DD HH:MM"
+            calendar_id: ID of the calendar to check (e.g., 'primary')
+            default_location: Location to use when no event provides one (e.g. the
+                request's location); resolved from the IP address if not given
+            chunk_days: Size of the parallel fetch windows in days (see iter_free_time)
+            max_workers: Maximum number of windows fetched concurrently
+            
+        Returns:
+            A list of dictionaries containing free time slots with start and end times and locations
+        """
+        return list(self.iter_free_time(
+            date_from, date_to,
+            calendar_id=calendar_id,
+            default_location=default_location,
+            chunk_days=chunk_days,
+            max_workers=max_workers
+        ))
 
 
 def main():
@@ -6,8 +6,16 @@ import json
 
 import os
 import sys
+import asyncio
+import threading
+import contextvars
 sys.path.append(os.path.abspath("..")) 
 from models import TravelRequest, TravelPlan
+import http_cassette
+import metrics
+import tracing
+import profiling
+import loop_watchdog
 from dataclasses import dataclass
 from typing import List, Tuple
 # Placeholder function to call LLM (to be implemented)
@@ -15,6 +23,22 @@ import logging
 
 logging.basicConfig(level=logging.DEBUG)
 
+# One calendar manager per process, so that its listing and recurrence caches carry over
+# from one request to the next. Recurring events are expanded locally unless
+# CALENDAR_LOCAL_RECURRENCE=0.
+_calendar_manager = None
+_calendar_manager_lock = threading.Lock()
+
+
+def get_calendar_manager():
+    """Get the (shared) calendar manager, created on first use."""
+    global _calendar_manager
+    with _calendar_manager_lock:
+        if _calendar_manager is None:
+            _calendar_manager = GoogleCalendarManager(
+                local_recurrence=os.environ.get("CALENDAR_LOCAL_RECURRENCE", "1") != "0")
+    return _calendar_manager
+
 def call_llm(input_data):
     """
     Placeholder for LLM call.
@@ -104,32 +128,52 @@ travel_protocol = Protocol()
 @travel_protocol.on_message(model=TravelRequest)
 async def handle_travel_request(ctx: Context, sender: str, msg: TravelRequest): 
     
-    calendar = GoogleCalendarManager()
+    calendar = get_calendar_manager()
     
+    metrics.IN_FLIGHT.labels("travel_request").inc()
     try:
-        # Call the LLM with the full request to process
-        response = call_llm({
-            "prompt": msg.prompt,
-            "preferences": msg.preferences,
-            "date_from": msg.date_from,
-            "date_to": msg.date_to,
-            "location": msg.location
-        })
-        response_dict = extract_response(response)
-        if response_dict is None:
-            ctx.logger.error("Error extracting response from LLM")
-            return
-        # Send back the LLM-generated plan
-        travel_plan = TravelPlan(
-            free_times=calendar.find_free_time(msg.date_from, msg.date_to),
-            attractions=response_dict.get('attractions', ([], 0, 0)),
-            events=response_dict.get('events', ([], 0, 0)),
-            lunch=response_dict.get('lunch', ("", 0, 0)),
-            dinner=response_dict.get('dinner', ("", 0, 0)),
-        )
-        await ctx.send(sender, travel_plan)
+        with tracing.span("info_agent.handle_travel_request", parent=tracing.context_from_message(msg),
+                          kind="server", request_id=msg.request_id), \
+                profiling.profiled(msg.profile_dir, "info_agent"):
+            # Call the LLM with the full request to process
+            with metrics.stage_timer("keywords"):
+                response = call_llm({
+                    "prompt": msg.prompt,
+                    "preferences": msg.preferences,
+                    "date_from": msg.date_from,
+                    "date_to": msg.date_to,
+                    "location": msg.location
+                })
+                response_dict = extract_response(response)
+            if response_dict is None:
+                ctx.logger.error("Error extracting response from LLM")
+                return
+            # The Calendar round trips block, so they run in the default executor, in a
+            # copy of the context to stay in the current trace
+            with metrics.stage_timer("free_time"):
+                context = contextvars.copy_context()
+                free_times = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    lambda: context.run(
+                        calendar.find_free_time, msg.date_from, msg.date_to, default_location=msg.location
+                    )
+                )
+            # Send back the LLM-generated plan
+            travel_plan = TravelPlan(
+                free_times=free_times,
+                attractions=response_dict.get('attractions', ([], 0, 0)),
+                events=response_dict.get('events', ([], 0, 0)),
+                lunch=response_dict.get('lunch', ("", 0, 0)),
+                dinner=response_dict.get('dinner', ("", 0, 0)),
+                request_id=msg.request_id,
+                profile_dir=msg.profile_dir,
+                **tracing.message_context()
+            )
+            await ctx.send(sender, travel_plan)
     except Exception as e:
         ctx.logger.error(f"Error processing travel plan: {e}")
+    finally:
+        metrics.IN_FLIGHT.labels("travel_request").dec()
 
 # Set up the agent
 agent = Agent(
@@ -140,6 +184,10 @@ agent = Agent(
     mailbox={"server": "https://agentverse.ai"}  # Add this
 )
 agent.include(travel_protocol)
+loop_watchdog.add_agent_watchdog(agent)
 
 if __name__ == "__main__":
+    # Record or replay outbound HTTP traffic when HTTP_CASSETTE_MODE is set
+    http_cassette.install_from_env()
+    metrics.start_metrics_server_from_env()
     agent.run()
@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import logging
+import threading
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_LOCATION = "Unknown Location"
+
+# How long a resolved IP location stays valid (seconds)
+IP_LOCATION_TTL = int(os.environ.get("IP_LOCATION_TTL", 6 * 60 * 60))
+# How long a failed lookup is remembered, so a network blip doesn't stick for hours
+IP_LOCATION_FAILURE_TTL = int(os.environ.get("IP_LOCATION_FAILURE_TTL", 60))
+# Hard cap on the ipinfo.io round trip so it can never stall a request
+IP_LOOKUP_TIMEOUT = float(os.environ.get("IP_LOOKUP_TIMEOUT", 2.0))
+# Optional MaxMind GeoLite2/GeoIP2 City database for offline lookups
+GEOIP_CITY_DB = os.environ.get("GEOIP_CITY_DB")
+# This host's public address, for the offline lookup; looked up once when not set
+PUBLIC_IP = os.environ.get("PUBLIC_IP")
+
+_ip_cache = {}
+_ip_cache_lock = threading.Lock()
+_geoip_reader = None
+_public_ip = PUBLIC_IP
+
+
+def _format_location(city, region, country):
+    """Join the location parts the same way the calendar manager always has."""
+    location = f"{city or ''}, {region or ''}, {country or ''}"
+    return location.strip(', ') or UNKNOWN_LOCATION
+
+
+def _get_geoip_reader():
+    """Open the offline IP->city database once, if one is configured and geoip2 is installed."""
+    global _geoip_reader
+    if _geoip_reader is not None or not GEOIP_CITY_DB:
+        return _geoip_reader
+    try:
+        import geoip2.database
+        _geoip_reader = geoip2.database.Reader(GEOIP_CITY_DB)
+    except ImportError:
+        logger.warning("GEOIP_CITY_DB is set but geoip2 is not installed; using ipinfo.io")
+    except Exception as e:
+        logger.error(f"Could not open GeoIP database {GEOIP_CITY_DB}: {e}")
+    return _geoip_reader
+
+
+def _get_public_ip():
+    """This host's public IP address, looked up once; None if the lookup fails."""
+    global _public_ip
+    if _public_ip is None:
+        try:
+            with metrics.api_call("ip_location"):
+                response = requests.get("https://ipinfo.io/ip", timeout=IP_LOOKUP_TIMEOUT)
+            if response.status_code == 200 and response.text.strip():
+                _public_ip = response.text.strip()
+        except Exception as e:
+            logger.warning(f"Error getting the public IP address: {e}")
+    return _public_ip
+
+
+def _lookup_offline(ip):
+    """
+    Resolve an IP address (or this host when ip is None) with the local GeoIP database,
+    or None if unavailable.
+    """
+    reader = _get_geoip_reader()
+    if reader is None:
+        return None
+    ip = ip or _get_public_ip()
+    if not ip:
+        return None
+    try:
+        record = reader.city(ip)
+        region = record.subdivisions.most_specific.iso_code if record.subdivisions else ""
+        return _format_location(record.city.name, region, record.country.iso_code)
+    except Exception as e:
+        logger.debug(f"Offline lookup failed for {ip}: {e}")
+        return None
+
+
+def _lookup_ipinfo(ip):
+    """Resolve an IP address (or this host when ip is None) with ipinfo.io."""
+    url = f"https://ipinfo.io/{ip}/json" if ip else "https://ipinfo.io/json"
+    try:
+        with metrics.api_call("ip_location"):
+            response = requests.get(url, timeout=IP_LOOKUP_TIMEOUT)
+        if response.status_code == 200:
+            data = response.json()
+            return _format_location(data.get('city'), data.get('region'), data.get('country'))
+        return None
+    except Exception as e:
+        logger.warning(f"Error getting location: {e}")
+        return None
+
+
+def lookup_ip_location(ip=None):
+    """
+    Resolve an IP address to a "City, Region, Country" string.
+
+    Results are cached for IP_LOCATION_TTL seconds so repeated requests never pay for
+    the network round trip more than once; failures only for IP_LOCATION_FAILURE_TTL
+    seconds, so the next requests retry soon.
+
+    Args:
+        ip: The IP address to resolve, or None for this host's public address
+
+    Returns:
+        str: The resolved location, or "Unknown Location"
+    """
+    cache_key = ip or "self"
+    now = time.monotonic()
+    with _ip_cache_lock:
+        cached = _ip_cache.get(cache_key)
+    if cached and cached[1] > now:
+        metrics.cache_lookup("ip_location", hit=True)
+        return cached[0]
+    metrics.cache_lookup("ip_location", hit=False)
+
+    location = _lookup_offline(ip) or _lookup_ipinfo(ip)
+    ttl = IP_LOCATION_TTL
+    if location is None:
+        location = UNKNOWN_LOCATION
+        ttl = IP_LOCATION_FAILURE_TTL
+
+    with _ip_cache_lock:
+        _ip_cache[cache_key] = (location, now + ttl)
+    return location
+
+
+def resolve_location(preferred=None):
+    """
+    Resolve the traveller's current location without hitting the network when possible.
+
+    Without a supplied location this falls back to the location of this host's public
+    IP address: the agents' messages do not carry the end user's address.
+
+    Args:
+        preferred: A location supplied with the request (e.g. TravelRequest.location
+            or a user-chosen origin); used as-is when present
+
+    Returns:
+        str: The resolved location
+    """
+    if preferred and str(preferred).strip():
+        return str(preferred).strip()
+    return lookup_ip_location()
+
+
+def clear_cache():
+    """Drop all cached IP lookups."""
+    with _ip_cache_lock:
+        _ip_cache.clear()
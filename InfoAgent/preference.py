@@ -66,17 +66,18 @@ class TravelPreferences:
     def to_json(self):
         return json.dumps(self.preferences, indent=4)
 
-# Example Usage
-preferences = TravelPreferences()
-preferences.fetch_preferences(
-    travel_style="adventure",
-    food_preference="vegan",
-    accommodation="airbnb",
-    transport_mode="bike",
-    time_preference="early_bird",
-    activity_intensity="moderate",
-    interests=["nature", "sports"],
-    custom_preferences="Love trying street food. Avoid crowded places."
-)
+if __name__ == "__main__":
+    # Example Usage
+    preferences = TravelPreferences()
+    preferences.fetch_preferences(
+        travel_style="adventure",
+        food_preference="vegan",
+        accommodation="airbnb",
+        transport_mode="bike",
+        time_preference="early_bird",
+        activity_intensity="moderate",
+        interests=["nature", "sports"],
+        custom_preferences="Love trying street food. Avoid crowded places."
+    )
 
-print(preferences.to_json())
+    print(preferences.to_json())
@@ -0,0 +1,265 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import dateutil.parser
+import dateutil.tz
+from dateutil.rrule import rrulestr
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Parsed recurrence rules kept by a RecurrenceCache, least recently used dropped first
+MAX_RULESETS = 1024
+
+
+def _utc_key(dt):
+    """Normalise an aware datetime so occurrences can be matched across time zones."""
+    return dt.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def _event_start(event):
+    """Parse an event's start, or None for all-day events."""
+    start = event.get('start', {}).get('dateTime')
+    return dateutil.parser.isoparse(start) if start else None
+
+
+def _overlaps(event, window_start, window_end):
+    """Check whether a timed event overlaps [window_start, window_end)."""
+    start = _event_start(event)
+    if start is None:
+        return False
+    end = dateutil.parser.isoparse(event['end']['dateTime'])
+    return start < window_end and end > window_start
+
+
+def _normalize_date_lines(lines, tz, dtstart):
+    """
+    Rewrite the RDATE/EXDATE lines of a recurrence so that every date is aware.
+
+    Dates without a time zone (floating times, or VALUE=DATE dates, which get the series'
+    start time) are taken in the event's time zone and written in UTC: dateutil cannot
+    compare naive dates with the aware occurrences of the rule, and does not accept a
+    TZID on RDATE lines.
+    """
+    normalized = []
+    for line in lines:
+        name, _, values = line.partition(":")
+        params = name.split(";")
+        if params[0].upper() not in ("RDATE", "EXDATE") or any(p.upper().startswith("TZID=") for p in params[1:]):
+            normalized.append(line)
+            continue
+        is_date = any(p.upper() == "VALUE=DATE" for p in params[1:])
+        utc_values = []
+        for value in values.split(","):
+            value = value.strip()
+            if not value.upper().endswith("Z"):
+                if is_date:
+                    value = f"{value[:8]}T{dtstart.strftime('%H%M%S')}"
+                local = datetime.strptime(value[:15], "%Y%m%dT%H%M%S").replace(tzinfo=tz)
+                value = local.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+            utc_values.append(value)
+        normalized.append(f"{params[0]}:{','.join(utc_values)}")
+    return normalized
+
+
+def parse_ruleset(master, default_timezone='UTC'):
+    """
+    Build a dateutil rruleset from a recurring event's RRULE/RDATE/EXDATE lines.
+
+    The series start is expressed in the event's own time zone so that occurrences
+    keep their wall-clock time across DST changes, as Google does.
+
+    Returns:
+        The rruleset, or None if the event is all-day or its rules can't be parsed
+    """
+    dtstart = _event_start(master)
+    if dtstart is None:
+        return None
+    tz = dateutil.tz.gettz(master['start'].get('timeZone') or default_timezone)
+    if tz is not None:
+        dtstart = dtstart.astimezone(tz)
+    try:
+        lines = _normalize_date_lines(master.get('recurrence', []), tz or dtstart.tzinfo, dtstart)
+        return rrulestr("\n".join(lines), dtstart=dtstart, forceset=True)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Could not parse recurrence of event {master.get('id')}: {e}")
+        return None
+
+
+class RecurrenceCache:
+    """
+    Caches unexpanded calendar listings and parsed recurrence rules so free time can be
+    computed for any window locally instead of asking Google to expand every series.
+
+    A listing holds the recurring masters, their exceptions (moved or cancelled
+    instances) and one-off events for a covered window. Any request inside that window
+    is answered without an API call until the listing is older than `ttl` seconds.
+    """
+
+    def __init__(self, ttl=15 * 60, max_rulesets=MAX_RULESETS):
+        self.ttl = ttl
+        self.max_rulesets = max_rulesets
+        self._listings = {}
+        # (event id, revision) -> ruleset, least recently used first
+        self._rulesets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_listing(self, calendar_id, window_start, window_end):
+        with self._lock:
+            listing = self._listings.get(calendar_id)
+        if not listing:
+            return None
+        if time.monotonic() - listing['fetched_at'] > self.ttl:
+            return None
+        if window_start < listing['window_start'] or window_end > listing['window_end']:
+            return None
+        return listing
+
+    def store(self, calendar_id, window_start, window_end, raw_events):
+        """Store a raw (singleEvents=False) listing for a window."""
+        masters, exceptions, singles = [], {}, []
+        for event in raw_events:
+            if event.get('recurrence'):
+                masters.append(event)
+            elif event.get('recurringEventId'):
+                exceptions.setdefault(event['recurringEventId'], []).append(event)
+            elif event.get('status') != 'cancelled':
+                singles.append(event)
+        listing = {
+            'fetched_at': time.monotonic(),
+            'window_start': window_start,
+            'window_end': window_end,
+            'masters': masters,
+            'exceptions': exceptions,
+            'singles': singles,
+        }
+        with self._lock:
+            self._listings[calendar_id] = listing
+        return listing
+
+    def _ruleset(self, master, default_timezone):
+        """Parse a master's rules once per revision of the event."""
+        key = (master.get('id'), master.get('updated'))
+        with self._lock:
+            if key in self._rulesets:
+                self._rulesets.move_to_end(key)
+                return self._rulesets[key]
+        ruleset = parse_ruleset(master, default_timezone)
+        with self._lock:
+            self._rulesets[key] = ruleset
+            while len(self._rulesets) > self.max_rulesets:
+                self._rulesets.popitem(last=False)
+        return ruleset
+
+    def expand_master(self, master, exceptions, window_start, window_end, default_timezone='UTC'):
+        """
+        Expand one recurring event into instance events overlapping the window.
+
+        Returns:
+            A list of event dicts shaped like singleEvents=True results, or None if the
+            series could not be expanded locally
+        """
+        ruleset = self._ruleset(master, default_timezone)
+        if ruleset is None:
+            return None
+
+        start = _event_start(master)
+        duration = dateutil.parser.isoparse(master['end']['dateTime']) - start
+
+        # Instances that were moved or cancelled are replaced by their exception events
+        overridden = set()
+        instances = []
+        for exception in exceptions:
+            original = exception.get('originalStartTime', {}).get('dateTime')
+            if original:
+                overridden.add(_utc_key(dateutil.parser.isoparse(original)))
+            if exception.get('status') != 'cancelled' and _overlaps(exception, window_start, window_end):
+                instances.append(exception)
+
+        try:
+            occurrences = ruleset.between(window_start - duration, window_end, inc=True)
+        except TypeError as e:
+            # Naive and aware dates that slipped through _normalize_date_lines
+            logger.warning(f"Could not expand recurrence of event {master.get('id')}: {e}")
+            return None
+        for occurrence in occurrences:
+            if _utc_key(occurrence) in overridden:
+                continue
+            occurrence_end = occurrence + duration
+            if occurrence_end <= window_start or occurrence >= window_end:
+                continue
+            instances.append({
+                'id': f"{master['id']}_{_utc_key(occurrence).strftime('%Y%m%dT%H%M%SZ')}",
+                'recurringEventId': master['id'],
+                'start': {'dateTime': occurrence.isoformat(), 'timeZone': master['start'].get('timeZone')},
+                'end': {'dateTime': occurrence_end.isoformat(), 'timeZone': master['end'].get('timeZone')},
+                'location': master.get('location', ''),
+                'transparency': master.get('transparency'),
+            })
+        return instances
+
+    def events_between(self, calendar_id, window_start, window_end, fetch_raw, fetch_instances,
+                       default_timezone='UTC'):
+        """
+        Get the expanded events overlapping a window.
+
+        Args:
+            calendar_id: The calendar the events belong to
+            window_start: Aware datetime, start of the window
+            window_end: Aware datetime, end of the window
+            fetch_raw: Callable(time_min, time_max) returning unexpanded events; only
+                called when the cached listing doesn't cover the window
+            fetch_instances: Callable(event_id, time_min, time_max) returning server-side
+                instances, used for series whose rules can't be expanded locally
+            default_timezone: Calendar time zone for events without their own
+
+        Returns:
+            A list of event dicts, equivalent to an events().list(singleEvents=True) result
+        """
+        listing = self._get_listing(calendar_id, window_start, window_end)
+        metrics.cache_lookup("calendar_listing", hit=listing is not None)
+        if listing is None:
+            raw_events = fetch_raw(window_start.isoformat(), window_end.isoformat())
+            listing = self.store(calendar_id, window_start, window_end, raw_events)
+
+        events = [event for event in listing['singles'] if _overlaps(event, window_start, window_end)]
+
+        # Exceptions whose series isn't in the listing are plain events
+        master_ids = {master['id'] for master in listing['masters']}
+        for master_id, exceptions in listing['exceptions'].items():
+            if master_id not in master_ids:
+                events.extend(e for e in exceptions
+                              if e.get('status') != 'cancelled' and _overlaps(e, window_start, window_end))
+
+        for master in listing['masters']:
+            if master.get('status') == 'cancelled':
+                continue
+            instances = self.expand_master(
+                master,
+                listing['exceptions'].get(master['id'], []),
+                window_start,
+                window_end,
+                default_timezone
+            )
+            if instances is None:
+                if _event_start(master) is None:
+                    continue  # All-day series never block time
+                instances = fetch_instances(master['id'], window_start.isoformat(), window_end.isoformat())
+            events.extend(instances)
+
+        return events
+
+    def invalidate(self, calendar_id=None):
+        """Forget cached listings (e.g. after writing to the calendar)."""
+        with self._lock:
+            if calendar_id is None:
+                self._listings.clear()
+            else:
+                self._listings.pop(calendar_id, None)
@@ -0,0 +1,134 @@
+"""
+Candidate pruning: score the places fetched for a free slot and keep the best few.
+
+Candidates that cannot fit into the slot are dropped first: those for which travelling
+from the slot's start to the place, visiting it and travelling on to the slot's end
+takes longer than the slot. On short gaps between meetings that is most of them.
+
+Every remaining candidate gets a score from its rating, its number of reviews, how well
+its price level fits the user's range and the detour it adds to the trip from the
+slot's start to its end. Each feature is computed as one column over all candidates and
+min-max normalized across them, so scores are relative to the pool. Candidates are then
+picked best first, with a penalty for each one already picked of the same primary type,
+so the planner sees a museum, a park and a landmark rather than three museums.
+
+Only as many candidates are kept as the slot can use: twice the number of visits that
+fit into it (so the planner still has a choice), at most max_candidates. That bounds the
+prompt and the distance matrix however many results the Places searches return.
+Outcomes are counted in exploreease_candidates_total{kind,result}.
+"""
+import os
+import sys
+import math
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+
+# Approximate visit durations, as in the planner prompt
+VISIT_MINUTES = {"attraction": 120, "lunch": 60, "dinner": 90}
+# Travel time allowed per visit when counting how many fit into a slot
+TRAVEL_ALLOWANCE_MINUTES = 30
+MAX_CANDIDATES = 5
+
+WEIGHTS = {"rating": 0.3, "popularity": 0.3, "price": 0.15, "detour": 0.25}
+# Subtracted from a candidate's score for every picked candidate of the same primary type
+DIVERSITY_PENALTY = 0.15
+GENERIC_TYPES = {"point_of_interest", "establishment", "tourist_attraction", "food"}
+
+CANDIDATES = metrics.Counter("exploreease_candidates_total",
+                             "Slot candidates kept, pruned, or dropped as unreachable.", ["kind", "result"])
+
+
+def _normalized(column):
+    low, high = min(column), max(column)
+    if high == low:
+        return [1.0] * len(column)
+    return [(value - low) / (high - low) for value in column]
+
+
+def _price_fit(price_level, min_price, max_price):
+    if min_price is None and max_price is None:
+        return 1.0
+    if price_level is None:
+        return 0.5
+    low = min_price if min_price is not None else 0
+    high = max_price if max_price is not None else 4
+    gap = max(low - price_level, price_level - high, 0)
+    return max(0.0, 1.0 - 0.5 * gap)
+
+
+def primary_type(place):
+    """The most specific type of a place ("museum" rather than "point_of_interest")."""
+    for place_type in place.types:
+        if place_type not in GENERIC_TYPES:
+            return place_type
+    return place.types[0] if place.types else None
+
+
+def score_candidates(places, start, end, travel_minutes, min_price=None, max_price=None):
+    """
+    Score places for a slot from `start` to `end` ({"lat", "lng"} dicts).
+
+    travel_minutes(origin, destination) estimates the travel time between two points,
+    like map_func.estimate_travel_time.
+
+    Returns:
+        List of scores between 0 and 1, in the order of places
+    """
+    if not places:
+        return []
+    known_ratings = [place.rating for place in places if place.rating is not None]
+    mean_rating = sum(known_ratings) / len(known_ratings) if known_ratings else 0.0
+    direct = travel_minutes(start, end)
+
+    columns = {
+        "rating": _normalized([place.rating if place.rating is not None else mean_rating for place in places]),
+        "popularity": _normalized([math.log1p(place.user_ratings_total) for place in places]),
+        "price": [_price_fit(place.price_level, min_price, max_price) for place in places],
+        # Shorter detours score higher
+        "detour": [1.0 - value for value in _normalized([
+            travel_minutes(start, place.coordinates) + travel_minutes(place.coordinates, end) - direct
+            for place in places
+        ])],
+    }
+    return [sum(WEIGHTS[name] * columns[name][i] for name in WEIGHTS) for i in range(len(places))]
+
+
+def fits_in_slot(place, start, end, slot_minutes, kind, travel_minutes):
+    """Whether start -> place -> end, with the visit, takes no longer than the slot."""
+    coordinates = place.coordinates
+    return (travel_minutes(start, coordinates) + VISIT_MINUTES[kind] + travel_minutes(coordinates, end)
+            <= slot_minutes)
+
+
+def candidates_for_slot(slot_minutes, kind, max_candidates=MAX_CANDIDATES):
+    """How many candidates of a kind ("attraction", "lunch" or "dinner") a slot can use."""
+    fits = int(slot_minutes // (VISIT_MINUTES[kind] + TRAVEL_ALLOWANCE_MINUTES))
+    return min(max_candidates, max(1, 2 * fits))
+
+
+def prune_candidates(places, start, end, slot_minutes, kind, travel_minutes, min_price=None, max_price=None,
+                     max_candidates=MAX_CANDIDATES):
+    """
+    Keep the best places of a kind for a slot, see the module docstring.
+
+    Returns:
+        List of at most candidates_for_slot(slot_minutes, kind, max_candidates) places
+        that fit into the slot, best first
+    """
+    reachable = [place for place in places if fits_in_slot(place, start, end, slot_minutes, kind, travel_minutes)]
+    scores = score_candidates(reachable, start, end, travel_minutes, min_price, max_price)
+    remaining = list(zip(scores, reachable))
+    picked = []
+    picked_types = {}
+    for _ in range(min(candidates_for_slot(slot_minutes, kind, max_candidates), len(remaining))):
+        best = max(range(len(remaining)), key=lambda i: remaining[i][0]
+                   - DIVERSITY_PENALTY * picked_types.get(primary_type(remaining[i][1]), 0))
+        _, place = remaining.pop(best)
+        picked.append(place)
+        place_type = primary_type(place)
+        picked_types[place_type] = picked_types.get(place_type, 0) + 1
+    CANDIDATES.labels(kind, "kept").inc(len(picked))
+    CANDIDATES.labels(kind, "pruned").inc(len(reachable) - len(picked))
+    CANDIDATES.labels(kind, "unreachable").inc(len(places) - len(reachable))
+    return picked
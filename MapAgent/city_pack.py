@@ -0,0 +1,441 @@
+"""
+Offline city packs: prefetched attractions and restaurants for a city, memory-mapped.
+
+A pack is built once per city with the same Nearby Search queries get_city_attractions
+and get_restaurants make at request time, run over a grid of centers:
+
+    python city_pack.py build --city "Tokyo" --radius-km 15 \\
+        --attraction-keywords museums parks --restaurant-keywords sushi ramen \\
+        --output packs/tokyo.pack
+    python city_pack.py info packs/tokyo.pack
+    python city_pack.py query packs/tokyo.pack 35.68 139.76 1500 --kind restaurant
+
+At start-up MapAgent maps every *.pack file in CITY_PACK_DIR. get_city_attractions and
+get_restaurants then answer from a pack, without calling the Places API, when the whole
+search circle lies inside the pack's area, the keywords were prefetched (compared with
+plurals folded, "museums" = "Museum") and none of the build's searches overlapping the
+circle was cut short. Other queries go to the API as before.
+
+File layout (little-endian): a header with a JSON description of the columns, then one
+array per column, 8-byte aligned (the header's offsets count from the first column).
+Rows are sorted by latitude. Numbers are fixed-width arrays (lat/lng float64, rating
+float32 with NaN for none, reviews uint32, price int8 with -1 for none, kind uint8).
+Each string column is a uint32 offsets array (rows + 1) plus a UTF-8 blob. Columns are read through memoryviews of the mmap, so the file is
+shared by every process that maps it and a query copies out only the rows it returns.
+"""
+import os
+import sys
+import json
+import math
+import mmap
+import array
+import struct
+import bisect
+import logging
+import argparse
+import threading
+from datetime import datetime
+
+from place import Place
+from spatial_index import distance_m, METERS_PER_DEGREE_LAT
+from query_planner import keyword_tokens
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rate_limit
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"EXPLPACK"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+ALIGNMENT = 8
+KINDS = ["attraction", "restaurant"]
+# Tag of rows found by the searches without a keyword
+NO_KEYWORD = "*"
+NUMERIC_COLUMNS = [("lat", "d"), ("lng", "d"), ("rating", "f"), ("reviews", "I"), ("price", "b"), ("kind", "B")]
+STRING_COLUMNS = ["place_id", "name", "vicinity", "photo_reference", "types", "keywords"]
+def keyword_key(keyword):
+    """The form keywords are matched in: folded tokens ("Art Museums" -> "art museum"), NO_KEYWORD for none."""
+    return " ".join(sorted(keyword_tokens(keyword)))
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_pack(path, rows, metadata):
+    """
+    Write a pack file.
+
+    Args:
+        path: Output file
+        rows: List of (Place, kind, keywords) with kind in KINDS and keywords a set of
+            the search keywords (NO_KEYWORD for none) that returned the place
+        metadata: JSON-serializable description (city, center, radius_m, keywords, ...)
+    """
+    rows = sorted(rows, key=lambda row: (row[0].lat, row[0].lng))
+    values = {
+        "lat": [place.lat for place, _, _ in rows],
+        "lng": [place.lng for place, _, _ in rows],
+        "rating": [place.rating if place.rating is not None else math.nan for place, _, _ in rows],
+        "reviews": [place.user_ratings_total for place, _, _ in rows],
+        "price": [place.price_level if place.price_level is not None else -1 for place, _, _ in rows],
+        "kind": [KINDS.index(kind) for _, kind, _ in rows],
+    }
+    strings = {
+        "place_id": [place.place_id or "" for place, _, _ in rows],
+        "name": [place.name for place, _, _ in rows],
+        "vicinity": [place.vicinity or "" for place, _, _ in rows],
+        "photo_reference": [place.photo_reference or "" for place, _, _ in rows],
+        "types": [",".join(place.types) for place, _, _ in rows],
+        "keywords": ["|".join(sorted(keywords)) for _, _, keywords in rows],
+    }
+
+    chunks = []
+    for name, typecode in NUMERIC_COLUMNS:
+        chunks.append((name, typecode, array.array(typecode, values[name])))
+    for name in STRING_COLUMNS:
+        encoded = [value.encode("utf-8") for value in strings[name]]
+        offsets = array.array("I", [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        chunks.append((f"{name}.offsets", "I", offsets))
+        chunks.append((f"{name}.data", "B", array.array("B", b"".join(encoded))))
+    if sys.byteorder == "big":
+        for _, _, column in chunks:
+            column.byteswap()
+
+    description = {"count": len(rows), "metadata": metadata, "columns": {}}
+    offset = 0
+    for name, typecode, column in chunks:
+        description["columns"][name] = [offset, typecode, len(column)]
+        offset = _aligned(offset + len(column) * column.itemsize)
+    encoded_description = json.dumps(description).encode("utf-8")
+    data_start = _aligned(HEADER.size + len(encoded_description))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(encoded_description)))
+        f.write(encoded_description)
+        for name, _, column in chunks:
+            f.write(b"\0" * (data_start + description["columns"][name][0] - f.tell()))
+            column.tofile(f)
+    # Workers that already mapped the old file keep reading it until they reload
+    os.replace(temporary, path)
+
+
+class CityPack:
+    """A memory-mapped pack file."""
+
+    def __init__(self, path):
+        if sys.byteorder == "big":
+            raise RuntimeError("City packs are little-endian")
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, description_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} city pack")
+        description = json.loads(self._map[HEADER.size:HEADER.size + description_size])
+        self.count = description["count"]
+        self.metadata = description["metadata"]
+        data_start = _aligned(HEADER.size + description_size)
+        self._view = memoryview(self._map)
+        self._columns = {}
+        for name, (offset, typecode, length) in description["columns"].items():
+            start = data_start + offset
+            self._columns[name] = self._view[start:start + length * array.array(typecode).itemsize].cast(typecode)
+        self.center = self.metadata["center"]
+        self.radius_m = self.metadata["radius_m"]
+        self.keywords = {kind: {keyword_key(keyword) for keyword in self.metadata["keywords"].get(kind, [])}
+                         | {NO_KEYWORD} for kind in KINDS}
+        # Searches of the build that had more results than Google serves
+        self.incomplete = self.metadata.get("incomplete", [])
+        self._row_keywords = {}
+
+    def close(self):
+        """Unmap the file; only safe once no other thread is querying the pack."""
+        for column in self._columns.values():
+            column.release()
+        self._columns = {}
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def _string(self, column, index):
+        offsets = self._columns[f"{column}.offsets"]
+        return bytes(self._columns[f"{column}.data"][offsets[index]:offsets[index + 1]]).decode("utf-8")
+
+    def place(self, index):
+        """Build the Place for one row."""
+        rating = self._columns["rating"][index]
+        price = self._columns["price"][index]
+        types = self._string("types", index)
+        return Place(
+            place_id=self._string("place_id", index) or None,
+            name=self._string("name", index),
+            lat=self._columns["lat"][index],
+            lng=self._columns["lng"][index],
+            rating=None if math.isnan(rating) else round(rating, 1),
+            user_ratings_total=self._columns["reviews"][index],
+            price_level=None if price < 0 else price,
+            types=tuple(types.split(",")) if types else (),
+            vicinity=self._string("vicinity", index) or None,
+            photo_reference=self._string("photo_reference", index) or None,
+        )
+
+    def covers(self, lat, lng, radius_m):
+        """Whether the whole search circle lies inside the area the pack was built for."""
+        return distance_m(self.center["lat"], self.center["lng"], lat, lng) + radius_m <= self.radius_m
+
+    def can_answer(self, kind, keywords, lat=None, lng=None, radius_m=None):
+        """
+        Whether every keyword (None for a search without one) was prefetched for kind
+        and, given a search circle, no build search of those keywords that overlaps it
+        was cut short.
+        """
+        wanted = {keyword_key(keyword) for keyword in keywords}
+        if not wanted <= self.keywords[kind]:
+            return False
+        if lat is None:
+            return True
+        return not any(search["kind"] == kind and search["keyword"] in wanted
+                       and distance_m(search["lat"], search["lng"], lat, lng) < search["radius_m"] + radius_m
+                       for search in self.incomplete)
+
+    def _keywords_of(self, index):
+        raw = self._string("keywords", index)
+        keys = self._row_keywords.get(raw)
+        if keys is None:
+            keys = self._row_keywords[raw] = {keyword_key(keyword) for keyword in raw.split("|")}
+        return keys
+
+    def nearby(self, lat, lng, radius_m, kind, keywords=(None,), min_price=None, max_price=None):
+        """
+        Places of one kind within radius_m of a point, found by any of the keywords.
+
+        Returns:
+            List of Place records, unsorted
+        """
+        lats, lngs = self._columns["lat"], self._columns["lng"]
+        kinds, prices = self._columns["kind"], self._columns["price"]
+        kind_code = KINDS.index(kind)
+        wanted = {keyword_key(keyword) for keyword in keywords}
+        # Rows are sorted by latitude: only the band that can be in range is scanned
+        band = radius_m / METERS_PER_DEGREE_LAT
+        start = bisect.bisect_left(lats, lat - band)
+        end = bisect.bisect_right(lats, lat + band)
+        places = []
+        for index in range(start, end):
+            if kinds[index] != kind_code:
+                continue
+            price = prices[index]
+            if price >= 0 and ((min_price is not None and price < min_price)
+                               or (max_price is not None and price > max_price)):
+                continue
+            if distance_m(lat, lng, lats[index], lngs[index]) > radius_m:
+                continue
+            if wanted.isdisjoint(self._keywords_of(index)):
+                continue
+            places.append(self.place(index))
+        return places
+
+
+_packs = []
+_packs_loaded = False
+_packs_lock = threading.RLock()
+
+
+def load_packs(directory):
+    """
+    Map every *.pack file in a directory, replacing the packs loaded before.
+
+    Replaced packs are not closed, since other threads may still be reading them; their
+    mappings go away once the last reference does.
+    """
+    global _packs, _packs_loaded
+    packs = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".pack"):
+            continue
+        try:
+            packs.append(CityPack(os.path.join(directory, name)))
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load city pack {name}: {e}")
+    with _packs_lock:
+        _packs, _packs_loaded = packs, True
+    for pack in packs:
+        logger.info(f"Loaded city pack {pack.path}: {pack.metadata.get('city')}, {pack.count} places")
+    return packs
+
+
+def load_packs_from_env():
+    """Load the packs in CITY_PACK_DIR, if it is set."""
+    global _packs_loaded
+    directory = os.environ.get("CITY_PACK_DIR")
+    if directory and os.path.isdir(directory):
+        return load_packs(directory)
+    with _packs_lock:
+        _packs_loaded = True
+    return []
+
+
+def loaded_packs():
+    """
+    The loaded packs. They are loaded from CITY_PACK_DIR on first use when MapAgent did
+    not load them at start-up.
+    """
+    if not _packs_loaded:
+        with _packs_lock:
+            if not _packs_loaded:
+                load_packs_from_env()
+    return _packs
+
+
+def find_pack(lat, lng, radius_m, kind, keywords):
+    """The pack that can answer a search, if any."""
+    for pack in loaded_packs():
+        if pack.covers(lat, lng, radius_m) and pack.can_answer(kind, keywords, lat, lng, radius_m):
+            return pack
+    return None
+
+
+def grid_centers(center_lat, center_lng, radius_m, step_m):
+    """Centers of a square grid with spacing step_m covering a circle."""
+    lat_step = step_m / METERS_PER_DEGREE_LAT
+    lng_step = step_m / (METERS_PER_DEGREE_LAT * math.cos(math.radians(center_lat)))
+    steps = int(math.ceil(radius_m / step_m))
+    centers = []
+    for i in range(-steps, steps + 1):
+        for j in range(-steps, steps + 1):
+            lat, lng = center_lat + i * lat_step, center_lng + j * lng_step
+            # Keep cells that reach into the circle
+            if distance_m(center_lat, center_lng, lat, lng) <= radius_m + step_m:
+                centers.append((lat, lng))
+    return centers
+
+
+def build(city, radius_m, attraction_step_m, restaurant_step_m, attraction_keywords, restaurant_keywords,
+          output, dry_run=False):
+    """
+    Prefetch a city with the request-time queries and write its pack.
+
+    The searches run exhaustively (see map_utils.exhaustive_searches): every page,
+    every keyword x type. Those that still had more results than Google serves are
+    listed in the pack's metadata, and the pack does not answer searches overlapping
+    them.
+    """
+    global _packs_loaded
+    # Always query the API while building
+    _packs_loaded = True
+    import map_utils
+
+    lat, lng = map_utils.geocode_location(city)
+    if lat is None:
+        raise SystemExit(f"Could not geocode {city}")
+    attraction_centers = grid_centers(lat, lng, radius_m, attraction_step_m)
+    restaurant_centers = grid_centers(lat, lng, radius_m, restaurant_step_m)
+    # A circle of radius step/sqrt(2) around each center covers its whole grid cell
+    attraction_radius = int(attraction_step_m / math.sqrt(2)) + 1
+    restaurant_radius = int(restaurant_step_m / math.sqrt(2)) + 1
+    attraction_searches = [None] + [[keyword] for keyword in attraction_keywords]
+    restaurant_searches = [None] + list(restaurant_keywords)
+    calls = (len(attraction_centers) * len(attraction_searches) * len(map_utils.ATTRACTION_PLACE_TYPES)
+             + len(restaurant_centers) * len(restaurant_searches))
+    print(f"{city}: {len(attraction_centers)} attraction and {len(restaurant_centers)} restaurant centers, "
+          f"{calls} Nearby Searches of up to {map_utils.GOOGLE_MAX_PAGES} pages each")
+    if dry_run:
+        return None
+
+    found = {}
+    incomplete = []
+
+    def add(search, kind, keyword, center_lat, center_lng, radius):
+        with map_utils.exhaustive_searches() as cut_short:
+            places = search()
+        for place in places:
+            if not place.place_id:
+                continue
+            entry = found.setdefault((kind, place.place_id), [place, kind, set()])
+            entry[2].add(keyword or NO_KEYWORD)
+        if cut_short:
+            incomplete.append({"kind": kind, "keyword": keyword_key(keyword), "lat": center_lat, "lng": center_lng,
+                               "radius_m": radius})
+
+    for number, (center_lat, center_lng) in enumerate(attraction_centers, 1):
+        for keywords in attraction_searches:
+            add(lambda: map_utils.get_city_attractions(center_lat, center_lng, city_name=city,
+                                                       radius=attraction_radius, attractions_keywords=keywords),
+                "attraction", keywords[0] if keywords else None, center_lat, center_lng, attraction_radius)
+        print(f"Attractions: {number}/{len(attraction_centers)} centers, {len(found)} places so far")
+    for number, (center_lat, center_lng) in enumerate(restaurant_centers, 1):
+        for keyword in restaurant_searches:
+            add(lambda: map_utils.get_restaurants(center_lat, center_lng, radius=restaurant_radius, keyword=keyword),
+                "restaurant", keyword, center_lat, center_lng, restaurant_radius)
+        print(f"Restaurants: {number}/{len(restaurant_centers)} centers, {len(found)} places so far")
+    if incomplete:
+        print(f"Warning: {len(incomplete)} searches had more results than Google serves; the pack will not "
+              f"answer searches overlapping them. A smaller step makes them complete.")
+
+    metadata = {
+        "city": city,
+        "center": {"lat": lat, "lng": lng},
+        "radius_m": radius_m,
+        "keywords": {"attraction": [NO_KEYWORD] + list(attraction_keywords),
+                     "restaurant": [NO_KEYWORD] + list(restaurant_keywords)},
+        "incomplete": incomplete,
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    write_pack(output, list(found.values()), metadata)
+    print(f"Wrote {len(found)} places to {output} ({os.path.getsize(output) / 1024:.0f} KiB)")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect offline city packs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Prefetch a city into a pack file")
+    build_parser.add_argument("--city", required=True)
+    build_parser.add_argument("--radius-km", type=float, default=15)
+    build_parser.add_argument("--attraction-step-km", type=float, default=5,
+                              help="Grid spacing of the attraction searches")
+    build_parser.add_argument("--restaurant-step-km", type=float, default=1.5,
+                              help="Grid spacing of the restaurant searches (20 results per search)")
+    build_parser.add_argument("--attraction-keywords", nargs="*", default=[])
+    build_parser.add_argument("--restaurant-keywords", nargs="*", default=[])
+    build_parser.add_argument("--output", required=True)
+    build_parser.add_argument("--dry-run", action="store_true", help="Only print how many calls it would make")
+
+    info_parser = commands.add_parser("info", help="Describe a pack file")
+    info_parser.add_argument("pack")
+
+    query_parser = commands.add_parser("query", help="Search a pack file")
+    query_parser.add_argument("pack")
+    query_parser.add_argument("lat", type=float)
+    query_parser.add_argument("lng", type=float)
+    query_parser.add_argument("radius_m", type=float)
+    query_parser.add_argument("--kind", choices=KINDS, default="attraction")
+    query_parser.add_argument("--keyword", default=None)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        # Prefetching runs in the background lane of the rate limiter
+        with rate_limit.background():
+            build(args.city, args.radius_km * 1000, args.attraction_step_km * 1000, args.restaurant_step_km * 1000,
+                  args.attraction_keywords, args.restaurant_keywords, args.output, args.dry_run)
+    elif args.command == "info":
+        pack = CityPack(args.pack)
+        print(json.dumps(dict(pack.metadata, places=pack.count), indent=2))
+    else:
+        pack = CityPack(args.pack)
+        places = pack.nearby(args.lat, args.lng, args.radius_m, args.kind, [args.keyword])
+        places.sort(key=lambda place: place.user_ratings_total, reverse=True)
+        for place in places:
+            print(f"{place.name:<50} {place.rating or '-':>4} {place.user_ratings_total:>7}  {place.vicinity or ''}")
+        print(f"{len(places)} places")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,25 @@
 import json
 import logging
 import os
+import contextvars
 from typing import List, Dict, Any
-from map_utils import *
+from map_utils import (geocode_location, get_city_attractions, get_restaurants_along_route, adaptive_search,
+                       search_radius)
+from place import Place
+from candidate_pruning import prune_candidates
 import sys
 sys.path.append(os.path.abspath("..")) 
-from models import TravelPlan, TravelRequest, ItineraryResponse
 from llm_utils import get_claude_response
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Places the attraction and restaurant searches of a slot aim for; their radius adapts to
+# how dense the area is
+ATTRACTION_TARGET = 15
+RESTAURANT_TARGET = 15
+
 def haversine_distance(lat1, lon1, lat2, lon2):
     """Calculate the great circle distance between two points in kilometers."""
     from math import radians, cos, sin, asin, sqrt
@@ -59,6 +70,15 @@ def estimate_travel_time(origin_coords, dest_coords, avg_speed_kmh=30):
 
 def extract_location_data(place):
     """Extract standardized location data from a place object."""
+    if isinstance(place, Place):
+        return {
+            "name": place.name,
+            "coordinates": place.coordinates,
+            "type": "unknown",
+            "rating": float(place.rating or 0.0),
+            "price_level": place.price_level,
+            "place_data": place  # Keep a reference to the record (not a copy)
+        }
     try:
         # Handle Google Places API format
         if "geometry" in place and "location" in place["geometry"]:
@@ -98,6 +118,45 @@ def extract_location_data(place):
             "place_data": {}
         }
     
+def collect_unique_locations(itinerary_data):
+    """Gather slot endpoints, attractions and restaurants as location records, unique by name."""
+    all_locations = []
+    
+    # Add start and end locations from each time slot
+    for slot in itinerary_data["free_time_slots"]:
+        all_locations.append(extract_location_data({
+            "name": slot["start_location"]["name"],
+            "coordinates": slot["start_location"]["coordinates"],
+            "type": "location"
+        }))
+        all_locations.append(extract_location_data({
+            "name": slot["end_location"]["name"],
+            "coordinates": slot["end_location"]["coordinates"],
+            "type": "location"
+        }))
+    
+    # Add attractions
+    for attraction in itinerary_data["attractions"]:
+        all_locations.append(extract_location_data(attraction))
+    
+    # Add restaurants
+    for meal_type in ["lunch", "dinner"]:
+        for restaurant in itinerary_data["restaurants"][meal_type]:
+            restaurant_data = extract_location_data(restaurant)
+            restaurant_data["type"] = meal_type
+            all_locations.append(restaurant_data)
+    
+    # Remove duplicates by name
+    unique_locations = []
+    location_names = set()
+    
+    for location in all_locations:
+        if location["name"] not in location_names:
+            unique_locations.append(location)
+            location_names.add(location["name"])
+    
+    return unique_locations
+
 def create_distance_matrix(locations):
     """Create a matrix of estimated travel times between all locations."""
     distance_matrix = {}
@@ -167,10 +226,12 @@ IMPORTANT: Your response must be a valid JSON array containing the itinerary ite
         # Since get_claude_response is not async, we use run_in_executor to avoid blocking
         import asyncio
         
-        # Run the function in the default executor
+        # Run the function in the default executor (in a copy of the context, so the
+        # call stays in the current trace)
+        context = contextvars.copy_context()
         response_text = await asyncio.get_event_loop().run_in_executor(
             None, 
-            lambda: get_claude_response(full_prompt, model="claude-3-opus-20240229", max_tokens=4096)
+            lambda: context.run(get_claude_response, full_prompt, model="claude-3-opus-20240229", max_tokens=4096)
         )
         
         # Parse the response
@@ -190,10 +251,10 @@ def create_itinerary_prompt(itinerary_data, distance_matrix):
     attractions = []
     for a in itinerary_data["attractions"]:
         attraction_data = {
-            "name": a["name"],
-            "rating": a.get("rating", "Not rated"),
-            "types": a.get("types", []),
-            "vicinity": a.get("vicinity", "Unknown")
+            "name": a.name,
+            "rating": a.rating if a.rating is not None else "Not rated",
+            "types": list(a.types),
+            "vicinity": a.vicinity if a.vicinity is not None else "Unknown"
         }
         attractions.append(attraction_data)
     
@@ -202,10 +263,10 @@ def create_itinerary_prompt(itinerary_data, distance_matrix):
     lunch_places = []
     for r in itinerary_data["restaurants"]["lunch"]:
         lunch_data = {
-            "name": r["name"],
-            "rating": r.get("rating", "Not rated"),
-            "price_level": r.get("price_level", "Unknown"),
-            "vicinity": r.get("vicinity", "Unknown")
+            "name": r.name,
+            "rating": r.rating if r.rating is not None else "Not rated",
+            "price_level": r.price_level if r.price_level is not None else "Unknown",
+            "vicinity": r.vicinity if r.vicinity is not None else "Unknown"
         }
         lunch_places.append(lunch_data)
     
@@ -214,10 +275,10 @@ def create_itinerary_prompt(itinerary_data, distance_matrix):
     dinner_places = []
     for r in itinerary_data["restaurants"]["dinner"]:
         dinner_data = {
-            "name": r["name"],
-            "rating": r.get("rating", "Not rated"),
-            "price_level": r.get("price_level", "Unknown"),
-            "vicinity": r.get("vicinity", "Unknown")
+            "name": r.name,
+            "rating": r.rating if r.rating is not None else "Not rated",
+            "price_level": r.price_level if r.price_level is not None else "Unknown",
+            "vicinity": r.vicinity if r.vicinity is not None else "Unknown"
         }
         dinner_places.append(dinner_data)
     
@@ -428,7 +489,7 @@ def post_process_itinerary(itinerary, unique_locations):
         # Process attractions and restaurants (lunch/dinner)
         if location_name in location_map:
             location_data = location_map[location_name]
-            place_data = location_data.get("place_data", {})
+            place = location_data.get("place_data")
             
             # Add rating if missing
             if "rating" not in item and "rating" in location_data:
@@ -438,18 +499,22 @@ def post_process_itinerary(itinerary, unique_locations):
             if item["type"] in ["lunch", "dinner"] and "price_level" not in item and "price_level" in location_data:
                 item["price_level"] = location_data["price_level"]
             
+            # Only places from the Places API (not slot start/end points) have these details
+            if not isinstance(place, Place):
+                continue
+            
             # Add attraction_type for attractions if missing
-            if item["type"] == "attraction" and "attraction_type" not in item and "types" in place_data:
+            if item["type"] == "attraction" and "attraction_type" not in item:
                 # Use the first type from the types list
-                item["attraction_type"] = place_data["types"][0] if place_data.get("types") else "point_of_interest"
+                item["attraction_type"] = place.types[0] if place.types else "point_of_interest"
             
             # Add vicinity if missing
-            if "vicinity" not in item and "vicinity" in place_data:
-                item["vicinity"] = place_data["vicinity"]
+            if "vicinity" not in item and place.vicinity is not None:
+                item["vicinity"] = place.vicinity
             
             # Add image reference if missing
-            if "image_reference" not in item and "photos" in place_data and place_data.get("photos"):
-                item["image_reference"] = place_data["photos"][0].get("photo_reference", "")
+            if "image_reference" not in item and place.photo_reference is not None:
+                item["image_reference"] = place.photo_reference
     
     return itinerary
 
@@ -464,6 +529,8 @@ def collect_itinerary_data(free_times, attraction_prefs, event_prefs, lunch_pref
             "dinner": []
         }
     }
+    # place_ids already added to each list (Place records compare by value, which is slower)
+    seen = {"attractions": set(), "lunch": set(), "dinner": set()}
     
     # Process each free time slot
     for time_slot in free_times:
@@ -499,38 +566,59 @@ def collect_itinerary_data(free_times, attraction_prefs, event_prefs, lunch_pref
         }
         
         itinerary_data["free_time_slots"].append(slot_data)
+        slot_start = slot_data["start_location"]["coordinates"]
+        slot_end = slot_data["end_location"]["coordinates"]
+        slot_minutes = (end_time - start_time).total_seconds() / 60
         
         # Fetch attractions based on preferences
+        slot_attractions = []
         if attraction_prefs and attraction_prefs[0]:
-            attractions = get_city_attractions(
-                float(start_lat), float(start_lng),
-                city_name="Current Location",
-                radius=10000,
-                attractions_keywords=attraction_prefs[0],
-                sort_by="reviews",
+            keywords = attraction_prefs[0]
+            attractions = adaptive_search(
+                lambda radius: get_city_attractions(
+                    float(start_lat), float(start_lng),
+                    city_name="Current Location",
+                    radius=radius,
+                    attractions_keywords=keywords,
+                    sort_by="reviews",
+                ),
+                start_lat, start_lng, "attraction", " ".join(keywords) if isinstance(keywords, list) else None,
+                target=ATTRACTION_TARGET, default_radius=10000, min_radius=2000, max_radius=25000,
             )
             
-            for attraction in attractions[:5]:  # Limit to top 5 attractions
-                if attraction not in itinerary_data["attractions"]:
-                    if isinstance(attraction, dict):
-                        itinerary_data["attractions"].append(attraction)
+            # Keep the best few for the slot (at most 5)
+            slot_attractions = prune_candidates(attractions, slot_start, slot_end, slot_minutes, "attraction",
+                                                estimate_travel_time)
+            for attraction in slot_attractions:
+                if attraction.place_id not in seen["attractions"]:
+                    seen["attractions"].add(attraction.place_id)
+                    itinerary_data["attractions"].append(attraction)
+        
+        # Meals can be anywhere on the way: near the start, an attraction or the end
+        route = [(start_lat, start_lng)] + [(a.lat, a.lng) for a in slot_attractions] + [(end_lat, end_lng)]
         
         # Fetch lunch options if applicable
         lunch_start = datetime(start_time.year, start_time.month, start_time.day, 11, 30)
         lunch_end = datetime(start_time.year, start_time.month, start_time.day, 14, 0)
         
         if start_time <= lunch_end and end_time >= lunch_start and lunch_prefs:
-            lunch_places = get_restaurants(
-                start_lat, start_lng,
-                radius=1500,
+            min_price = lunch_prefs[1] if lunch_prefs[1] <= 4 else lunch_prefs[1] // 20
+            max_price = lunch_prefs[2] if lunch_prefs[2] <= 4 else 4
+            lunch_places = get_restaurants_along_route(
+                route,
+                radius=search_radius(start_lat, start_lng, "restaurant", lunch_prefs[0], RESTAURANT_TARGET,
+                                     default_radius=1500, min_radius=500, max_radius=5000),
                 meal_type="lunch",
-                min_price=lunch_prefs[1] if lunch_prefs[1] <= 4 else lunch_prefs[1] // 20,
-                max_price=lunch_prefs[2] if lunch_prefs[2] <= 4 else 4,
+                min_price=min_price,
+                max_price=max_price,
                 keyword=lunch_prefs[0],
             )
+            lunch_places = prune_candidates(lunch_places, slot_start, slot_end, slot_minutes, "lunch",
+                                            estimate_travel_time, min_price, max_price)
             
-            for place in lunch_places[:5]:  # Limit to top 5 lunch places
-                if place not in itinerary_data["restaurants"]["lunch"]:
+            for place in lunch_places:
+                if place.place_id not in seen["lunch"]:
+                    seen["lunch"].add(place.place_id)
                     itinerary_data["restaurants"]["lunch"].append(place)
         
         # Fetch dinner options if applicable
@@ -538,17 +626,23 @@ def collect_itinerary_data(free_times, attraction_prefs, event_prefs, lunch_pref
         dinner_end = datetime(start_time.year, start_time.month, start_time.day, 21, 0)
         
         if start_time <= dinner_end and end_time >= dinner_start and dinner_prefs:
-            dinner_places = get_restaurants(
-                start_lat, start_lng,
-                radius=1500,
+            min_price = dinner_prefs[1] if dinner_prefs[1] <= 4 else dinner_prefs[1] // 20
+            max_price = dinner_prefs[2] if dinner_prefs[2] <= 4 else 4
+            dinner_places = get_restaurants_along_route(
+                route,
+                radius=search_radius(start_lat, start_lng, "restaurant", dinner_prefs[0], RESTAURANT_TARGET,
+                                     default_radius=1500, min_radius=500, max_radius=5000),
                 meal_type="dinner",
-                min_price=dinner_prefs[1] if dinner_prefs[1] <= 4 else dinner_prefs[1] // 20,
-                max_price=dinner_prefs[2] if dinner_prefs[2] <= 4 else 4,
+                min_price=min_price,
+                max_price=max_price,
                 keyword=dinner_prefs[0],
             )
+            dinner_places = prune_candidates(dinner_places, slot_start, slot_end, slot_minutes, "dinner",
+                                             estimate_travel_time, min_price, max_price)
             
-            for place in dinner_places[:5]:  # Limit to top 5 dinner places
-                if place not in itinerary_data["restaurants"]["dinner"]:
+            for place in dinner_places:
+                if place.place_id not in seen["dinner"]:
+                    seen["dinner"].add(place.place_id)
                     itinerary_data["restaurants"]["dinner"].append(place)
     
     return itinerary_data
\ No newline at end of file
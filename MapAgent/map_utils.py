@@ -2,23 +2,195 @@ import os
 import requests
 import time
 import json
+import math
 import logging
+import threading
+import contextvars
+from contextlib import contextmanager
 
 from datetime import datetime, timedelta
-import googlemaps
-from geopy.geocoders  import Nominatim
-from uagents import Agent, Context, Protocol
-from uagents.crypto import Identity
 
 from dotenv import load_dotenv
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+import rate_limit
+from singleflight import SingleFlight
+from place import Place
+import city_pack
+from spatial_index import catalog, densities, distance_m, snap_radius, PAGE_SIZE
+from query_planner import planner
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def get_restaurants(latitude, longitude, radius=1000, meal_type="lunch", min_price=0, max_price=4, keyword=None):
+# Base URL of the Google Maps web services. Point it at a local stand-in
+# (stubs/google_stub.py) to load test without spending quota.
+MAPS_BASE_URL = os.environ.get("GOOGLE_MAPS_BASE_URL", "https://maps.googleapis.com").rstrip("/")
+
+# Nearby Searches get_restaurants_along_route may make besides the one at the route's start
+MEAL_ROUTE_EXTRA_SEARCHES = int(os.environ.get("MEAL_ROUTE_EXTRA_SEARCHES", 1))
+# Pages of results one Nearby Search may read (Google serves at most 3 pages of 20).
+# Each further page waits out PAGE_TOKEN_DELAY, so paging is opt-in: with the default of
+# one page a search never waits, and with more a search only pages when it is short of
+# the results it wants.
+PLACES_MAX_PAGES = int(os.environ.get("PLACES_MAX_PAGES", 1))
+# A next_page_token only becomes valid a short while after it is issued
+PAGE_TOKEN_DELAY = float(os.environ.get("PLACES_PAGE_TOKEN_DELAY", 2.0))
+PAGE_TOKEN_ATTEMPTS = 3
+# Pages Google serves at most for one Nearby Search
+GOOGLE_MAX_PAGES = 3
+# New unique attractions each get_city_attractions search should find before it stops paging
+ATTRACTIONS_PER_SEARCH = 10
+# Size search radii from the result densities learned per area (see search_radius).
+# Off by default: fixed radii let the place catalog answer repeated searches.
+ADAPTIVE_RADIUS = os.environ.get("PLACES_ADAPTIVE_RADIUS", "0") == "1"
+
+# Set inside exhaustive_searches(): the list of the searches still cut short
+_exhaustive = contextvars.ContextVar("exhaustive_searches", default=None)
+
+# Identical geocode, Places and Directions requests made at the same time by concurrent
+# trips share one call
+inflight = SingleFlight("maps")
+
+
+def _check_throttled(call, response, data=None):
+    """Report an HTTP 429 or an OVER_QUERY_LIMIT status to the rate limiter."""
+    if response.status_code == 429 or (data is not None and data.get('status') == "OVER_QUERY_LIMIT"):
+        call.throttled()
+
+
+def _nearby_search(url, params):
+    """Run one Places Nearby Search request, recording its latency and result count."""
+    return inflight.do(("places", url, tuple(sorted(params.items()))), _run_nearby_search, url, params)
+
+
+def _run_nearby_search(url, params):
+    place_type = params.get("type", "any")
+    keyword = params.get("keyword", "")
+    with rate_limit.limit("places") as call, metrics.PLACES_SEARCH_SECONDS.labels(place_type, keyword).time(), \
+            metrics.api_call("places"):
+        response = requests.get(url, params=params, timeout=10)
+        _check_throttled(call, response)
+        result_data = response.json()
+        _check_throttled(call, response, result_data)
+    metrics.PLACES_RESULTS.labels(place_type, keyword).inc(len(result_data.get('results', [])))
+    return result_data
+
+
+def iter_nearby_pages(url, params, max_pages=None):
+    """
+    Run a Nearby Search and yield its results page by page, following next_page_token
+    
+    Parameters:
+    - url: str - Nearby Search endpoint
+    - params: dict - Query parameters of the first page
+    - max_pages: int - Pages to read at most (default: PLACES_MAX_PAGES)
+    
+    Yields:
+    - (list of Place records, whether more pages are available) for each page; nothing
+      if the search fails. Stop iterating to stop fetching.
+    """
+    max_pages = max_pages or PLACES_MAX_PAGES
+    result_data = _nearby_search(url, params)
+    for page in range(1, max_pages + 1):
+        status = result_data.get('status')
+        if status not in ("OK", "ZERO_RESULTS"):
+            logger.warning(f"Nearby Search page {page} failed: {status} {result_data.get('error_message', '')}")
+            return
+        next_page_token = result_data.get('next_page_token')
+        issued = time.monotonic()
+        yield [Place.from_google(result) for result in result_data.get('results', [])], bool(next_page_token)
+        if not next_page_token or page == max_pages:
+            return
+        
+        # Google ignores the other parameters when a page token is given; they are kept
+        # for the metrics labels
+        page_params = dict(params, pagetoken=next_page_token)
+        time.sleep(max(0.0, PAGE_TOKEN_DELAY - (time.monotonic() - issued)))
+        for attempt in range(PAGE_TOKEN_ATTEMPTS):
+            result_data = _nearby_search(url, page_params)
+            if result_data.get('status') != "INVALID_REQUEST" or attempt == PAGE_TOKEN_ATTEMPTS - 1:
+                break
+            # The token is not valid yet
+            time.sleep(PAGE_TOKEN_DELAY)
+
+
+@contextmanager
+def exhaustive_searches():
+    """
+    Make the searches run inside the block complete, for prefetching (city_pack builds):
+    each reads every page Google serves instead of stopping at PLACES_MAX_PAGES or once
+    it has enough results, is not answered from the place catalog, and runs even when
+    the query planner would skip it.
+    
+    Yields:
+    - list to which the parameters of every search that still had more results after
+      the last page Google serves are appended
+    """
+    cut_short = []
+    token = _exhaustive.set(cut_short)
+    try:
+        yield cut_short
+    finally:
+        _exhaustive.reset(token)
+
+
+def _search_places(url, params, want=PAGE_SIZE, accept=None, max_pages=None):
+    """
+    Run one Nearby Search and return its results as Place records, answering it from
+    the place catalog when earlier searches already covered it.
+    
+    Further pages are read until `want` results pass accept(place) (every result does
+    by default) or the page budget runs out.
+    """
+    lat, lng = (float(value) for value in params["location"].split(","))
+    search = {
+        "place_type": params.get("type"),
+        "keyword": params.get("keyword"),
+        "min_price": params.get("minprice"),
+        "max_price": params.get("maxprice"),
+    }
+    cut_short = _exhaustive.get()
+    if cut_short is not None:
+        want, accept, max_pages = math.inf, None, GOOGLE_MAX_PAGES
+    else:
+        places = catalog.lookup(lat, lng, params["radius"], limit=max(want, PAGE_SIZE), **search)
+        metrics.cache_lookup("place_catalog", hit=places is not None)
+        if places is not None:
+            return places
+    
+    places = []
+    pages = 0
+    accepted = 0
+    more = False
+    for page, more in iter_nearby_pages(url, params, max_pages):
+        pages += 1
+        places.extend(page)
+        accepted += sum(1 for place in page if accept is None or accept(place))
+        if accepted >= want:
+            break
+    if pages:
+        catalog.record(lat, lng, params["radius"], places, complete=not more, **search)
+    if more and cut_short is not None:
+        cut_short.append(params)
+    return places
+
+
+def _from_city_pack(latitude, longitude, radius, kind, keywords, min_price=None, max_price=None):
+    """Answer a search from a loaded city pack, or return None if the API has to be queried."""
+    if not city_pack.loaded_packs():
+        return None
+    pack = city_pack.find_pack(latitude, longitude, radius, kind, keywords)
+    metrics.cache_lookup("city_pack", hit=pack is not None)
+    if pack is None:
+        return None
+    return pack.nearby(latitude, longitude, radius, kind, keywords, min_price, max_price)
+
+@metrics.stage_timer("places")
+def get_restaurants(latitude, longitude, radius=1000, meal_type="lunch", min_price=0, max_price=4, keyword=None,
+                    min_results=PAGE_SIZE):
     """
     Find restaurants for lunch or dinner
     
@@ -30,11 +202,13 @@ def get_restaurants(latitude, longitude, radius=1000, meal_type="lunch", min_pri
     - min_price: int - Minimum price level (0-4, where 0 is free and 4 is expensive) (default: 0)
     - max_price: int - Maximum price level (0-4, where 0 is free and 4 is expensive) (default: 4)
     - keyword: str - Specific keyword to search for (default: None)
+    - min_results: int - Restaurants wanted; while a search returns fewer, it reads
+      further result pages, up to PLACES_MAX_PAGES (default: 20)
     
     Returns:
-    - list of restaurant results
+    - list of restaurants as Place records
     """
-    url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+    url = f"{MAPS_BASE_URL}/maps/api/place/nearbysearch/json"
     params = {
         "location": f"{latitude},{longitude}",
         "radius": radius,
@@ -49,9 +223,144 @@ def get_restaurants(latitude, longitude, radius=1000, meal_type="lunch", min_pri
     if keyword:
         params["keyword"] = keyword
     
-    response = requests.get(url, params=params)
-    return response.json()['results']
+    places = _from_city_pack(latitude, longitude, radius, "restaurant", [keyword], min_price, max_price)
+    if places is not None:
+        # Like Nearby Search: whole pages of results, most prominent first
+        places.sort(key=lambda place: place.user_ratings_total, reverse=True)
+        places = places[:max(min_results, PAGE_SIZE)]
+    else:
+        places = _search_places(url, params, want=min_results)
+    
+    # A search that filled min_results may have stopped short of everything in range
+    densities.observe(latitude, longitude, "restaurant", keyword, len(places), radius,
+                      lower_bound=len(places) >= min_results)
+    return places
+
 
+def search_radius(latitude, longitude, kind, keyword, target, default_radius, min_radius, max_radius):
+    """
+    Radius of a search expected to find about `target` places
+    
+    With PLACES_ADAPTIVE_RADIUS=1, it comes from the densities earlier searches of the
+    same kind ("restaurant" or "attraction") and keyword found around the point. Until
+    there are any, or without it, it is default_radius.
+    
+    Returns:
+    - int - Radius in meters, between min_radius and max_radius
+    """
+    if not ADAPTIVE_RADIUS:
+        return default_radius
+    return densities.radius_for(latitude, longitude, kind, keyword, target, default_radius, min_radius, max_radius)
+
+
+def adaptive_search(search, latitude, longitude, kind, keyword, target, default_radius, min_radius, max_radius):
+    """
+    Run search(radius) with the radius from search_radius
+    
+    If it finds less than a quarter of the target, it is run once more with the radius
+    grown to the area that should hold the target at the density it saw. There are no
+    further follow-up searches.
+    
+    Returns:
+    - list of Place records returned by search
+    """
+    radius = search_radius(latitude, longitude, kind, keyword, target, default_radius, min_radius, max_radius)
+    places = search(radius)
+    if ADAPTIVE_RADIUS and len(places) < target / 4 and radius < max_radius:
+        radius = snap_radius(radius * math.sqrt(target / max(len(places), 1)), min_radius, max_radius)
+        logger.info(f"Found {len(places)} {kind} places, searching again with a {radius} m radius")
+        places = search(radius)
+    return places
+
+def _restaurants_are_local(latitude, longitude, radius, min_price, max_price, keyword):
+    """Whether get_restaurants would answer from a city pack or the place catalog."""
+    if city_pack.loaded_packs() and city_pack.find_pack(latitude, longitude, radius, "restaurant", [keyword]):
+        return True
+    return catalog.lookup(latitude, longitude, radius, "restaurant", keyword or None, min_price, max_price) is not None
+
+
+def get_restaurants_along_route(points, radius=1500, meal_type="lunch", min_price=0, max_price=4, keyword=None,
+                                max_extra_searches=None):
+    """
+    Find restaurants within `radius` of any point of a route, e.g. a slot's start, its
+    candidate attractions and its end
+    
+    The start is searched with get_restaurants as before. Other points are searched
+    too, farthest from the points already searched first. Only max_extra_searches of
+    them (MEAL_ROUTE_EXTRA_SEARCHES, default 1) may call the Places API; searches a city
+    pack or the place catalog answer are free. Restaurants the catalog already holds
+    near the unsearched points are added as well.
+    
+    Parameters:
+    - points: list of (lat, lng) tuples, starting with the route's start
+    - other parameters as for get_restaurants
+    
+    Returns:
+    - list of Place records, taking the most reviewed ones near each point in turn
+    """
+    if max_extra_searches is None:
+        max_extra_searches = MEAL_ROUTE_EXTRA_SEARCHES
+    # Points closer than half the radius to an earlier one add little area
+    route = []
+    for point in points:
+        if all(distance_m(*point, *kept) > radius / 2 for kept in route):
+            route.append(point)
+    
+    per_point = [get_restaurants(route[0][0], route[0][1], radius=radius, meal_type=meal_type, min_price=min_price,
+                                 max_price=max_price, keyword=keyword)]
+    searched = [route[0]]
+    remaining = route[1:]
+    extra_searches = 0
+    while remaining:
+        point = max(remaining, key=lambda p: min(distance_m(*p, *s) for s in searched))
+        remaining.remove(point)
+        if _restaurants_are_local(point[0], point[1], radius, min_price, max_price, keyword):
+            pass
+        elif extra_searches < max_extra_searches:
+            extra_searches += 1
+        else:
+            places = catalog.nearby(point[0], point[1], radius, "restaurant", keyword, min_price, max_price)
+            per_point.append(places)
+            continue
+        per_point.append(get_restaurants(point[0], point[1], radius=radius, meal_type=meal_type, min_price=min_price,
+                                         max_price=max_price, keyword=keyword))
+        searched.append(point)
+    
+    # Interleave so the first few restaurants are spread along the route
+    results = []
+    seen = set()
+    for rank in range(max(len(places) for places in per_point)):
+        for places in per_point:
+            if rank < len(places) and places[rank].place_id not in seen:
+                seen.add(places[rank].place_id)
+                results.append(places[rank])
+    return results
+
+# Optimized list of place types for tourist attractions
+ATTRACTION_PLACE_TYPES = [
+    "tourist_attraction",
+    "museum",
+    "aquarium",
+    "art_gallery",
+    "zoo",
+    "landmark",
+    "park"
+]
+
+def _plan_searches(keywords, place_types):
+    """The keyword x type searches to run: the planner's choice, or all of them in exhaustive_searches()."""
+    if _exhaustive.get() is not None:
+        return [(keyword, place_type) for keyword in keywords for place_type in place_types]
+    return planner.plan(keywords, place_types)
+
+
+def _record_search(keyword, place_type, new_places):
+    # Exhaustive searches read more pages than request-time ones, so their yield would skew the planner
+    if _exhaustive.get() is None:
+        planner.record(keyword, place_type, new_places)
+
+
+@metrics.stage_timer("places")
 def get_city_attractions(city_lat, city_lng, city_name="the city", radius=25000, attractions_keywords=None, sort_by="reviews"):
     """
     Find tourist attractions at the city level
@@ -65,14 +374,14 @@ def get_city_attractions(city_lat, city_lng, city_name="the city", radius=25000,
     - sort_by: str - Sort results by "rating", "reviews", or "prominence" (default: "reviews")
     
     Returns:
-    - list of attraction results sorted by the specified criteria
+    - list of attractions as Place records, sorted by the specified criteria
     """
     # Ensure radius doesn't exceed API limits
     if radius > 50000:
         print(f"Warning: Radius reduced from {radius}m to 50000m (API maximum)")
         radius = 50000
     
-    url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+    url = f"{MAPS_BASE_URL}/maps/api/place/nearbysearch/json"
     
     # Base parameters
     base_params = {
@@ -82,62 +391,72 @@ def get_city_attractions(city_lat, city_lng, city_name="the city", radius=25000,
     }
     
     results = []
-    
-    # Optimized list of place types for tourist attractions
-    place_types = [
-        "tourist_attraction",
-        "museum",
-        "aquarium",
-        "art_gallery",
-        "zoo",
-        "landmark",
-        "park"
-    ]
+    place_types = ATTRACTION_PLACE_TYPES
     
     print(f"Searching for attractions in {city_name} (radius: {radius/1000:.1f}km)...")
     
+    # Searches read further pages until they find ATTRACTIONS_PER_SEARCH places the
+    # earlier searches did not
+    found_ids = set()
+    # Whether a search filled its pages, so more attractions may be in range
+    cut_short = False
+    
+    def is_new(place):
+        return place.place_id not in found_ids
+    
+    has_keywords = attractions_keywords and isinstance(attractions_keywords, list) and len(attractions_keywords) > 0
+    packed = _from_city_pack(city_lat, city_lng, radius, "attraction", attractions_keywords if has_keywords else [None])
+    if packed is not None:
+        print(f"Found {len(packed)} results in the city pack")
+        results = packed
     # If attraction keywords are provided, make separate requests for each keyword
-    if attractions_keywords and isinstance(attractions_keywords, list) and len(attractions_keywords) > 0:
-        for keyword in attractions_keywords:
-            for place_type in place_types:
-                keyword_params = base_params.copy()
-                keyword_params["type"] = place_type
-                keyword_params["keyword"] = keyword
-                
-                response = requests.get(url, params=keyword_params)
-                result_data = response.json()
-                
-                if result_data.get('status') == "OK" and result_data.get('results'):
-                    print(f"Found {len(result_data.get('results'))} results for '{place_type}' with keyword '{keyword}'")
-                    results.extend(result_data.get('results'))
+    elif attractions_keywords and isinstance(attractions_keywords, list) and len(attractions_keywords) > 0:
+        # The planner skips the keyword x type combinations that have stopped finding new places
+        for keyword, place_type in _plan_searches(attractions_keywords, place_types):
+            keyword_params = base_params.copy()
+            keyword_params["type"] = place_type
+            keyword_params["keyword"] = keyword
+            
+            places = _search_places(url, keyword_params, want=ATTRACTIONS_PER_SEARCH, accept=is_new)
+            _record_search(keyword, place_type, sum(1 for place in places if is_new(place)))
+            cut_short = cut_short or len(places) >= PAGE_SIZE
+            
+            if places:
+                print(f"Found {len(places)} results for '{place_type}' with keyword '{keyword}'")
+                results.extend(places)
+                found_ids.update(place.place_id for place in places)
     else:
         # If no keywords, try each place type
-        for place_type in place_types:
+        for _, place_type in _plan_searches([None], place_types):
             type_params = base_params.copy()
             type_params["type"] = place_type
             
-            response = requests.get(url, params=type_params)
-            result_data = response.json()
+            places = _search_places(url, type_params, want=ATTRACTIONS_PER_SEARCH, accept=is_new)
+            _record_search(None, place_type, sum(1 for place in places if is_new(place)))
+            cut_short = cut_short or len(places) >= PAGE_SIZE
             
-            if result_data.get('status') == "OK" and result_data.get('results'):
-                print(f"Found {len(result_data.get('results'))} results for '{place_type}'")
-                results.extend(result_data.get('results'))
+            if places:
+                print(f"Found {len(places)} results for '{place_type}'")
+                results.extend(places)
+                found_ids.update(place.place_id for place in places)
     
     # Remove duplicates based on place_id
     unique_results = {}
     for item in results:
-        if 'place_id' in item:
-            unique_results[item['place_id']] = item
+        if item.place_id:
+            unique_results[item.place_id] = item
     
     results = list(unique_results.values())
+    densities.observe(city_lat, city_lng, "attraction", " ".join(attractions_keywords) if has_keywords else None,
+                      len(results), radius, lower_bound=cut_short)
     
     # Sort results based on the specified criteria
     if sort_by == "rating":
         # Sort by rating (highest first), handling places with no rating
-        results.sort(key=lambda x: (x.get('rating', 0) or 0, x.get('user_ratings_total', 0) or 0), reverse=True)
+        results.sort(key=lambda x: (x.rating or 0, x.user_ratings_total), reverse=True)
     elif sort_by == "reviews":
         # Sort by number of reviews (highest first)
-        results.sort(key=lambda x: x.get('user_ratings_total', 0) or 0, reverse=True)
+        results.sort(key=lambda x: x.user_ratings_total, reverse=True)
     
     print(f"Total unique attractions found in {city_name}: {len(results)}")
     return results
@@ -145,9 +464,24 @@ def get_city_attractions(city_lat, city_lng, city_name="the city", radius=25000,
 from datetime import datetime, timedelta
 
 
-googlemaps_api_key = os.environ.get("GOOGLE_PLACES_API_KEY")
-# Initialize Google Maps client
-gmaps = googlemaps.Client(key=os.environ.get("GOOGLE_PLACES_API_KEY"))
+_gmaps_client = None
+_gmaps_lock = threading.Lock()
+
+
+def get_gmaps_client():
+    """
+    The shared Google Maps client, created on first use.
+
+    Creating it validates GOOGLE_PLACES_API_KEY, so importing this module works without
+    a key and only the Directions calls need one.
+    """
+    global _gmaps_client
+    if _gmaps_client is None:
+        with _gmaps_lock:
+            if _gmaps_client is None:
+                import googlemaps
+                _gmaps_client = googlemaps.Client(key=os.environ.get("GOOGLE_PLACES_API_KEY"), base_url=MAPS_BASE_URL)
+    return _gmaps_client
 
 # # Initialize geocoder
 # geocoder = Nominatim(user_agent="map_agent")
@@ -170,15 +504,17 @@ def geocode_location(location_name):
     """Convert a location name to latitude and longitude coordinates"""
     # Check cache first to avoid redundant API calls
     if hasattr(geocode_location, 'cache') and location_name in geocode_location.cache:
+        metrics.cache_lookup("geocode", hit=True)
         return geocode_location.cache[location_name]
+    metrics.cache_lookup("geocode", hit=False)
     
     # Initialize cache if it doesn't exist
     if not hasattr(geocode_location, 'cache'):
         geocode_location.cache = {}
     
     # Replace with your actual Google Maps API key
-    api_key = googlemaps_api_key
-    base_url = "https://maps.googleapis.com/maps/api/geocode/json"
+    api_key = os.environ.get("GOOGLE_PLACES_API_KEY")
+    base_url = f"{MAPS_BASE_URL}/maps/api/geocode/json"
     
     try:
         # Prepare request parameters
@@ -187,12 +523,8 @@ def geocode_location(location_name):
             'key': api_key
         }
         
-        # Make the request
-        response = requests.get(base_url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        # Parse the response
-        data = response.json()
+        # Make the request, or wait for the same one in flight
+        data = inflight.do(("geocode", location_name), _run_geocode, base_url, params)
         
         # Check status
         if data['status'] != 'OK':
@@ -218,10 +550,25 @@ def geocode_location(location_name):
         return None, None
 
 
+def _run_geocode(base_url, params):
+    with rate_limit.limit("geocode") as call, metrics.stage_timer("geocode"), metrics.api_call("geocode"):
+        response = requests.get(base_url, params=params, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+        _check_throttled(call, response, data)
+    return data
+
+
+def _run_directions(origin, destination):
+    with rate_limit.limit("directions"), metrics.api_call("directions"):
+        return get_gmaps_client().directions(origin, destination, mode="driving")
+
+
 def calculate_travel_time(origin, destination):
     """Calculate travel time between two locations"""
     try:
-        directions = gmaps.directions(origin, destination, mode="driving")
+        directions = inflight.do(("directions", repr(origin), repr(destination)),
+                                 _run_directions, origin, destination)
         if directions and len(directions) > 0:
             leg = directions[0]['legs'][0]
             return leg['duration']['value']  # Travel time in seconds
@@ -250,4 +597,4 @@ def get_place_photo_url(photo_reference, max_width=400):
         logger.error("GOOGLE_PLACES_API_KEY environment variable not set")
         return None
         
-    return f"https://maps.googleapis.com/maps/api/place/photo?maxwidth={max_width}&photoreference={photo_reference}&key={api_key}"
\ No newline at end of file
+    return f"{MAPS_BASE_URL}/maps/api/place/photo?maxwidth={max_width}&photoreference={photo_reference}&key={api_key}"
\ No newline at end of file
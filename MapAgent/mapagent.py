@@ -3,13 +3,16 @@ from uagents.setup import fund_agent_if_low
 from datetime import datetime, timedelta
 import json
 import os
+import asyncio
 import logging
+import contextvars
 from typing import List, Dict, Any, Tuple, Optional
 from dotenv import load_dotenv
 
 # Import your utility functions from the separate file
 from map_func import (
     collect_itinerary_data,
+    collect_unique_locations,
     create_distance_matrix,
     extract_location_data,
     generate_optimized_itinerary,
@@ -21,9 +24,12 @@ load_dotenv()
 import sys
 sys.path.append(os.path.abspath("..")) 
 from models import TravelPlan, ItineraryResponse
-
-# Import map utilities
-from map_utils import *
+import http_cassette
+import metrics
+import tracing
+import profiling
+import loop_watchdog
+import city_pack
 
 # Set up logging
 logging.basicConfig(
@@ -62,6 +68,7 @@ class MapAgent:
         
         # Include the protocol in the agent
         self.agent.include(self.protocol)
+        loop_watchdog.add_agent_watchdog(self.agent)
         
         logger.info(f"Map Agent initialized with address: {self.agent.address}")
     
@@ -69,12 +76,17 @@ class MapAgent:
         """Handle incoming travel plan messages"""
         logger.info(f"Received travel plan from {sender}")
         
+        handler_span = tracing.start_span("map_agent.handle_travel_plan", parent=tracing.context_from_message(msg),
+                                          kind="server", attributes={"request_id": msg.request_id})
         try:
             # Process the request data using the external functions
-            itinerary = await self.generate_itinerary(msg)
+            with metrics.in_flight("travel_plan"), tracing.use_span(handler_span), \
+                    profiling.profiled(msg.profile_dir, "map_agent"):
+                itinerary = await self.generate_itinerary(msg)
             
             # Create the response
-            response = ItineraryResponse(itinerary=itinerary)
+            response = ItineraryResponse(itinerary=itinerary, request_id=msg.request_id,
+                                         **tracing.message_context(handler_span))
             
             # Send back the generated itinerary to the sender
             await ctx.send(sender, response)
@@ -91,68 +103,49 @@ class MapAgent:
             error_response = ItineraryResponse(itinerary=[{
                 "type": "error",
                 "description": f"Error: {str(e)}"
-            }])
+            }], request_id=msg.request_id, **tracing.message_context(handler_span))
             await ctx.send(sender, error_response)
+            handler_span.end(error=e)
+        finally:
+            handler_span.end()
     
     async def generate_itinerary(self, data: TravelPlan) -> List[Dict[str, Any]]:
         """Generate an itinerary based on user preferences and free time slots"""
         logger.info(f"Generating itinerary with preferences: {data.attractions}, {data.events}, {data.lunch}, {data.dinner}")
         
         try:
-            # Step 1: Collect all necessary data using the external function
-            itinerary_data = collect_itinerary_data(
-                data.free_times, 
-                data.attractions, 
-                data.events,
-                data.lunch, 
-                data.dinner
-            )
+            # Step 1: Collect all necessary data using the external function. Its Maps
+            # calls (and the waits for Places page tokens) block, so it runs in the
+            # default executor, in a copy of the context to stay in the current trace
+            with metrics.stage_timer("collect_places"):
+                context = contextvars.copy_context()
+                itinerary_data = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    lambda: context.run(
+                        collect_itinerary_data,
+                        data.free_times, 
+                        data.attractions, 
+                        data.events,
+                        data.lunch, 
+                        data.dinner
+                    )
+                )
             
             # Step 2: Extract all unique locations
-            all_locations = []
-            # pdb.set_trace()
-            # Add start and end locations from each time slot
-            for slot in itinerary_data["free_time_slots"]:
-                all_locations.append(extract_location_data({
-                    "name": slot["start_location"]["name"],
-                    "coordinates": slot["start_location"]["coordinates"],
-                    "type": "location"
-                }))
-                all_locations.append(extract_location_data({
-                    "name": slot["end_location"]["name"],
-                    "coordinates": slot["end_location"]["coordinates"],
-                    "type": "location"
-                }))
-            
-            # Add attractions
-             
-            for attraction in itinerary_data["attractions"]:
-                all_locations.append(extract_location_data(attraction))
-             
-            # Add restaurants
-            for meal_type in ["lunch", "dinner"]:
-                for restaurant in itinerary_data["restaurants"][meal_type]:
-                    restaurant_data = extract_location_data(restaurant)
-                    restaurant_data["type"] = meal_type
-                    all_locations.append(restaurant_data)
-            
-            # Remove duplicates by name
-            unique_locations = []
-            location_names = set()
-            
-            for location in all_locations:
-                if location["name"] not in location_names:
-                    unique_locations.append(location)
-                    location_names.add(location["name"])
+            with metrics.stage_timer("unique_locations"):
+                unique_locations = collect_unique_locations(itinerary_data)
             
             # Step 3: Create distance matrix using the external function
-            distance_matrix = create_distance_matrix(unique_locations)
+            with metrics.stage_timer("distance_matrix"):
+                distance_matrix = create_distance_matrix(unique_locations)
             
             # Step 4: Use LLM to generate optimized itinerary using the external function
-            optimized_itinerary = await generate_optimized_itinerary(itinerary_data, distance_matrix)
+            with metrics.stage_timer("itinerary_llm"):
+                optimized_itinerary = await generate_optimized_itinerary(itinerary_data, distance_matrix)
             # import pdb; pdb.set_trace()
             # Step 5: Post-process the itinerary if needed using the external function
-            final_itinerary = post_process_itinerary(optimized_itinerary, unique_locations)
+            with metrics.stage_timer("post_process"):
+                final_itinerary = post_process_itinerary(optimized_itinerary, unique_locations)
             # import pdb; pdb.set_trace()
             return final_itinerary
             
@@ -174,5 +167,9 @@ class MapAgent:
         self.agent.run()
 
 if __name__ == "__main__":
+    # Record or replay outbound HTTP traffic when HTTP_CASSETTE_MODE is set
+    http_cassette.install_from_env()
+    metrics.start_metrics_server_from_env()
+    city_pack.load_packs_from_env()
     map_agent = MapAgent()
     map_agent.run()
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""
+Compact record for a place returned by the Google Places API.
+
+A Nearby Search result carries much more than the planner uses (viewport, icons, plus
+codes, photo attributions, ...). get_restaurants and get_city_attractions turn each
+result into a Place as soon as it arrives, so only the fields below are kept and copied
+through the pipeline.
+"""
+from dataclasses import dataclass, asdict
+from typing import Optional, Tuple
+
+
+@dataclass(slots=True)
+class Place:
+    place_id: Optional[str]
+    name: str
+    lat: float
+    lng: float
+    rating: Optional[float] = None
+    user_ratings_total: int = 0
+    price_level: Optional[int] = None
+    types: Tuple[str, ...] = ()
+    vicinity: Optional[str] = None
+    # Reference of the first photo, for get_place_photo_url
+    photo_reference: Optional[str] = None
+
+    @classmethod
+    def from_google(cls, result):
+        """Build a Place from one Places API result, keeping only the fields we use."""
+        location = result.get("geometry", {}).get("location", {})
+        photos = result.get("photos")
+        return cls(
+            place_id=result.get("place_id"),
+            name=str(result.get("name", "Unknown")),
+            lat=float(location.get("lat", 0.0)),
+            lng=float(location.get("lng", 0.0)),
+            rating=result.get("rating"),
+            user_ratings_total=result.get("user_ratings_total") or 0,
+            price_level=result.get("price_level"),
+            types=tuple(result.get("types", ())),
+            vicinity=result.get("vicinity"),
+            photo_reference=photos[0].get("photo_reference") if photos else None,
+        )
+
+    @property
+    def coordinates(self):
+        return {"lat": self.lat, "lng": self.lng}
+
+    def to_dict(self):
+        return asdict(self)
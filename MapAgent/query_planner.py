@@ -0,0 +1,154 @@
+"""
+Query planner for the keyword x place type searches of get_city_attractions.
+
+get_city_attractions runs one Nearby Search per LLM keyword and attraction place type.
+Many of those combinations ("food festival" x aquarium) return nothing, or only places
+an earlier search of the same call already found. The planner keeps, per (keyword
+token, place type), how many searches ran and how many new unique places they returned,
+and skips a combination once every token of its keyword has been seen at least
+MIN_OBSERVATIONS times with that type and averaged fewer than MIN_YIELD new places. One
+in PROBE_EVERY skipped searches still runs, so combinations that start paying off get
+picked up again.
+
+Keywords are merged when they have the same tokens once plurals are folded ("Museums"
+and "museum"): the second would repeat the first search. Nearby Search has no OR
+operator, so different keywords cannot be merged into one request.
+
+Statistics live in memory and, when QUERY_PLANNER_STATS names a JSON file, are loaded
+from it on first use and written back at most every SAVE_INTERVAL seconds.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+
+from spatial_index import tokenize
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MIN_OBSERVATIONS = 5
+MIN_YIELD = 0.1
+PROBE_EVERY = 10
+SAVE_INTERVAL = 30
+# Token of the searches without a keyword
+NO_KEYWORD = "*"
+
+PLANNED_SEARCHES = metrics.Counter("exploreease_places_planned_searches_total",
+                                   "Attraction searches the query planner ran, skipped or ran as probes.",
+                                   ["decision"])
+
+
+def keyword_tokens(keyword):
+    """Tokens of a keyword with plurals folded ("art museums" -> art, museum)."""
+    tokens = set()
+    for token in tokenize(keyword):
+        if token.endswith(("ches", "shes", "sses", "xes")):
+            token = token[:-2]
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.add(token)
+    return frozenset(tokens) or frozenset([NO_KEYWORD])
+
+
+class QueryPlanner:
+    """Chooses which keyword x place type searches to run from their past yield."""
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else os.environ.get("QUERY_PLANNER_STATS")
+        # (token, place type) -> [searches, new places]
+        self._stats = {}
+        self._skipped = {}
+        self._loaded = False
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                for token, place_type, searches, new in json.load(f):
+                    self._stats[(token, place_type)] = [searches, new]
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load query planner statistics from {self.path}: {e}")
+
+    def _save(self):
+        rows = [[token, place_type, searches, new] for (token, place_type), (searches, new) in self._stats.items()]
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, "w") as f:
+                json.dump(rows, f)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.error(f"Could not save query planner statistics to {self.path}: {e}")
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def _low_yield(self, tokens, place_type):
+        for token in tokens:
+            searches, new = self._stats.get((token, place_type), (0, 0))
+            if searches < MIN_OBSERVATIONS or new / searches >= MIN_YIELD:
+                return False
+        return True
+
+    def plan(self, keywords, place_types):
+        """
+        The searches to run for a get_city_attractions call.
+
+        Parameters:
+        - keywords: list of keywords, or [None] for the searches without one
+        - place_types: list of place types
+
+        Returns:
+        - list of (keyword, place_type) in the order to run them, keyword by keyword
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            merged = {}
+            for keyword in keywords:
+                merged.setdefault(keyword_tokens(keyword), keyword)
+            searches = []
+            for tokens, keyword in merged.items():
+                for place_type in place_types:
+                    if not self._low_yield(tokens, place_type):
+                        PLANNED_SEARCHES.labels("run").inc()
+                        searches.append((keyword, place_type))
+                        continue
+                    skipped = self._skipped[(tokens, place_type)] = self._skipped.get((tokens, place_type), 0) + 1
+                    if skipped % PROBE_EVERY == 0:
+                        PLANNED_SEARCHES.labels("probe").inc()
+                        searches.append((keyword, place_type))
+                    else:
+                        PLANNED_SEARCHES.labels("skipped").inc()
+            return searches
+
+    def record(self, keyword, place_type, new_places):
+        """Record that a search returned new_places places no earlier search of its call had."""
+        with self._lock:
+            for token in keyword_tokens(keyword):
+                stats = self._stats.setdefault((token, place_type), [0, 0])
+                stats[0] += 1
+                stats[1] += new_places
+            self._dirty = True
+            if self.path and time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+                self._save()
+
+    def flush(self):
+        """Write the statistics to QUERY_PLANNER_STATS now, if anything changed."""
+        with self._lock:
+            if self.path and self._dirty:
+                self._save()
+
+
+# The planner shared by get_city_attractions
+planner = QueryPlanner()
+atexit.register(planner.flush)
@@ -0,0 +1,366 @@
+"""
+In-memory spatial index of places, and the catalog of Nearby Search results built on it.
+
+GridIndex buckets places into fixed-size lat/lng cells and answers radius and k-nearest
+queries by scanning only the cells that can be in range, with filters on place type,
+price level and keyword tokens.
+
+PlaceCatalog keeps every place the Places API returned, together with the searches that
+returned them (center, radius, type, keyword, price range). A new search can be answered
+from the index, without calling the API, when an earlier search with the same type and
+keyword covered it:
+- the earlier search was complete (it read every page of results) and its circle and
+  price range contain the new ones, or
+- it was the very same search.
+A search that stopped with more pages left only holds the most prominent places of its
+circle, so a smaller circle inside it may have places the search did not return.
+Searches, and the places only they returned, expire after PLACE_CATALOG_TTL seconds
+(default 6 hours), and the catalog is cleared once it holds more than
+PLACE_CATALOG_MAX_PLACES places (default 100000). Expired searches are dropped as new
+ones are recorded, and only the PLACE_CATALOG_MAX_SEARCHES (default 10000) most
+recent searches are kept.
+
+DensityMap learns how many places per square kilometer searches find, per coarse cell,
+kind and keyword, and turns that into the radius expected to return a target count.
+"""
+import os
+import re
+import math
+import time
+import threading
+from collections import OrderedDict
+
+EARTH_RADIUS_M = 6371000
+METERS_PER_DEGREE_LAT = 111320
+# About 1.1 km north-south
+CELL_DEGREES = 0.01
+# Results in one page of a Nearby Search
+PAGE_SIZE = 20
+# About 11 km north-south, so densities are learned from a few searches per area
+DENSITY_CELL_DEGREES = 0.1
+# Weight of a new observation in a cell's moving average
+DENSITY_ALPHA = 0.3
+# Radii are rounded to steps of this ratio, and a cell keeps its radius until the
+# estimate moves by more than RADIUS_HYSTERESIS. Repeated searches around the same point
+# then keep the same circle, which the place catalog can answer, while densities drift.
+RADIUS_STEP = 1.25
+RADIUS_HYSTERESIS = 1.5
+
+
+def distance_m(lat1, lng1, lat2, lng2):
+    """Great circle distance in meters."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def tokenize(text):
+    """Lower-case word tokens of a name, type or keyword ("art_gallery" -> art, gallery)."""
+    return set(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+
+class _Entry:
+    __slots__ = ("place", "types", "tokens", "expires")
+
+    def __init__(self, place):
+        self.place = place
+        self.expires = None
+        self.types = set(place.types)
+        self.tokens = tokenize(place.name)
+        for place_type in place.types:
+            self.tokens |= tokenize(place_type)
+
+    def matches(self, place_type, keyword_tokens, min_price, max_price):
+        if place_type is not None and place_type not in self.types:
+            return False
+        if keyword_tokens and not keyword_tokens <= self.tokens:
+            return False
+        # Like the city packs, places without a price level pass the price filter
+        price = self.place.price_level
+        if price is not None and ((min_price is not None and price < min_price)
+                                  or (max_price is not None and price > max_price)):
+            return False
+        return True
+
+
+class GridIndex:
+    """Places bucketed by lat/lng cell, for radius and k-nearest queries."""
+
+    def __init__(self, cell_degrees=CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._entries = {}
+        self._cells = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def add(self, place, place_type=None, keyword=None, expires=None):
+        """
+        Add a place, or merge into the entry already indexed for its place_id. place_type
+        and keyword are those of the search that found it, so later queries with the same
+        filters match it even if its name and types do not. With `expires` (a
+        time.monotonic() value), queries given a later `now` skip the place.
+        """
+        key = place.place_id or (place.name, place.lat, place.lng)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry(place)
+            self._cells.setdefault(self._cell(place.lat, place.lng), []).append(entry)
+        else:
+            entry.place = place
+        if expires is not None:
+            entry.expires = expires if entry.expires is None else max(entry.expires, expires)
+        if place_type:
+            entry.types.add(place_type)
+            entry.tokens |= tokenize(place_type)
+        entry.tokens |= tokenize(keyword)
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+        self._cells.clear()
+
+    def _cells_around(self, lat, lng, radius_m):
+        lat_span = radius_m / METERS_PER_DEGREE_LAT
+        lng_span = radius_m / (METERS_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        min_row, min_col = self._cell(lat - lat_span, lng - lng_span)
+        max_row, max_col = self._cell(lat + lat_span, lng + lng_span)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                yield from self._cells.get((row, col), ())
+
+    def within(self, lat, lng, radius_m, place_type=None, keyword=None, min_price=None, max_price=None, now=None):
+        """
+        Places within radius_m of a point that pass the filters (and, given `now`, have
+        not expired).
+
+        Returns:
+            List of (distance in meters, Place), nearest first
+        """
+        keyword_tokens = tokenize(keyword)
+        found = []
+        for entry in self._cells_around(lat, lng, radius_m):
+            if not entry.matches(place_type, keyword_tokens, min_price, max_price):
+                continue
+            if now is not None and entry.expires is not None and entry.expires <= now:
+                continue
+            distance = distance_m(lat, lng, entry.place.lat, entry.place.lng)
+            if distance <= radius_m:
+                found.append((distance, entry.place))
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def nearest(self, lat, lng, k, place_type=None, keyword=None, min_price=None, max_price=None,
+                max_radius_m=50000):
+        """
+        The k places nearest to a point that pass the filters, searching outwards ring by
+        ring of cells up to max_radius_m.
+
+        Returns:
+            List of (distance in meters, Place), nearest first
+        """
+        # Every place within `radius` of the point lies in the cells scanned for it
+        radius = self.cell_degrees * METERS_PER_DEGREE_LAT
+        while True:
+            found = self.within(lat, lng, min(radius, max_radius_m), place_type, keyword, min_price, max_price)
+            if len(found) >= k or radius >= max_radius_m or len(found) == len(self._entries):
+                return found[:k]
+            radius *= 2
+
+
+class _Search:
+    __slots__ = ("lat", "lng", "radius", "min_price", "max_price", "complete", "expires")
+
+    def __init__(self, lat, lng, radius, min_price, max_price, complete, expires):
+        self.lat, self.lng, self.radius = lat, lng, radius
+        self.min_price, self.max_price = min_price, max_price
+        self.complete = complete
+        self.expires = expires
+
+    def answers(self, lat, lng, radius, min_price, max_price):
+        if self.complete:
+            return (distance_m(self.lat, self.lng, lat, lng) + radius <= self.radius
+                    and (self.min_price is None or (min_price is not None and min_price >= self.min_price))
+                    and (self.max_price is None or (max_price is not None and max_price <= self.max_price)))
+        return ((self.lat, self.lng, self.radius, self.min_price, self.max_price)
+                == (lat, lng, radius, min_price, max_price))
+
+
+class PlaceCatalog:
+    """Places returned by past Nearby Searches, and which searches they answer."""
+
+    def __init__(self, ttl=None, max_places=None, max_searches=None):
+        self.ttl = ttl if ttl is not None else float(os.environ.get("PLACE_CATALOG_TTL", 6 * 3600))
+        self.max_places = max_places or int(os.environ.get("PLACE_CATALOG_MAX_PLACES", 100000))
+        self.max_searches = max_searches or int(os.environ.get("PLACE_CATALOG_MAX_SEARCHES", 10000))
+        self.index = GridIndex()
+        # Every search by (type and keyword, circle, price range), oldest first; all searches
+        # live for the same TTL, so this is also the order in which they expire
+        self._searches = OrderedDict()
+        # The same searches by type and keyword, for lookup
+        self._searches_by_key = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(place_type, keyword):
+        return place_type, " ".join(sorted(tokenize(keyword)))
+
+    def lookup(self, lat, lng, radius, place_type=None, keyword=None, min_price=None, max_price=None,
+               limit=PAGE_SIZE):
+        """
+        Answer a Nearby Search from the catalog.
+
+        Returns:
+            List of at most `limit` Place records, most reviewed first, or None if the
+            search was not covered and has to go to the API
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._prune_locked(now)
+            searches = self._searches_by_key.get(self._key(place_type, keyword))
+            if not searches:
+                return None
+            if not any(search.answers(lat, lng, radius, min_price, max_price) for search in searches.values()):
+                return None
+            found = self.index.within(lat, lng, radius, place_type, keyword, min_price, max_price, now)
+        places = [place for _, place in found]
+        places.sort(key=lambda place: place.user_ratings_total, reverse=True)
+        return places[:limit]
+
+    def nearby(self, lat, lng, radius, place_type=None, keyword=None, min_price=None, max_price=None):
+        """
+        The places the catalog holds within `radius` of a point, whether or not a past
+        search covered the circle, leaving out those whose searches have expired.
+
+        Returns:
+            List of Place records, most reviewed first
+        """
+        with self._lock:
+            found = self.index.within(lat, lng, radius, place_type, keyword, min_price, max_price,
+                                      time.monotonic())
+        places = [place for _, place in found]
+        places.sort(key=lambda place: place.user_ratings_total, reverse=True)
+        return places
+
+    def record(self, lat, lng, radius, places, place_type=None, keyword=None, min_price=None, max_price=None,
+               complete=None):
+        """
+        Add the results of a Nearby Search the API answered. complete tells whether every
+        page was read; by default, whether the results fit in one page.
+        """
+        if complete is None:
+            complete = len(places) < PAGE_SIZE
+        with self._lock:
+            if len(self.index) + len(places) > self.max_places:
+                self.clear_locked()
+            now = time.monotonic()
+            self._prune_locked(now)
+            expires = now + self.ttl
+            for place in places:
+                self.index.add(place, place_type, keyword, expires)
+            key = self._key(place_type, keyword)
+            search_id = (key, lat, lng, radius, min_price, max_price)
+            # The same search again replaces the earlier one
+            self._remove_locked(search_id)
+            search = _Search(lat, lng, radius, min_price, max_price, complete, expires)
+            self._searches[search_id] = search
+            self._searches_by_key.setdefault(key, {})[search_id] = search
+            while len(self._searches) > self.max_searches:
+                self._remove_locked(next(iter(self._searches)))
+
+    def _remove_locked(self, search_id):
+        if self._searches.pop(search_id, None) is None:
+            return
+        key = search_id[0]
+        searches = self._searches_by_key[key]
+        del searches[search_id]
+        if not searches:
+            del self._searches_by_key[key]
+
+    def _prune_locked(self, now):
+        """Drop the expired searches (with the lock held)."""
+        while self._searches:
+            search_id, search = next(iter(self._searches.items()))
+            if search.expires > now:
+                break
+            self._remove_locked(search_id)
+
+    def clear_locked(self):
+        self.index.clear()
+        self._searches.clear()
+        self._searches_by_key.clear()
+
+    def clear(self):
+        with self._lock:
+            self.clear_locked()
+
+
+class DensityMap:
+    """Places per square kilometer found by past searches, per coarse cell, kind and keyword."""
+
+    def __init__(self, cell_degrees=DENSITY_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._densities = {}
+        self._radii = {}
+        self._lock = threading.Lock()
+
+    def _keys(self, lat, lng, kind, keyword):
+        cell = int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+        keyword_key = " ".join(sorted(tokenize(keyword)))
+        # The keyword's own density, then that of every search of the kind as a fallback
+        return (cell, kind, keyword_key), (cell, kind, None)
+
+    def observe(self, lat, lng, kind, keyword, count, radius_m, lower_bound=False):
+        """
+        Record that a search of radius_m found `count` places. With lower_bound, the
+        search may have been cut short (a full page), so its density is only a minimum.
+        """
+        area_km2 = math.pi * (radius_m / 1000) ** 2
+        # Half a place for an empty search, so the density stays positive
+        density = max(count, 0.5) / area_km2
+        with self._lock:
+            for key in self._keys(lat, lng, kind, keyword):
+                current = self._densities.get(key)
+                if current is None:
+                    self._densities[key] = density
+                elif not lower_bound or density > current:
+                    self._densities[key] = current + DENSITY_ALPHA * (density - current)
+
+    def density(self, lat, lng, kind, keyword=None):
+        """Estimated places per square kilometer, or None before any search there."""
+        with self._lock:
+            for key in self._keys(lat, lng, kind, keyword):
+                if key in self._densities:
+                    return self._densities[key]
+        return None
+
+    def radius_for(self, lat, lng, kind, keyword, target, default_m, min_m, max_m):
+        """The radius expected to find `target` places, within [min_m, max_m]."""
+        density = self.density(lat, lng, kind, keyword)
+        if density is None:
+            return default_m
+        radius_m = snap_radius(1000 * math.sqrt(target / (math.pi * density)), min_m, max_m)
+        key = self._keys(lat, lng, kind, keyword)[0] + (target, min_m, max_m)
+        with self._lock:
+            previous = self._radii.get(key)
+            if previous is not None and previous / RADIUS_HYSTERESIS <= radius_m <= previous * RADIUS_HYSTERESIS:
+                return previous
+            self._radii[key] = radius_m
+        return radius_m
+
+
+def snap_radius(radius_m, min_m, max_m):
+    """Round a radius to the nearest step of RADIUS_STEP above min_m, within [min_m, max_m]."""
+    if radius_m <= min_m:
+        return int(min_m)
+    steps = round(math.log(radius_m / min_m, RADIUS_STEP))
+    return int(min(max_m, min_m * RADIUS_STEP ** steps))
+
+
+# The catalog shared by get_restaurants and get_city_attractions
+catalog = PlaceCatalog()
+# Result densities learned by get_restaurants and get_city_attractions
+densities = DensityMap()
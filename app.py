@@ -7,13 +7,24 @@ import subprocess
 import uuid
 import time
 from typing import Dict, List, Any, Optional
+import metrics
+import tracing
+import loop_watchdog
 
 app = FastAPI(title="Travel Itinerary API", description="API for generating travel itineraries")
+metrics.add_metrics_route(app)
+loop_watchdog.add_watchdog(app)
+
+TRAVEL_REQUESTS = metrics.Counter("exploreease_travel_requests_total", "Travel requests by final status.",
+                                  ["status"])
 
 # Store for tracking request status
 request_status = {}
 
-async def process_travel_request(request_id: str, travel_request: Dict[str, Any]):
+async def process_travel_request(request_id: str, travel_request: Dict[str, Any], profile: bool = False):
+    # The request id doubles as the trace id, so a request's spans are easy to find
+    request_span = tracing.start_span("app.process_travel_request", parent=tracing.SpanContext(uuid.UUID(request_id).hex, None),
+                                      kind="server", attributes={"request_id": request_id})
     try:
         # Create a unique directory for this request
         request_dir = f"requests/{request_id}"
@@ -27,6 +38,11 @@ async def process_travel_request(request_id: str, travel_request: Dict[str, Any]
         # Set environment variables for the client agent
         env = os.environ.copy()
         env["INPUT_FILE_PATH"] = input_file_path
+        env["REQUEST_ID"] = request_id
+        env["TRACEPARENT"] = tracing.to_traceparent(request_span)
+        if profile:
+            # The client and both agents write their profiles next to the request's logs
+            env["PROFILE_DIR"] = os.path.abspath(request_dir)
         
         # Run the client agent as a subprocess
         client_process = subprocess.Popen(
@@ -46,7 +62,9 @@ async def process_travel_request(request_id: str, travel_request: Dict[str, Any]
         
         # Wait for the process to complete (with timeout)
         try:
-            stdout, stderr = client_process.communicate(timeout=300)  # 5 minutes timeout
+            with metrics.in_flight("travel_request"), metrics.stage_timer("client_agent"):
+                # In a thread, so the API keeps serving status requests meanwhile
+                stdout, stderr = await asyncio.to_thread(client_process.communicate, timeout=300)  # 5 minutes timeout
             
             # Log the output for debugging
             with open(f"{request_dir}/client_stdout.log", 'wb') as f:
@@ -90,15 +108,21 @@ async def process_travel_request(request_id: str, travel_request: Dict[str, Any]
             "status": "failed", 
             "error": str(e)
         }
+    finally:
+        TRAVEL_REQUESTS.labels(request_status[request_id]["status"]).inc()
+        request_span.set_attribute("status", request_status[request_id]["status"])
+        request_span.end()
 
 @app.post("/travel/request", response_model=Dict[str, str])
 async def create_travel_request(
     travel_request: Dict[str, Any],
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    profile: bool = False
 ):
     """
     Submit a travel request to generate an itinerary.
     Returns a request ID that can be used to check the status and retrieve results.
+    With ?profile=true, CPU and memory profiles are written to requests/<request_id>/.
     """
     required_fields = ["prompt", "preferences", "date_from", "date_to", "location"]
     for field in required_fields:
@@ -111,7 +135,7 @@ async def create_travel_request(
     request_id = str(uuid.uuid4())
     request_status[request_id] = {"status": "pending"}
     
-    background_tasks.add_task(process_travel_request, request_id, travel_request)
+    background_tasks.add_task(process_travel_request, request_id, travel_request, profile)
     
     return {"request_id": request_id, "status": "pending"}
 
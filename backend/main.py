@@ -2,6 +2,8 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import os
+import metrics
+import loop_watchdog
 from backend.routes.calendar import router as calendar_router
 from backend.routes.preferences import router as preferences_router
 from backend.routes.recommendations import router as recommendations_router
@@ -16,6 +18,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+metrics.add_metrics_route(app)
+loop_watchdog.add_watchdog(app)
 
 # Include routers
 app.include_router(preferences_router, prefix="/api", tags=["preferences"])
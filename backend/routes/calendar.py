@@ -2,8 +2,10 @@ from fastapi import APIRouter, HTTPException, Body
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+from backend.services.google_calendar_manager import GoogleCalendarManager, CalendarNotAuthorized
 
 router = APIRouter()
+calendar_manager = GoogleCalendarManager()
 
 class GoogleToken(BaseModel):
     access_token: str
@@ -17,6 +19,12 @@ class CalendarEventData(BaseModel):
     end_time: datetime
     location: Optional[str] = None
 
+class ItineraryExportData(BaseModel):
+    itinerary: List[Dict[str, Any]]
+    calendar_id: str = "primary"
+    time_zone: Optional[str] = None
+    trip_key: Optional[str] = None
+
 @router.get("/calendar/status")
 async def calendar_status():
     """Check if user is authenticated with Google Calendar"""
@@ -45,4 +53,21 @@ async def export_to_calendar(event_data: CalendarEventData):
 async def add_calendar_event(event_data: CalendarEventData):
     """Add a single event to Google Calendar using agents"""
     # This will be integrated with your InfoAgent
-    return {"success": True, "event_id": "sample_event_id"}
\ No newline at end of file
+    return {"success": True, "event_id": "sample_event_id"}
+
+@router.post("/calendar/export-itinerary")
+async def export_itinerary(export_data: ItineraryExportData):
+    """Export a whole itinerary to Google Calendar in batch requests.
+    Safe to retry: items that were already exported are reported as existing."""
+    try:
+        result = await calendar_manager.export_itinerary(
+            export_data.itinerary,
+            calendar_id=export_data.calendar_id,
+            time_zone=export_data.time_zone,
+            trip_key=export_data.trip_key
+        )
+    except CalendarNotAuthorized as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Calendar export failed: {e}")
+    return {"success": result["failed"] == 0, **result}
@@ -1,7 +1,16 @@
 import os
+import sys
+import asyncio
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 
+# The calendar implementation lives with the InfoAgent
+INFO_AGENT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "InfoAgent")
+
+class CalendarNotAuthorized(Exception):
+    """The user has no stored Google token that can be used (or refreshed) without signing in."""
+
+
 class GoogleCalendarManager:
     """
     This class will be the interface between your FastAPI backend and your agents.
@@ -39,4 +48,27 @@ class GoogleCalendarManager:
             "success": True,
             "event_id": "dummy_event_id",
             "message": "Event would be created by your agents"
-        }
\ No newline at end of file
+        }
+        
+    async def export_itinerary(self, itinerary: List[Dict[str, Any]], calendar_id: str = "primary",
+                               time_zone: Optional[str] = None, trip_key: Optional[str] = None) -> Dict[str, Any]:
+        """Export a whole itinerary to the user's Google Calendar in batch requests"""
+        if INFO_AGENT_DIR not in sys.path:
+            sys.path.append(INFO_AGENT_DIR)
+        from calendar_api import GoogleCalendarManager as CalendarClient, CalendarAuthError
+        
+        def export():
+            # Never start the browser sign-in flow from a request worker
+            try:
+                calendar = CalendarClient(
+                    credentials_file=os.path.join(INFO_AGENT_DIR, "credentials.json"),
+                    token_file=os.path.join(INFO_AGENT_DIR, "token.pickle"),
+                    interactive=False
+                )
+            except CalendarAuthError as e:
+                raise CalendarNotAuthorized(str(e)) from e
+            return calendar.export_itinerary(itinerary, calendar_id=calendar_id,
+                                             time_zone=time_zone, trip_key=trip_key)
+        
+        # The Google client is blocking, so keep it off the event loop
+        return await asyncio.to_thread(export)
@@ -0,0 +1,70 @@
+"""
+Helpers shared by the benchmark scripts: percentiles, process stats and results files.
+"""
+import os
+import sys
+import json
+import platform
+import resource
+import subprocess
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile of a list of numbers (q in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(benchmark, payload, output=None):
+    """
+    Write a results file tagged with the commit and environment.
+
+    Returns:
+        The path of the written file
+    """
+    commit = git_commit()
+    results = {
+        "benchmark": benchmark,
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "argv": sys.argv[1:],
+    }
+    results.update(payload)
+    output = output or os.path.join(
+        DEFAULT_RESULTS_DIR, f"{benchmark}-{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    return output
+
+
+def load_results(path):
+    with open(path, "r") as f:
+        return json.load(f)
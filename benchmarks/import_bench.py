@@ -0,0 +1,138 @@
+"""
+Import-time benchmark for the agents, the APIs and the modules they load.
+
+Each target is imported in a fresh interpreter with `python -X importtime`, from the
+directory its process is started in (the agents run from InfoAgent/ and MapAgent/). For
+every target it reports the median import time, the median wall time of the whole
+process (interpreter start-up included) and the packages that take the most of it, so
+a new eager import of a heavy client library shows up as a regression.
+
+Usage:
+    python benchmarks/import_bench.py
+    python benchmarks/import_bench.py --only map_func calendar_api --repeat 10
+    python benchmarks/import_bench.py --baseline benchmarks/results/<previous>.json
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+from collections import defaultdict
+
+from bench_common import ROOT_DIR, percentile, write_results, load_results
+
+# (name, directory the process starts in, module to import)
+TARGETS = [
+    ("map_utils", "MapAgent", "map_utils"),
+    ("map_func", "MapAgent", "map_func"),
+    ("mapagent", "MapAgent", "mapagent"),
+    ("llm_utils", "InfoAgent", "llm_utils"),
+    ("calendar_api", "InfoAgent", "calendar_api"),
+    ("info_agent", "InfoAgent", "info_agent"),
+    ("client_agent", ".", "client_agent"),
+    ("app", ".", "app"),
+    ("backend.main", ".", "backend.main"),
+    ("frontend.app", "frontend", "app"),
+]
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output.
+
+    Returns:
+        List of (module, self_us, cumulative_us, depth) in the order they were printed
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def import_once(directory, module):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             cwd=os.path.join(ROOT_DIR, directory), capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{process.stderr[-2000:]}")
+    return wall, parse_importtime(process.stderr)
+
+
+def measure(directory, module, repeat, top):
+    walls, imports = [], []
+    packages = defaultdict(list)
+    for _ in range(repeat):
+        wall, rows = import_once(directory, module)
+        walls.append(wall)
+        imports.append(next((cumulative for name, _, cumulative, depth in rows
+                             if name == module and depth == 0), 0))
+        # Self time summed per top-level package
+        totals = defaultdict(int)
+        for name, self_us, _, _ in rows:
+            totals[name.split(".")[0]] += self_us
+        for package, total in totals.items():
+            packages[package].append(total)
+    heaviest = sorted(((package, percentile(values, 50) / 1000) for package, values in packages.items()),
+                      key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "import_ms": percentile(imports, 50) / 1000,
+        "process_ms": percentile(walls, 50) * 1000,
+        "modules": len(rows),
+        "heaviest_packages": [{"package": package, "self_ms": ms} for package, ms in heaviest],
+    }
+
+
+def print_results(results):
+    print(f"\n{'target':<16}{'import ms':>12}{'process ms':>12}{'modules':>9}  heaviest packages (self ms)")
+    for row in results:
+        heaviest = ", ".join(f"{p['package']} {p['self_ms']:.0f}" for p in row["heaviest_packages"])
+        print(f"{row['target']:<16}{row['import_ms']:>12.1f}{row['process_ms']:>12.1f}{row['modules']:>9}  {heaviest}")
+
+
+def print_comparison(baseline_path, results):
+    baseline = load_results(baseline_path)
+    previous = {row["target"]: row for row in baseline["results"]}
+    print(f"\nCompared with {baseline.get('commit', '?')} ({baseline_path}):")
+    for row in results:
+        before = previous.get(row["target"])
+        if not before or not before["import_ms"]:
+            continue
+        delta = (row["import_ms"] - before["import_ms"]) / before["import_ms"] * 100
+        print(f"  {row['target']:<16}import {before['import_ms']:8.1f} -> {row['import_ms']:8.1f} ms ({delta:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark for the agents and APIs")
+    parser.add_argument("--only", nargs="+", default=None, help="Only import these targets")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument("--top", type=int, default=5, help="Heaviest packages to report per target")
+    parser.add_argument("--output", default=None, help="Results file (default: benchmarks/results/...)")
+    parser.add_argument("--baseline", default=None, help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for name, directory, module in TARGETS:
+        if args.only and name not in args.only:
+            continue
+        try:
+            measurement = measure(directory, module, args.repeat, args.top)
+        except RuntimeError as e:
+            print(f"{name}: {e}", file=sys.stderr)
+            continue
+        results.append(dict(target=name, **measurement))
+        print(f"{name}: {measurement['import_ms']:.1f} ms", file=sys.stderr)
+
+    print_results(results)
+    output = write_results("import", {"repeat": args.repeat, "results": results}, args.output)
+    print(f"\nResults written to {output}")
+    if args.baseline:
+        print_comparison(args.baseline, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Microbenchmarks for the MapAgent helpers and GoogleCalendarManager.find_free_time.
+
+Inputs are generated from MapAgent/attractions.json (places copied with unique names
+and jittered coordinates, as Place records) and scaled from 10 to 5,000 places/events. For every function
+and size it reports time per call and memory allocated per call (tracemalloc), plus
+the growth exponent between consecutive sizes (~1 linear, ~2 quadratic), so the
+quadratic parts stand out and can be tracked across commits. extract_location_data is
+timed over the whole batch of n places, the way collect_unique_locations calls it.
+
+No network calls are made: find_free_time runs against an in-memory fake Calendar
+service, and no API keys are needed.
+
+Usage:
+    python benchmarks/micro_bench.py
+    python benchmarks/micro_bench.py --sizes 10 100 1000 --only create_distance_matrix
+    python benchmarks/micro_bench.py --baseline benchmarks/results/<previous>.json
+"""
+import os
+import sys
+import copy
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+
+from bench_common import ROOT_DIR, percentile, write_results, load_results
+
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, "InfoAgent"), os.path.join(ROOT_DIR, "MapAgent")]
+
+from place import Place
+
+DEFAULT_SIZES = [10, 100, 500, 1000, 5000]
+# create_distance_matrix and create_itinerary_prompt are O(n^2) in time and memory;
+# above this size they are skipped unless the cap is raised
+DEFAULT_QUADRATIC_CAP = 1000
+FIXTURE = os.path.join(ROOT_DIR, "MapAgent", "attractions.json")
+
+
+def make_places(count, seed=0):
+    """Copy fixture places until there are `count`, each with a unique name and position."""
+    with open(FIXTURE, "r") as f:
+        fixture = json.load(f)
+    rng = random.Random(seed)
+    places = []
+    for i in range(count):
+        place = copy.deepcopy(fixture[i % len(fixture)])
+        place["name"] = f"{place['name']} #{i}"
+        place["place_id"] = f"{place.get('place_id', 'place')}-{i}"
+        location = place["geometry"]["location"]
+        location["lat"] += rng.uniform(-0.05, 0.05)
+        location["lng"] += rng.uniform(-0.05, 0.05)
+        places.append(Place.from_google(place))
+    return places
+
+
+def make_slots(days, start=datetime(2025, 4, 15, 9, 0)):
+    slots = []
+    for day in range(days):
+        slot_start = start + timedelta(days=day)
+        slots.append({
+            "start": slot_start.strftime("%Y-%m-%d %H:%M"),
+            "end": slot_start.replace(hour=22).strftime("%Y-%m-%d %H:%M"),
+            "start_location": {"name": "Hotel", "coordinates": {"lat": 35.68, "lng": 139.76}},
+            "end_location": {"name": "Hotel", "coordinates": {"lat": 35.68, "lng": 139.76}},
+        })
+    return slots
+
+
+def make_itinerary_data(places):
+    third = max(1, len(places) // 3)
+    return {
+        "free_time_slots": make_slots(max(1, len(places) // 10)),
+        "attractions": places[:third],
+        "restaurants": {"lunch": places[third:2 * third], "dinner": places[2 * third:]},
+    }
+
+
+def make_itinerary(places):
+    """An LLM-style itinerary visiting every place, with coordinates left for post-processing."""
+    itinerary = []
+    cursor = datetime(2025, 4, 15, 9, 0)
+    for i, place in enumerate(places):
+        itinerary.append({
+            "type": ("attraction", "lunch", "dinner")[i % 3],
+            "time": cursor.strftime("%Y-%m-%d %H:%M"),
+            "end_time": (cursor + timedelta(hours=1)).strftime("%Y-%m-%d %H:%M"),
+            "location": place.name,
+            "coordinates": {"lat": 0.0, "lng": 0.0},
+            "description": f"Visit {place.name}",
+        })
+        cursor += timedelta(hours=1)
+    return itinerary
+
+
+class FakeCalendarService:
+    """In-memory stand-in for the parts of the Calendar v3 service find_free_time uses."""
+
+    PAGE_SIZE = 250
+
+    def __init__(self, events, time_zone="UTC"):
+        self.items = sorted(events, key=lambda e: e["start"]["dateTime"])
+        self.bounds = [(datetime.fromisoformat(e["start"]["dateTime"]), datetime.fromisoformat(e["end"]["dateTime"]))
+                       for e in self.items]
+        self.time_zone = time_zone
+
+    class _Request:
+        def __init__(self, result):
+            self.result = result
+
+        def execute(self):
+            return self.result
+
+    def calendars(self):
+        return self
+
+    def events(self):
+        return self
+
+    def get(self, calendarId):
+        return self._Request({"id": calendarId, "timeZone": self.time_zone})
+
+    def list(self, calendarId, timeMin, timeMax, pageToken=None, **kwargs):
+        window_start, window_end = datetime.fromisoformat(timeMin), datetime.fromisoformat(timeMax)
+        matching = [event for event, (start, end) in zip(self.items, self.bounds)
+                    if start < window_end and end > window_start]
+        offset = int(pageToken or 0)
+        result = {"items": matching[offset:offset + self.PAGE_SIZE]}
+        if offset + self.PAGE_SIZE < len(matching):
+            result["nextPageToken"] = str(offset + self.PAGE_SIZE)
+        return self._Request(result)
+
+
+def make_events(count, seed=0):
+    """`count` non-overlapping-ish 30-90 minute events, about eight per day."""
+    rng = random.Random(seed)
+    events = []
+    start = datetime(2025, 4, 15, 8, 0, tzinfo=timezone.utc)
+    for i in range(count):
+        day, slot = divmod(i, 8)
+        event_start = start + timedelta(days=day, minutes=slot * 90 + rng.randrange(0, 30))
+        event_end = event_start + timedelta(minutes=rng.choice([30, 60, 90]))
+        events.append({
+            "id": f"event{i}",
+            "start": {"dateTime": event_start.isoformat()},
+            "end": {"dateTime": event_end.isoformat()},
+            "location": f"Place {i % 50}",
+        })
+    days = count // 8 + 1
+    return events, start, start + timedelta(days=days)
+
+
+def build_cases(size, quadratic_cap):
+    """
+    Prepare the benchmark cases for one input size.
+
+    Returns:
+        A list of (name, setup, function) where setup() builds fresh arguments (not timed)
+        and function(*arguments) is the call being measured
+    """
+    from map_func import (create_distance_matrix, extract_location_data, create_itinerary_prompt,
+                          extract_json_from_response, post_process_itinerary, collect_unique_locations,
+                          estimate_travel_time)
+    from candidate_pruning import prune_candidates
+    from calendar_api import GoogleCalendarManager
+
+    places = make_places(size)
+    itinerary_data = make_itinerary_data(places)
+    unique_locations = collect_unique_locations(itinerary_data)
+    itinerary = make_itinerary(places)
+    response_text = "Here is your itinerary:\n" + json.dumps(itinerary, indent=2) + "\nEnjoy your trip!"
+
+    events, range_start, range_end = make_events(size)
+    calendar = GoogleCalendarManager(service=FakeCalendarService(events))
+    date_from = range_start.strftime("%Y-%m-%d %H:%M")
+    date_to = range_end.strftime("%Y-%m-%d %H:%M")
+
+    slot = make_slots(1)[0]
+    slot_start = slot["start_location"]["coordinates"]
+    slot_end = slot["end_location"]["coordinates"]
+
+    cases = [
+        ("extract_location_data", lambda: (places,),
+         lambda batch: [extract_location_data(place) for place in batch]),
+        ("prune_candidates", lambda: (places,),
+         lambda batch: prune_candidates(batch, slot_start, slot_end, 13 * 60, "attraction", estimate_travel_time)),
+        ("extract_json_from_response", lambda: (response_text,), extract_json_from_response),
+        ("post_process_itinerary", lambda: (copy.deepcopy(itinerary), unique_locations), post_process_itinerary),
+        ("find_free_time", lambda: (date_from, date_to),
+         lambda start, end: calendar.find_free_time(start, end, default_location="Hotel")),
+    ]
+    if size <= quadratic_cap:
+        distance_matrix = create_distance_matrix(unique_locations)
+        cases += [
+            ("create_distance_matrix", lambda: (unique_locations,), create_distance_matrix),
+            ("create_itinerary_prompt", lambda: (itinerary_data, distance_matrix), create_itinerary_prompt),
+        ]
+    return cases
+
+
+def measure(setup, function, min_time, max_repeats):
+    """Time repeated calls (median of runs) and measure the allocations of one call."""
+    timings = []
+    total = 0.0
+    while len(timings) < max_repeats and (total < min_time or len(timings) < 3):
+        arguments = setup()
+        start = time.perf_counter()
+        function(*arguments)
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        total += elapsed
+
+    arguments = setup()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    result = function(*arguments)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename") if stat.size_diff > 0)
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    del result
+
+    return {
+        "time_s": percentile(timings, 50),
+        "time_min_s": min(timings),
+        "repeats": len(timings),
+        "alloc_peak_kb": peak / 1024,
+        "alloc_retained_kb": allocated / 1024,
+        "alloc_blocks": blocks,
+    }
+
+
+def add_growth(results):
+    """Annotate each measurement with the log-log slope from the previous size."""
+    by_name = {}
+    for row in results:
+        by_name.setdefault(row["function"], []).append(row)
+    for rows in by_name.values():
+        rows.sort(key=lambda row: row["size"])
+        for previous, row in zip(rows, rows[1:]):
+            if previous["time_s"] and row["time_s"]:
+                row["growth"] = math.log(row["time_s"] / previous["time_s"]) / math.log(row["size"] / previous["size"])
+
+
+def print_results(results):
+    print(f"\n{'function':<28}{'size':>6}{'time/call':>12}{'peak alloc':>13}{'retained':>11}{'blocks':>9}{'growth':>8}")
+    for row in sorted(results, key=lambda row: (row["function"], row["size"])):
+        growth = f"{row['growth']:.2f}" if "growth" in row else "-"
+        print(f"{row['function']:<28}{row['size']:>6}{row['time_s'] * 1000:>10.3f}ms"
+              f"{row['alloc_peak_kb']:>10.1f} KB{row['alloc_retained_kb']:>8.1f} KB{row['alloc_blocks']:>9}{growth:>8}")
+
+
+def print_comparison(baseline_path, results):
+    baseline = load_results(baseline_path)
+    previous = {(row["function"], row["size"]): row for row in baseline["results"]}
+    print(f"\nCompared with {baseline.get('commit', '?')} ({baseline_path}):")
+    for row in sorted(results, key=lambda row: (row["function"], row["size"])):
+        before = previous.get((row["function"], row["size"]))
+        if not before or not before["time_s"]:
+            continue
+        time_delta = (row["time_s"] - before["time_s"]) / before["time_s"] * 100
+        alloc_delta = row["alloc_peak_kb"] - before["alloc_peak_kb"]
+        print(f"  {row['function']:<28}{row['size']:>6}  time {time_delta:+6.1f}%  peak alloc {alloc_delta:+.1f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for MapAgent helpers and free-time search")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--only", nargs="+", default=None, help="Only run these functions")
+    parser.add_argument("--quadratic-cap", type=int, default=DEFAULT_QUADRATIC_CAP,
+                        help="Largest size for the O(n^2) distance matrix and prompt benchmarks")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds spent timing each case")
+    parser.add_argument("--max-repeats", type=int, default=200)
+    parser.add_argument("--output", default=None, help="Results file (default: benchmarks/results/...)")
+    parser.add_argument("--baseline", default=None, help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = []
+    for size in args.sizes:
+        for name, setup, function in build_cases(size, args.quadratic_cap):
+            if args.only and name not in args.only:
+                continue
+            # The helpers print diagnostics; keep them out of the timings and the report
+            with redirect_stdout(open(os.devnull, "w")):
+                measurement = measure(setup, function, args.min_time, args.max_repeats)
+            results.append(dict(function=name, size=size, **measurement))
+            print(f"{name} n={size}: {measurement['time_s'] * 1000:.3f} ms", file=sys.stderr)
+
+    add_growth(results)
+    print_results(results)
+    output = write_results("micro", {"sizes": args.sizes, "quadratic_cap": args.quadratic_cap,
+                                     "results": results}, args.output)
+    print(f"\nResults written to {output}")
+    if args.baseline:
+        print_comparison(args.baseline, results)
+
+
+if __name__ == "__main__":
+    main()
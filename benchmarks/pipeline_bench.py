@@ -0,0 +1,360 @@
+"""
+End-to-end benchmark of the TravelRequest -> TravelPlan -> ItineraryResponse pipeline.
+
+Runs the same stages the agents run (InfoAgent: keyword LLM call and calendar free time;
+MapAgent: place collection, distance matrix, itinerary LLM call and post-processing)
+in-process, against the local stand-ins in stubs/ or a recorded HTTP cassette, at a
+sweep of concurrency levels. For each level it reports latency percentiles, throughput,
+a per-stage breakdown, API call counts and peak RSS, and writes everything to a JSON
+file under benchmarks/results/ so runs can be compared across commits.
+
+Usage:
+    python stubs/google_stub.py --latency lognormal:150:0.5 &
+    python stubs/anthropic_stub.py --ttft lognormal:600:0.3 &
+    export GOOGLE_MAPS_BASE_URL=http://127.0.0.1:8100 GOOGLE_CALENDAR_BASE_URL=http://127.0.0.1:8100
+    export GOOGLE_PLACES_API_KEY=AIzaStubKey ANTHROPIC_BASE_URL=http://127.0.0.1:8200 CLAUDE_API=stub
+
+    python benchmarks/pipeline_bench.py --corpus default --corpus saved --corpus synthetic:20
+    python benchmarks/pipeline_bench.py --concurrency 1 8 --baseline benchmarks/results/<previous>.json
+
+Corpora:
+    default        travel_request.json in the repo root
+    saved          requests/*/travel_request.json saved by app.py
+    synthetic:N    N generated multi-day trips (seeded by --seed)
+    <file>.jsonl   one TravelRequest JSON object per line
+    <file>.json    a single TravelRequest
+"""
+import os
+import sys
+import json
+import glob
+import time
+import random
+import asyncio
+import logging
+import argparse
+import urllib.request
+from contextlib import contextmanager, redirect_stdout, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from bench_common import ROOT_DIR, percentile, peak_rss_mb, write_results, load_results
+
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, "InfoAgent"), os.path.join(ROOT_DIR, "MapAgent")]
+
+from models import TravelRequest, TravelPlan, ItineraryResponse
+import http_cassette
+import tracing
+
+logger = logging.getLogger("pipeline_bench")
+
+DEFAULT_CONCURRENCY = [1, 8, 32, 128]
+STAGES = ["keywords", "free_time", "collect_places", "unique_locations", "distance_matrix",
+          "itinerary_llm", "post_process"]
+
+SYNTHETIC_CITIES = ["Los Angeles", "San Francisco", "New York", "Chicago", "Seattle", "Paris", "Tokyo"]
+SYNTHETIC_INTERESTS = ["beaches", "entertainment", "food", "landmarks", "museums", "nightlife",
+                       "parks", "shopping", "history", "art"]
+
+
+def load_corpus(specs, seed=0):
+    """Load TravelRequest dictionaries from the corpus specs described in the module docstring."""
+    corpus = []
+    for spec in specs:
+        if spec == "default":
+            with open(os.path.join(ROOT_DIR, "travel_request.json"), "r") as f:
+                corpus.append(json.load(f))
+        elif spec == "saved":
+            for path in sorted(glob.glob(os.path.join(ROOT_DIR, "requests", "*", "travel_request.json"))):
+                with open(path, "r") as f:
+                    corpus.append(json.load(f))
+        elif spec.startswith("synthetic:"):
+            corpus.extend(synthetic_requests(int(spec.split(":", 1)[1]), seed))
+        elif spec.endswith(".jsonl"):
+            with open(spec, "r") as f:
+                corpus.extend(json.loads(line) for line in f if line.strip())
+        else:
+            with open(spec, "r") as f:
+                corpus.append(json.load(f))
+    # Validate up front so a bad corpus entry fails before any timing starts
+    return [TravelRequest(**request).dict() for request in corpus]
+
+
+def synthetic_requests(count, seed=0):
+    """Generate multi-day trips with varied cities, lengths and preferences."""
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        city = rng.choice(SYNTHETIC_CITIES)
+        start = datetime(2025, 5, 1, 9, 0) + timedelta(days=rng.randrange(60))
+        end = (start + timedelta(days=rng.randint(0, 4))).replace(hour=rng.choice([18, 20, 22]))
+        min_budget = rng.randint(0, 2)
+        requests.append({
+            "prompt": f"Plan a {(end.date() - start.date()).days + 1}-day trip to {city}",
+            "preferences": {
+                "travel_style": rng.choice(["relaxed", "balanced", "packed"]),
+                "food_preference": rng.choice(["local cuisine", "vegetarian", "seafood", "street food"]),
+                "budget": f"{min_budget}-{rng.randint(min_budget + 1, 4)}",
+                "transport_mode": rng.choice(["car", "walking", "transit"]),
+                "time_preference": rng.choice(["morning", "afternoon", "evening"]),
+                "activity_intensity": rng.choice(["light", "moderate", "high"]),
+                "interests": rng.sample(SYNTHETIC_INTERESTS, rng.randint(2, 5)),
+                "custom_preferences": ""
+            },
+            "date_from": start.strftime("%Y-%m-%d %H:%M"),
+            "date_to": end.strftime("%Y-%m-%d %H:%M"),
+            "location": city
+        })
+    return requests
+
+
+@contextmanager
+def stage(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+def run_info_stages(request, timings):
+    """What InfoAgent's handle_travel_request does, stage by stage."""
+    from info_agent import call_llm, extract_response, get_calendar_manager
+
+    with stage(timings, "keywords"):
+        response = call_llm(request)
+        if not isinstance(response, str):
+            raise RuntimeError(f"Keyword LLM call failed: {response}")
+        response_dict = extract_response(response)
+        if response_dict is None:
+            raise RuntimeError("Could not extract keywords from the LLM response")
+
+    with stage(timings, "free_time"):
+        calendar = get_calendar_manager()
+        free_times = calendar.find_free_time(request["date_from"], request["date_to"],
+                                             default_location=request["location"])
+
+    return TravelPlan(
+        free_times=free_times,
+        attractions=response_dict.get('attractions', ([], 0, 0)),
+        events=response_dict.get('events', ([], 0, 0)),
+        lunch=response_dict.get('lunch', ("", 0, 0)),
+        dinner=response_dict.get('dinner', ("", 0, 0)),
+    )
+
+
+async def run_map_stages(plan, timings):
+    """What MapAgent.generate_itinerary does, stage by stage."""
+    from map_func import (collect_itinerary_data, collect_unique_locations, create_distance_matrix,
+                          generate_optimized_itinerary, post_process_itinerary)
+
+    with stage(timings, "collect_places"):
+        itinerary_data = await asyncio.to_thread(
+            collect_itinerary_data, plan.free_times, plan.attractions, plan.events, plan.lunch, plan.dinner
+        )
+    with stage(timings, "unique_locations"):
+        unique_locations = collect_unique_locations(itinerary_data)
+    with stage(timings, "distance_matrix"):
+        distance_matrix = create_distance_matrix(unique_locations)
+    with stage(timings, "itinerary_llm"):
+        optimized_itinerary = await generate_optimized_itinerary(itinerary_data, distance_matrix)
+    if not optimized_itinerary:
+        raise RuntimeError("Itinerary LLM call returned no itinerary")
+    with stage(timings, "post_process"):
+        final_itinerary = post_process_itinerary(optimized_itinerary, unique_locations)
+    return ItineraryResponse(itinerary=final_itinerary)
+
+
+async def run_one(request):
+    """Run one request through the whole pipeline and return its measurements."""
+    timings = {}
+    start = time.perf_counter()
+    try:
+        # With TRACE_EXPORTER set, every benchmark request is recorded as a trace
+        with tracing.span("pipeline_bench.request", location=request["location"]):
+            plan = await asyncio.to_thread(run_info_stages, request, timings)
+            response = await run_map_stages(plan, timings)
+        error = None
+        items = len(response.itinerary)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        items = 0
+    return {"latency": time.perf_counter() - start, "stages": timings, "error": error, "items": items}
+
+
+async def run_level(corpus, concurrency, total):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(request):
+        async with semaphore:
+            return await run_one(request)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bounded(corpus[i % len(corpus)]) for i in range(total)))
+    return results, time.perf_counter() - start
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values),
+        "max": max(values),
+    }
+
+
+def stub_stats(base_url, reset=False):
+    """
+    Read (or reset) a stand-in server's /_stats counters.
+
+    Uses urllib rather than requests/httpx so the call bypasses an installed cassette.
+    """
+    if not base_url:
+        return None
+    url = f"{base_url.rstrip('/')}/_stats" + ("/reset" if reset else "")
+    try:
+        request = urllib.request.Request(url, method="POST" if reset else "GET")
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+
+def stats_endpoints():
+    return {
+        "google": os.environ.get("GOOGLE_MAPS_BASE_URL") or os.environ.get("GOOGLE_CALENDAR_BASE_URL"),
+        "anthropic": os.environ.get("ANTHROPIC_BASE_URL"),
+    }
+
+
+def level_report(concurrency, results, wall_time, api_calls):
+    latencies = [r["latency"] for r in results if r["error"] is None]
+    errors = [r["error"] for r in results if r["error"] is not None]
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "wall_time_s": wall_time,
+        "throughput_rps": len(latencies) / wall_time if wall_time else 0.0,
+        "latency_s": summarize(latencies),
+        "stages_s": {name: summarize([r["stages"][name] for r in results if name in r["stages"]])
+                     for name in STAGES},
+        "api_calls": api_calls,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def print_level(report):
+    latency = report["latency_s"] or {}
+
+    def ms(value):
+        return f"{value * 1000:8.1f}" if value is not None else "       -"
+
+    print(f"\nconcurrency={report['concurrency']:<4} requests={report['requests']:<5} "
+          f"errors={report['errors']:<4} throughput={report['throughput_rps']:.2f} req/s "
+          f"peak_rss={report['peak_rss_mb']:.0f} MB")
+    print(f"  latency ms   p50 {ms(latency.get('p50'))}  p95 {ms(latency.get('p95'))}  "
+          f"p99 {ms(latency.get('p99'))}")
+    for name, summary in report["stages_s"].items():
+        if summary:
+            print(f"  {name:<17} p50 {ms(summary['p50'])}  p95 {ms(summary['p95'])}")
+    for server, stats in report["api_calls"].items():
+        if stats:
+            calls = ", ".join(f"{k}={v}" for k, v in sorted(stats.items()))
+            print(f"  {server} calls: {calls}")
+    for error in report["error_samples"]:
+        print(f"  error: {error}")
+
+
+def print_comparison(baseline_path, levels):
+    baseline = load_results(baseline_path)
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    print(f"\nCompared with {baseline.get('commit', '?')} ({baseline_path}):")
+    for level in levels:
+        before = previous.get(level["concurrency"])
+        if not before or not before["latency_s"] or not level["latency_s"]:
+            continue
+        deltas = []
+        for q in ("p50", "p95", "p99"):
+            old, new = before["latency_s"][q], level["latency_s"][q]
+            deltas.append(f"{q} {(new - old) / old * 100:+.1f}%")
+        old_rps, new_rps = before["throughput_rps"], level["throughput_rps"]
+        if old_rps:
+            deltas.append(f"throughput {(new_rps - old_rps) / old_rps * 100:+.1f}%")
+        print(f"  concurrency={level['concurrency']:<4} " + "  ".join(deltas))
+
+
+async def main_async(args, corpus):
+    # The default executor backs asyncio.to_thread and run_in_executor; size it so it
+    # never becomes the concurrency limit being measured
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=max(32, 2 * max(args.concurrency)))
+    )
+
+    with (nullcontext() if args.verbose else redirect_stdout(open(os.devnull, "w"))):
+        for request in corpus[:args.warmup]:
+            await run_one(request)
+
+    levels = []
+    endpoints = stats_endpoints()
+    for concurrency in args.concurrency:
+        total = args.requests or max(len(corpus), 4 * concurrency)
+        for base_url in endpoints.values():
+            stub_stats(base_url, reset=True)
+        # map_utils prints every Places query; keep that out of the report unless asked for
+        with (nullcontext() if args.verbose else redirect_stdout(open(os.devnull, "w"))):
+            results, wall_time = await run_level(corpus, concurrency, total)
+        api_calls = {server: stub_stats(base_url) for server, base_url in endpoints.items()}
+        report = level_report(concurrency, results, wall_time, api_calls)
+        print_level(report)
+        levels.append(report)
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark with a concurrency sweep")
+    parser.add_argument("--corpus", action="append", default=None,
+                        help="default, saved, synthetic:N or a .json/.jsonl file (repeatable)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--requests", type=int, default=None,
+                        help="Requests per concurrency level (default: max(corpus size, 4 x concurrency))")
+    parser.add_argument("--warmup", type=int, default=1, help="Requests to run before measuring")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for synthetic trips")
+    parser.add_argument("--output", default=None, help="Results file (default: benchmarks/results/...)")
+    parser.add_argument("--baseline", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the agents' own output")
+    parser.add_argument("--allow-live", action="store_true",
+                        help="Run even though no stand-in or cassette is configured (uses real API quota)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    cassette = http_cassette.install_from_env()
+    if cassette is None and not args.allow_live and not all(stats_endpoints().values()):
+        parser.error("Point GOOGLE_*_BASE_URL and ANTHROPIC_BASE_URL at the stand-ins in stubs/, "
+                     "set HTTP_CASSETTE_MODE=replay, or pass --allow-live")
+
+    corpus = load_corpus(args.corpus or ["default"], seed=args.seed)
+    # The agent modules configure DEBUG logging on import; keep the benchmark output readable
+    import info_agent  # noqa: F401
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"Corpus: {len(corpus)} requests, concurrency sweep {args.concurrency}")
+    levels = asyncio.run(main_async(args, corpus))
+
+    output = write_results("pipeline", {
+        "cassette": os.environ.get("HTTP_CASSETTE_MODE", "off"),
+        "corpus": {"specs": args.corpus or ["default"], "size": len(corpus)},
+        "levels": levels,
+    }, args.output)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        print_comparison(args.baseline, levels)
+
+
+if __name__ == "__main__":
+    main()
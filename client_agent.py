@@ -12,6 +12,10 @@ sys.path.append(os.path.abspath(".."))
 logging.basicConfig(level=logging.DEBUG)
 
 from models import TravelRequest, TravelPlan, ItineraryResponse
+import http_cassette
+import tracing
+import profiling
+import loop_watchdog
 
 # from MapAgent.mapagent import MapAgent
 # from InfoAgent.info_agent import agent as info_agent  # assuming the agent is named 'agent' in info_agent.py
@@ -33,9 +37,13 @@ client_agent = Agent(
     endpoint=["http://127.0.0.1:8001/submit"],
     mailbox={"server": "https://agentverse.ai"}
 )
+# Registered first: the startup handler below waits for the whole pipeline
+loop_watchdog.add_agent_watchdog(client_agent)
 
 client_protocol = Protocol()
 received_response = False
+# Span covering the whole request, from sending it to receiving the itinerary
+request_span = None
 
 # def run_agent_in_thread(agent, name):
 #     """Run an agent in a separate thread"""
@@ -89,16 +97,20 @@ async def handle_travel_plan(ctx: Context, sender: str, msg: TravelPlan):
     
     # Create a new TravelPlan model instance to send to the Map Agent
     # Make sure to use the same model as defined in models.py
-    travel_plan = TravelPlan(
-        free_times=msg.free_times,
-        attractions=msg.attractions,
-        events=msg.events,
-        lunch=msg.lunch,
-        dinner=msg.dinner
-    )
-    
-    # Send the travel plan to the Map Agent
-    await ctx.send(map_agent_address, travel_plan)
+    with tracing.span("client.forward_travel_plan", parent=tracing.context_from_message(msg)):
+        travel_plan = TravelPlan(
+            free_times=msg.free_times,
+            attractions=msg.attractions,
+            events=msg.events,
+            lunch=msg.lunch,
+            dinner=msg.dinner,
+            request_id=msg.request_id,
+            profile_dir=msg.profile_dir,
+            **tracing.message_context()
+        )
+        
+        # Send the travel plan to the Map Agent
+        await ctx.send(map_agent_address, travel_plan)
     ctx.logger.info("Travel plan sent to Map Agent")
 
 # Handle final itinerary from Map Agent
@@ -114,6 +126,11 @@ async def handle_itinerary(ctx: Context, sender: str, msg: ItineraryResponse):
     with open('final_itinerary.json', 'w') as f:
         json.dump({"itinerary": msg.itinerary}, f, indent=4)
     
+    if request_span is not None:
+        request_span.set_attribute("itinerary_items", len(msg.itinerary))
+        request_span.end()
+    tracing.flush()
+    
     ctx.logger.info("Shutting down client after receiving final itinerary")
     sys.exit(0)
 
@@ -133,6 +150,9 @@ async def handle_error_message(ctx: Context, sender: str, msg: ErrorMessage):
         json.dump({"error": msg.error}, f, indent=4)
     
     ctx.logger.info("Error message saved to 'map_agent_error.json'")
+    if request_span is not None:
+        request_span.end(error=RuntimeError(msg.error))
+    tracing.flush()
     sys.exit(1)
 
 client_agent.include(client_protocol)
@@ -153,7 +173,9 @@ def load_travel_request():
             preferences=data.get("preferences", {}),
             date_from=data.get("date_from", ""),
             date_to=data.get("date_to", ""),
-            location=data.get("location", "")
+            location=data.get("location", ""),
+            request_id=os.environ.get("REQUEST_ID"),
+            profile_dir=os.environ.get("PROFILE_DIR")
         )
         
         return request
@@ -165,21 +187,39 @@ def load_travel_request():
 info_agent_address = os.environ.get("INFOAGENT")
 @client_agent.on_event("startup")
 async def on_startup(ctx: Context):
+    global request_span
     # Load travel request from JSON file
     request = load_travel_request()
     
     ctx.logger.info(f"Loaded travel request from {INPUT_FILE_PATH}")
     ctx.logger.info(f"Request details: Location: {request.location}, Dates: {request.date_from} to {request.date_to}")
     
+    # Continue the trace started by app.py, if any, and carry it in the request
+    request_span = tracing.start_span(
+        "client.travel_request",
+        parent=tracing.context_from_traceparent(os.environ.get("TRACEPARENT")),
+        attributes={"request_id": request.request_id, "location": request.location}
+    )
+    request.trace_id = request_span.trace_id
+    request.parent_span_id = request_span.span_id
+    ctx.logger.info(f"Trace id: {request_span.trace_id}")
+    
+    # Profile this process until it exits when app.py asked for a profile
+    profiling.start_from_env("client_agent", loop=asyncio.get_running_loop())
+    
     ctx.logger.info(f"Sending travel request to Information Agent: {info_agent_address}")
     await ctx.send(info_agent_address, request)
     
     await asyncio.sleep(120)  # Longer timeout for the complete pipeline (2 minutes)
     if not received_response:
         ctx.logger.error("No final itinerary received within timeout period")
+        request_span.end(error=TimeoutError("No final itinerary received within timeout period"))
+        tracing.flush()
         sys.exit(1)
 
 if __name__ == "__main__":
+    # Record or replay outbound HTTP traffic when HTTP_CASSETTE_MODE is set
+    http_cassette.install_from_env()
     print(f"Client agent address: {client_agent.address}")
     print(f"Reading travel request from: {INPUT_FILE_PATH}")
     client_agent.run()
@@ -5,8 +5,14 @@ from typing import Dict, List, Any, Optional, Union
 from datetime import datetime, timedelta
 import uuid
 import os
+import sys
 import json
 from dotenv import load_dotenv
+
+# Shared instrumentation lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+import loop_watchdog
 import client_agent
 import models
 import logging
@@ -41,6 +47,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+metrics.add_metrics_route(app)
+loop_watchdog.add_watchdog(app)
+
+TRAVEL_REQUESTS = metrics.Counter("exploreease_travel_requests_total", "Travel requests by final status.",
+                                  ["status"])
 
 # In-memory storage for travel requests
 travel_requests = {}
@@ -142,13 +153,14 @@ async def process_travel_request(request_id: str):
         
         # Use the client_agent to generate the itinerary
         agent = client_agent.TravelAgent()
-        itinerary = await agent.generate_itinerary(
-            location=request_data["location"],
-            date_from=request_data["date_from"],
-            date_to=request_data["date_to"],
-            preferences=request_data["preferences"],
-            prompt=request_data["prompt"]
-        )
+        with metrics.in_flight("travel_request"), metrics.stage_timer("travel_agent"):
+            itinerary = await agent.generate_itinerary(
+                location=request_data["location"],
+                date_from=request_data["date_from"],
+                date_to=request_data["date_to"],
+                preferences=request_data["preferences"],
+                prompt=request_data["prompt"]
+            )
         
         # Final processing
         travel_requests[request_id]["progress"] = 0.9
@@ -169,6 +181,8 @@ async def process_travel_request(request_id: str):
         travel_requests[request_id]["status"] = "failed"
         travel_requests[request_id]["message"] = "Failed to generate itinerary"
         travel_requests[request_id]["error"] = str(e)
+    finally:
+        TRAVEL_REQUESTS.labels(travel_requests[request_id]["status"]).inc()
 
 if __name__ == "__main__":
     uvicorn.run("app:app", host="0.0.0.0", port=3000, reload=True)
\ No newline at end of file
@@ -6,7 +6,7 @@ import asyncio
 from dotenv import load_dotenv
 import httpx
 from datetime import datetime, timedelta
-from anthropic import Anthropic
+import metrics
 
 # Load environment variables
 load_dotenv()
@@ -26,7 +26,10 @@ class TravelAgent:
         # Initialize Anthropic client
         self.anthropic = None
         if self.claude_api_key:
-            self.anthropic = Anthropic(api_key=self.claude_api_key)
+            # Imported here to keep the API's start-up fast
+            from anthropic import Anthropic
+            # ANTHROPIC_BASE_URL can point at a local stand-in (stubs/anthropic_stub.py)
+            self.anthropic = Anthropic(api_key=self.claude_api_key, base_url=os.getenv("ANTHROPIC_BASE_URL"))
         else:
             logger.warning("ANTHROPIC_API_KEY not found in environment variables")
             
@@ -189,16 +192,17 @@ class TravelAgent:
         logger.info(f"Sending request to Anthropic for {location} itinerary")
         
         # the newest Anthropic model is "claude-3-7-sonnet-20250219" which was released February 24, 2025
-        response = await asyncio.to_thread(
-            self.anthropic.messages.create,
-            model="claude-3-7-sonnet-20250219",
-            system=system_prompt,
-            max_tokens=4000,
-            temperature=0.7,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ]
-        )
+        with metrics.api_call("anthropic"):
+            response = await asyncio.to_thread(
+                self.anthropic.messages.create,
+                model="claude-3-7-sonnet-20250219",
+                system=system_prompt,
+                max_tokens=4000,
+                temperature=0.7,
+                messages=[
+                    {"role": "user", "content": user_prompt}
+                ]
+            )
         
         # Extract and parse JSON response
         if not response or not response.content or len(response.content) == 0:
@@ -0,0 +1,361 @@
+"""
+Record/replay of outbound HTTP traffic for deterministic end-to-end performance runs.
+
+Hooks the three HTTP stacks the agents use:
+- requests (map_utils Places/Geocoding calls and the googlemaps client)
+- httplib2 (googleapiclient, used by calendar_api)
+- httpx (the anthropic client, used by llm_utils)
+
+Configuration (environment variables):
+- HTTP_CASSETTE_MODE: "off" (default), "record" or "replay"
+- HTTP_CASSETTE_DIR: where cassettes are stored (default "cassettes/" in the repo root)
+- HTTP_CASSETTE_SCENARIO: scenario name; each scenario is a directory of JSONL files
+- HTTP_CASSETTE_LATENCY: on replay, "original" sleeps for the recorded response time,
+  "zero" answers immediately
+
+Every process records into its own file inside the scenario directory, and replay loads
+all of them, so a scenario covers the client, InfoAgent and MapAgent together.
+"""
+import os
+import re
+import sys
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CASSETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes")
+
+# Query parameters and headers that carry credentials and must never reach a cassette
+SECRET_PARAMS = {"key", "api_key", "client", "signature", "access_token"}
+# Fields of JSON and form-encoded bodies that carry credentials (e.g. an OAuth token
+# refresh); they are redacted from stored responses and from request bodies before hashing
+SECRET_FIELDS = SECRET_PARAMS | {"refresh_token", "id_token", "client_secret", "password", "assertion"}
+REDACTED = "REDACTED"
+# Response headers that no longer apply once the body is stored decoded
+DROPPED_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "set-cookie"}
+
+_CONTENT_ID = re.compile(r"Content-ID: <([^>]+)>", re.IGNORECASE)
+_RESPONSE_CONTENT_ID = re.compile(r"Content-ID: <response-([^>]+)>", re.IGNORECASE)
+
+
+def _normalize_url(url):
+    """Drop credentials from the query string and sort it so equal requests match."""
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+def _redact_json(value):
+    if isinstance(value, dict):
+        return {k: REDACTED if k in SECRET_FIELDS else _redact_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact_json(item) for item in value]
+    return value
+
+
+def _redact_body(content):
+    """Redact SECRET_FIELDS from a JSON or form-encoded body; other bodies are returned as they are."""
+    if not content:
+        return content
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content
+    if not any(field in text for field in SECRET_FIELDS):
+        return content
+    try:
+        return json.dumps(_redact_json(json.loads(text))).encode("utf-8")
+    except ValueError:
+        pass
+    fields = parse_qsl(text, keep_blank_values=True)
+    if fields and "=" in text and not any(c.isspace() for c in text.strip()):
+        return urlencode([(k, REDACTED if k in SECRET_FIELDS else v) for k, v in fields]).encode("utf-8")
+    return content
+
+
+def _to_bytes(body):
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        return body.encode("utf-8")
+    if isinstance(body, (bytes, bytearray)):
+        return bytes(body)
+    return b""  # Streaming request bodies are matched on method and URL only
+
+
+def _encode_body(content):
+    try:
+        return content.decode("utf-8"), "utf-8"
+    except UnicodeDecodeError:
+        return base64.b64encode(content).decode("ascii"), "base64"
+
+
+def _decode_body(interaction):
+    if interaction.get("body_encoding") == "base64":
+        return base64.b64decode(interaction["body"])
+    return interaction["body"].encode("utf-8")
+
+
+class Cassette:
+    """A set of recorded interactions for one scenario."""
+
+    def __init__(self, directory, scenario, latency="original"):
+        self.path = os.path.join(directory, scenario)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.exact = defaultdict(deque)
+        self.loose = defaultdict(deque)
+        self.record_file = None
+
+    @staticmethod
+    def keys(method, url, body):
+        loose = f"{method.upper()} {_normalize_url(url)}"
+        exact = f"{loose} {hashlib.sha1(_redact_body(_to_bytes(body))).hexdigest()}"
+        return exact, loose
+
+    def load(self):
+        """Load every recording of the scenario for replay."""
+        if not os.path.isdir(self.path):
+            raise FileNotFoundError(f"No cassette recorded for scenario at {self.path}")
+        count = 0
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".jsonl"):
+                continue
+            with open(os.path.join(self.path, name), "r") as f:
+                for line in f:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        self.exact[interaction["key"]].append(interaction)
+                        self.loose[interaction["loose_key"]].append(interaction)
+                        count += 1
+        logger.info(f"Loaded {count} recorded HTTP interactions from {self.path}")
+
+    def play(self, method, url, body):
+        """
+        Find the recorded response for a request.
+
+        Identical requests are answered in recording order; once a key's recordings are
+        used up the last one keeps being served, so a corpus can be replayed repeatedly
+        and at any concurrency. Requests whose body changes between runs (e.g. batch
+        boundaries) fall back to matching on method and URL.
+        """
+        exact, loose = self.keys(method, url, body)
+        with self.lock:
+            for table, key in ((self.exact, exact), (self.loose, loose)):
+                queue = table.get(key)
+                if queue:
+                    return queue.popleft() if len(queue) > 1 else queue[0]
+        raise LookupError(f"No recorded response for {loose}")
+
+    def record(self, method, url, body, status, headers, content, elapsed):
+        exact, loose = self.keys(method, url, body)
+        text, encoding = _encode_body(_redact_body(content))
+        interaction = {
+            "key": exact,
+            "loose_key": loose,
+            "method": method.upper(),
+            "url": _normalize_url(url),
+            "status": status,
+            "headers": {k: v for k, v in headers.items() if k.lower() not in DROPPED_RESPONSE_HEADERS},
+            "body": text,
+            "body_encoding": encoding,
+            "elapsed": round(elapsed, 6),
+        }
+        with self.lock:
+            if self.record_file is None:
+                os.makedirs(self.path, exist_ok=True)
+                process_name = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+                filename = os.path.join(self.path, f"{process_name}-{os.getpid()}.jsonl")
+                self.record_file = open(filename, "a")
+            self.record_file.write(json.dumps(interaction) + "\n")
+            self.record_file.flush()
+
+    def delay(self, interaction):
+        return interaction["elapsed"] if self.latency == "original" else 0.0
+
+
+def _rewrite_batch_ids(request_body, interaction):
+    """
+    Batch responses are matched to calls by Content-ID, which is random per request;
+    renumber the recorded response with the ids of the request being replayed.
+    """
+    content = _decode_body(interaction)
+    request_ids = _CONTENT_ID.findall(_to_bytes(request_body).decode("utf-8", "replace"))
+    if not request_ids:
+        return content
+    text = content.decode("utf-8")
+    position = iter(request_ids)
+    text = _RESPONSE_CONTENT_ID.sub(lambda m: f"Content-ID: <response-{next(position, m.group(1))}>", text)
+    return text.encode("utf-8")
+
+
+def _replay_content(interaction, request_body):
+    if "multipart/mixed" in str(interaction["headers"].get("content-type", interaction["headers"].get("Content-Type", ""))):
+        return _rewrite_batch_ids(request_body, interaction)
+    return _decode_body(interaction)
+
+
+_active = None
+_originals = {}
+
+
+def _install_requests(cassette, mode):
+    from requests.adapters import HTTPAdapter
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+
+    original = HTTPAdapter.send
+    _originals["requests"] = (HTTPAdapter, "send", original)
+
+    def send(self, request, **kwargs):
+        if mode == "replay":
+            interaction = cassette.play(request.method, request.url, request.body)
+            time.sleep(cassette.delay(interaction))
+            response = Response()
+            response.status_code = interaction["status"]
+            response.headers = CaseInsensitiveDict(interaction["headers"])
+            response._content = _replay_content(interaction, request.body)
+            response.url = request.url
+            response.request = request
+            response.reason = "OK" if response.status_code < 400 else "Error"
+            response.encoding = "utf-8"
+            return response
+
+        start = time.perf_counter()
+        response = original(self, request, **kwargs)
+        content = response.content
+        cassette.record(request.method, request.url, request.body, response.status_code,
+                        dict(response.headers), content, time.perf_counter() - start)
+        return response
+
+    HTTPAdapter.send = send
+
+
+def _install_httplib2(cassette, mode):
+    import httplib2
+
+    original = httplib2.Http.request
+    _originals["httplib2"] = (httplib2.Http, "request", original)
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        if mode == "replay":
+            interaction = cassette.play(method, uri, body)
+            time.sleep(cassette.delay(interaction))
+            info = dict(interaction["headers"], status=str(interaction["status"]))
+            return httplib2.Response(info), _replay_content(interaction, body)
+
+        start = time.perf_counter()
+        response, content = original(self, uri, method, body, headers, *args, **kwargs)
+        response_headers = {k: v for k, v in response.items() if k != "status" and not k.startswith("-")}
+        cassette.record(method, uri, body, response.status, response_headers, content or b"",
+                        time.perf_counter() - start)
+        return response, content
+
+    httplib2.Http.request = request
+
+
+def _install_httpx(cassette, mode):
+    import httpx
+
+    original_send = httpx.Client.send
+    original_async_send = httpx.AsyncClient.send
+    _originals["httpx"] = (httpx.Client, "send", original_send)
+    _originals["httpx_async"] = (httpx.AsyncClient, "send", original_async_send)
+
+    def replayed(request):
+        interaction = cassette.play(request.method, str(request.url), request.content)
+        response = httpx.Response(interaction["status"], headers=interaction["headers"],
+                                  content=_replay_content(interaction, request.content), request=request)
+        return interaction, response
+
+    def send(self, request, **kwargs):
+        if mode == "replay":
+            interaction, response = replayed(request)
+            time.sleep(cassette.delay(interaction))
+            return response
+        start = time.perf_counter()
+        response = original_send(self, request, **kwargs)
+        response.read()
+        cassette.record(request.method, str(request.url), request.content, response.status_code,
+                        dict(response.headers), response.content, time.perf_counter() - start)
+        return response
+
+    async def async_send(self, request, **kwargs):
+        if mode == "replay":
+            interaction, response = replayed(request)
+            await asyncio.sleep(cassette.delay(interaction))
+            return response
+        start = time.perf_counter()
+        response = await original_async_send(self, request, **kwargs)
+        await response.aread()
+        cassette.record(request.method, str(request.url), request.content, response.status_code,
+                        dict(response.headers), response.content, time.perf_counter() - start)
+        return response
+
+    httpx.Client.send = send
+    httpx.AsyncClient.send = async_send
+
+
+def install(mode, directory=DEFAULT_CASSETTE_DIR, scenario="default", latency="original"):
+    """
+    Start recording or replaying outbound HTTP traffic in this process.
+
+    Args:
+        mode: "record" or "replay" ("off" does nothing)
+        directory: Root directory of the cassettes
+        scenario: Scenario name (one subdirectory per scenario)
+        latency: "original" or "zero" (replay only)
+
+    Returns:
+        The active Cassette, or None when mode is "off"
+    """
+    global _active
+    if mode in (None, "", "off"):
+        return None
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Unknown HTTP cassette mode: {mode}")
+    if _active is not None:
+        return _active
+
+    cassette = Cassette(directory, scenario, latency)
+    if mode == "replay":
+        cassette.load()
+
+    for installer in (_install_requests, _install_httplib2, _install_httpx):
+        try:
+            installer(cassette, mode)
+        except ImportError:
+            pass  # That HTTP stack isn't used by this process
+
+    _active = cassette
+    logger.info(f"HTTP cassette {mode} enabled for scenario '{scenario}' ({cassette.path})")
+    return cassette
+
+
+def install_from_env():
+    """Install according to the HTTP_CASSETTE_* environment variables."""
+    return install(
+        os.environ.get("HTTP_CASSETTE_MODE", "off"),
+        directory=os.environ.get("HTTP_CASSETTE_DIR", DEFAULT_CASSETTE_DIR),
+        scenario=os.environ.get("HTTP_CASSETTE_SCENARIO", "default"),
+        latency=os.environ.get("HTTP_CASSETTE_LATENCY", "original"),
+    )
+
+
+def uninstall():
+    """Restore the original HTTP client methods."""
+    global _active
+    for owner, name, original in _originals.values():
+        setattr(owner, name, original)
+    _originals.clear()
+    if _active is not None and _active.record_file is not None:
+        _active.record_file.close()
+    _active = None
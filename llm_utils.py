@@ -1,10 +1,36 @@
 
-from anthropic import Anthropic, RateLimitError, APIError
 import time
 import os
+import threading
 from dotenv import load_dotenv
+import metrics
+import rate_limit
+from singleflight import SingleFlight
 load_dotenv()
 
+# Base URL of the Anthropic API. Point it at a local stand-in (stubs/anthropic_stub.py)
+# to benchmark the pipeline without real model latency or cost.
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL")
+
+# One client per API key, created on first use: importing anthropic is slow, and a shared
+# client keeps its connection pool between calls
+_clients = {}
+_clients_lock = threading.Lock()
+# Identical prompts sent at the same time share one completion
+_inflight = SingleFlight("anthropic")
+
+
+def get_client(api_key):
+    """Get the (shared) Anthropic client for an API key."""
+    client = _clients.get(api_key)
+    if client is None:
+        from anthropic import Anthropic
+        with _clients_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                client = _clients[api_key] = Anthropic(api_key=api_key, base_url=ANTHROPIC_BASE_URL)
+    return client
+
 
 def get_claude_response(prompt, model="claude-3-haiku-20240307", max_tokens=1000, retries=3):
     """
@@ -26,18 +52,25 @@ def get_claude_response(prompt, model="claude-3-haiku-20240307", max_tokens=1000
     if not api_key:
         raise ValueError("CLAUDE_API environment variable not set")
     
-    client = Anthropic(api_key=api_key)
+    return _inflight.do((api_key, model, max_tokens, prompt), _create_message, api_key, prompt, model,
+                        max_tokens, retries)
+
+
+def _create_message(api_key, prompt, model, max_tokens, retries):
+    client = get_client(api_key)
+    from anthropic import RateLimitError, APIError
     
     attempt = 0
     while attempt < retries:
         try:
-            response = client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            with rate_limit.limit("anthropic"), metrics.api_call("anthropic"):
+                response = client.messages.create(
+                    model=model,
+                    max_tokens=max_tokens,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ]
+                )
             
             # Return the text content from the response
             return response.content[0].text
@@ -0,0 +1,140 @@
+"""
+Event loop lag monitor and blocking call detector.
+
+A heartbeat scheduled on the event loop every LOOP_WATCHDOG_INTERVAL seconds (default
+0.1) records how late it runs in the exploreease_event_loop_lag_seconds histogram. A
+watchdog thread checks the heartbeat; when the loop has not run it for longer than
+LOOP_BLOCK_THRESHOLD seconds (default 0.25), it logs the stack of the loop thread, i.e.
+the code that is blocking it (a requests.get, a googleapiclient execute(), a
+time.sleep, ...), and counts it in exploreease_event_loop_blocks_total.
+
+Plug it in with add_watchdog(app) for the FastAPI apps and add_agent_watchdog(agent) for
+the uagents agents. LOOP_WATCHDOG=0 turns it off.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.1
+DEFAULT_THRESHOLD = 0.25
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LOOP_LAG_SECONDS = metrics.Histogram("exploreease_event_loop_lag_seconds",
+                                     "How late the event loop ran a scheduled heartbeat.", buckets=LAG_BUCKETS)
+LOOP_BLOCKS = metrics.Counter("exploreease_event_loop_blocks_total",
+                              "Times the event loop was blocked for longer than the threshold.")
+
+# One watchdog per event loop
+_watchdogs = {}
+
+
+class LoopWatchdog:
+    """Measures the lag of one event loop and reports what blocks it."""
+
+    def __init__(self, loop, interval=DEFAULT_INTERVAL, threshold=DEFAULT_THRESHOLD):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self._loop_thread = None
+        self._due = None
+        self._beats = 0
+        self._handle = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the heartbeat and the watchdog thread; call from the loop's thread."""
+        self._loop_thread = threading.get_ident()
+        self._due = time.monotonic()
+        self._handle = self.loop.call_soon(self._beat)
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+
+    def _beat(self):
+        now = time.monotonic()
+        lag = max(0.0, now - self._due)
+        LOOP_LAG_SECONDS.observe(lag)
+        if lag > self.threshold:
+            logger.warning(f"Event loop was blocked for {lag:.3f}s")
+        self._beats += 1
+        self._due = now + self.interval
+        self._handle = self.loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(min(self.interval, self.threshold / 2)):
+            blocked = time.monotonic() - self._due
+            # Report each blocking episode once, while it is still going on
+            if blocked > self.threshold and reported != self._beats:
+                reported = self._beats
+                LOOP_BLOCKS.inc()
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else "(unavailable)\n"
+                logger.warning(f"Event loop blocked for more than {blocked:.3f}s in:\n{stack.rstrip()}")
+
+
+def start_watchdog(loop=None, interval=None, threshold=None):
+    """
+    Watch the running (or given) event loop, once per loop.
+
+    Returns:
+        The LoopWatchdog, or None if LOOP_WATCHDOG=0
+    """
+    if os.environ.get("LOOP_WATCHDOG", "1") == "0":
+        return None
+    loop = loop or asyncio.get_running_loop()
+    if loop in _watchdogs:
+        return _watchdogs[loop]
+    interval = interval or float(os.environ.get("LOOP_WATCHDOG_INTERVAL", DEFAULT_INTERVAL))
+    threshold = threshold or float(os.environ.get("LOOP_BLOCK_THRESHOLD", DEFAULT_THRESHOLD))
+    watchdog = _watchdogs[loop] = LoopWatchdog(loop, interval, threshold).start()
+    return watchdog
+
+
+def stop_watchdog(loop=None):
+    watchdog = _watchdogs.pop(loop or asyncio.get_running_loop(), None)
+    if watchdog is not None:
+        watchdog.stop()
+
+
+def add_watchdog(app):
+    """Watch the event loop of a FastAPI app while it is running."""
+
+    @app.on_event("startup")
+    async def start_loop_watchdog():
+        start_watchdog()
+
+    @app.on_event("shutdown")
+    async def stop_loop_watchdog():
+        stop_watchdog()
+
+    return app
+
+
+def add_agent_watchdog(agent):
+    """
+    Watch the event loop of a uagents Agent.
+
+    Startup handlers run one after the other, so call this before registering handlers
+    that keep running (like the client agent's, which waits for the itinerary).
+    """
+
+    async def start_loop_watchdog(ctx):
+        start_watchdog()
+
+    agent.on_event("startup")(start_loop_watchdog)
+    return agent
@@ -0,0 +1,381 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Every process (the FastAPI apps and each agent) keeps its own registry. The apps serve
+it on GET /metrics (see add_metrics_route); the agents can serve it on a separate port
+by setting METRICS_PORT (see start_metrics_server_from_env).
+
+Shared metrics:
+- exploreease_stage_seconds{stage}: duration of each pipeline step
+- exploreease_api_calls_total{api,outcome} / exploreease_api_call_seconds{api}:
+  outbound calls to Google, Anthropic and the IP location service
+- exploreease_api_calls_in_flight{api} and exploreease_in_flight{operation}
+- exploreease_cache_requests_total{cache,result}: cache hits and misses
+- exploreease_places_search_seconds / exploreease_places_results_total{place_type,keyword}
+- exploreease_http_* for the FastAPI apps
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Label values come partly from LLM output (Places keywords); past this many series a
+# metric folds new label combinations into "other" instead of growing without bound
+MAX_SERIES_PER_METRIC = 500
+OVERFLOW_LABEL = "other"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Holds the metrics of one process and renders them."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """Get the child series for a set of label values."""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                if len(self._series) >= MAX_SERIES_PER_METRIC:
+                    key = (OVERFLOW_LABEL,) * len(self.labelnames)
+                    series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = self._new_series()
+            return series
+
+    def _default(self):
+        return self.labels()
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines) + "\n"
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+    kind = "counter"
+
+    def _new_series(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._series.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in items]
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, e.g. the number of requests in flight."""
+    kind = "gauge"
+
+    def _new_series(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+    def track_inprogress(self):
+        return self._default().track_inprogress()
+
+    _samples = Counter._samples
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    """Counts observations (e.g. durations in seconds) into cumulative buckets."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + ((float("inf"),) if max(buckets) != float("inf") else ())
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_series(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._series.items())
+        lines = []
+        for key, child in items:
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("exploreease_stage_seconds", "Duration of each pipeline stage.", ["stage"])
+API_CALLS = Counter("exploreease_api_calls_total", "Outbound API calls by outcome.", ["api", "outcome"])
+API_CALL_SECONDS = Histogram("exploreease_api_call_seconds", "Duration of outbound API calls.", ["api"])
+API_IN_FLIGHT = Gauge("exploreease_api_calls_in_flight", "Outbound API calls currently running.", ["api"])
+IN_FLIGHT = Gauge("exploreease_in_flight", "Requests currently being processed.", ["operation"])
+CACHE_REQUESTS = Counter("exploreease_cache_requests_total", "Cache lookups by result.", ["cache", "result"])
+PLACES_SEARCH_SECONDS = Histogram("exploreease_places_search_seconds",
+                                  "Duration of Places Nearby Search requests.", ["place_type", "keyword"])
+PLACES_RESULTS = Counter("exploreease_places_results_total",
+                         "Places returned by Nearby Search.", ["place_type", "keyword"])
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Time a pipeline stage: `with stage_timer("distance_matrix"): ...`
+
+    The stage is also recorded as a trace span. Works as a decorator on regular
+    (non-async) functions too.
+    """
+    with STAGE_SECONDS.labels(stage).time(), tracing.span(stage):
+        yield
+
+
+@contextmanager
+def api_call(api):
+    """
+    Count and time one outbound API call.
+
+    The outcome label is "ok", or the exception class name if the block raises. The
+    call is also recorded as a client span in the current trace.
+    """
+    outcome = "ok"
+    start = time.perf_counter()
+    API_IN_FLIGHT.labels(api).inc()
+    try:
+        with tracing.span(f"{api} call", kind="client", api=api):
+            yield
+    except BaseException as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        API_IN_FLIGHT.labels(api).dec()
+        API_CALL_SECONDS.labels(api).observe(time.perf_counter() - start)
+        API_CALLS.labels(api, outcome).inc()
+
+
+def cache_lookup(cache, hit):
+    """Record a cache hit (hit=True) or miss."""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def in_flight(operation):
+    """Track an operation in the in-flight gauge: `with in_flight("travel_request"): ...`"""
+    return IN_FLIGHT.labels(operation).track_inprogress()
+
+
+def render():
+    """Render all metrics of this process in the Prometheus text format."""
+    return REGISTRY.render()
+
+
+HTTP_REQUESTS = Counter("exploreease_http_requests_total", "HTTP requests served.", ["method", "route", "status"])
+HTTP_REQUEST_SECONDS = Histogram("exploreease_http_request_seconds", "Time to serve HTTP requests.",
+                                 ["method", "route"])
+HTTP_IN_FLIGHT = Gauge("exploreease_http_requests_in_flight", "HTTP requests currently being served.")
+
+
+def add_metrics_route(app, path="/metrics"):
+    """Serve the registry on a FastAPI app and record request counts and latencies."""
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse
+
+    @app.middleware("http")
+    async def record_http_metrics(request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        HTTP_IN_FLIGHT.inc()
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # Use the route template (/travel/status/{request_id}) to keep label values bounded
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(request.method, route).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(request.method, route, str(status)).inc()
+
+    @app.get(path, include_in_schema=False)
+    async def metrics_endpoint():
+        return PlainTextResponse(render(), media_type=CONTENT_TYPE)
+
+    return app
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the agent logs
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve /metrics from a background thread (for the agent processes)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def start_metrics_server_from_env():
+    """Start the metrics server if METRICS_PORT is set."""
+    port = os.environ.get("METRICS_PORT")
+    if not port:
+        return None
+    return start_metrics_server(int(port), os.environ.get("METRICS_HOST", "0.0.0.0"))
@@ -1,13 +1,19 @@
 # Import the same model definitions
 from uagents import Model
 from typing import List, Tuple
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 class TravelRequest(Model):
     prompt: str
     preferences: dict
     date_from: str
     date_to: str
     location: str
+    # Trace context (see tracing.py): the request's id, its trace and the sender's span
+    request_id: Optional[str] = None
+    trace_id: Optional[str] = None
+    parent_span_id: Optional[str] = None
+    # Directory to write profiles into when the request is profiled (see profiling.py)
+    profile_dir: Optional[str] = None
 
 # Define output model
 class TravelPlan(Model):
@@ -16,8 +22,15 @@ class TravelPlan(Model):
     events: object
     lunch: object
     dinner: object
+    request_id: Optional[str] = None
+    trace_id: Optional[str] = None
+    parent_span_id: Optional[str] = None
+    profile_dir: Optional[str] = None
     
 class ItineraryResponse(Model):
     itinerary: List[Dict[str, Any]]
+    request_id: Optional[str] = None
+    trace_id: Optional[str] = None
+    parent_span_id: Optional[str] = None
     
     
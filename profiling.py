@@ -0,0 +1,258 @@
+"""
+Opt-in profiling of single travel requests.
+
+POST /travel/request?profile=true makes app.py pass the request directory to the client
+agent (PROFILE_DIR) and, through the profile_dir field of the messages, to InfoAgent and
+MapAgent. Each process then writes into requests/<request_id>/:
+- <name>.folded: sampled thread stacks in the folded format read by flamegraph.pl,
+  speedscope and inferno (wall clock, so blocking HTTP calls in worker threads show up)
+- <name>.tasks.folded: sampled await chains of the asyncio tasks, i.e. which coroutine
+  each task was waiting in
+- <name>.memory.txt: the top allocation sites (tracemalloc) still alive at the end
+
+Profiling covers the whole process while a request is being handled, so requests handled
+concurrently by the same agent show up in each other's profiles.
+
+The agents only write under PROFILE_ROOT (default: the requests/ directory of this repo),
+whatever directory a message names. PROFILE_INTERVAL sets the sampling interval in seconds
+and PROFILE_MEMORY_TOP the number of allocation sites to keep.
+"""
+import os
+import sys
+import atexit
+import asyncio
+import logging
+import threading
+import tracemalloc
+import linecache
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROFILE_ROOT = os.path.join(ROOT_DIR, "requests")
+DEFAULT_INTERVAL = 0.01
+DEFAULT_MEMORY_TOP = 25
+MAX_STACK_DEPTH = 128
+# Frames kept per allocation by tracemalloc; more frames cost more memory and time
+MEMORY_FRAMES = 5
+
+
+def _short_path(filename):
+    if filename.startswith(ROOT_DIR + os.sep):
+        return os.path.relpath(filename, ROOT_DIR)
+    return os.path.join(*filename.split(os.sep)[-2:]) if os.sep in filename else filename
+
+
+def _frame_label(code):
+    # Semicolons separate frames in the folded format
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _thread_stack(frame):
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def _task_stack(task):
+    """The chain of coroutines a task is currently awaiting, outermost first."""
+    labels = []
+    coro = task.get_coro()
+    while coro is not None and len(labels) < MAX_STACK_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(_frame_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return labels
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads (and the asyncio tasks of one event loop) from a
+    background thread. At the default 100 samples per second the overhead stays around
+    a percent, unlike cProfile which instruments every call.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, loop=None):
+        self.interval = interval
+        self.loop = loop
+        self.thread_stacks = Counter()
+        self.task_stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample(own)
+            except Exception as e:
+                # Sampling races with the threads it looks at; drop the sample
+                logger.debug(f"Dropped profiler sample: {e}")
+
+    def _sample(self, own):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = [f"thread {names.get(ident, ident)}"] + _thread_stack(frame)
+            self.thread_stacks[";".join(stack)] += 1
+        if self.loop is not None:
+            for task in asyncio.all_tasks(self.loop):
+                stack = _task_stack(task)
+                if stack:
+                    self.task_stacks[";".join(stack)] += 1
+        self.samples += 1
+
+    @staticmethod
+    def write_folded(stacks, path):
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_FRAMES)
+            _tracemalloc_owned = True
+        _tracemalloc_users += 1
+    return tracemalloc.take_snapshot()
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+
+
+def write_memory_report(start_snapshot, path, top=DEFAULT_MEMORY_TOP):
+    """Write the allocation sites that grew the most since start_snapshot."""
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, __file__),
+              tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+              tracemalloc.Filter(False, "<unknown>"))
+    end_snapshot = tracemalloc.take_snapshot().filter_traces(ignore)
+    stats = end_snapshot.compare_to(start_snapshot.filter_traces(ignore), "lineno")
+    current, peak = tracemalloc.get_traced_memory()
+    with open(path, "w") as f:
+        f.write(f"# Top {top} allocation sites by memory still allocated at the end of the request\n")
+        f.write(f"# Traced memory: {current / 1e6:.1f} MB now, {peak / 1e6:.1f} MB peak\n")
+        for stat in stats[:top]:
+            frame = stat.traceback[0]
+            f.write(f"{stat.size_diff / 1024:>10.1f} KiB {stat.count_diff:>8} blocks  "
+                    f"{_short_path(frame.filename)}:{frame.lineno}\n")
+            line = linecache.getline(frame.filename, frame.lineno).strip()
+            if line:
+                f.write(f"{'':>30}{line}\n")
+
+
+def _allowed_directory(directory):
+    root = os.path.realpath(os.environ.get("PROFILE_ROOT", DEFAULT_PROFILE_ROOT))
+    directory = os.path.realpath(directory)
+    return directory == root or directory.startswith(root + os.sep)
+
+
+class ProfileSession:
+    """One profiled stretch of a process, written to <directory>/<name>.* when stopped."""
+
+    def __init__(self, directory, name, loop=None):
+        self.directory = directory
+        self.name = name
+        interval = float(os.environ.get("PROFILE_INTERVAL", DEFAULT_INTERVAL))
+        self.profiler = SamplingProfiler(interval, loop)
+        self.memory_top = int(os.environ.get("PROFILE_MEMORY_TOP", DEFAULT_MEMORY_TOP))
+        self._start_snapshot = None
+        self._stopped = False
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._start_snapshot = _start_tracemalloc()
+        self.profiler.start()
+        return self
+
+    def stop(self):
+        """Stop sampling and write the profile files (only the first call counts)."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self.profiler.stop()
+        base = os.path.join(self.directory, self.name)
+        try:
+            write_memory_report(self._start_snapshot, f"{base}.memory.txt", self.memory_top)
+        finally:
+            _stop_tracemalloc()
+        self.profiler.write_folded(self.profiler.thread_stacks, f"{base}.folded")
+        if self.profiler.loop is not None:
+            self.profiler.write_folded(self.profiler.task_stacks, f"{base}.tasks.folded")
+        logger.info(f"Wrote {self.profiler.samples} profile samples to {base}.*")
+
+
+@contextmanager
+def profiled(directory, name):
+    """
+    Profile a block into `directory` if it is set: `with profiled(msg.profile_dir, "map_agent"): ...`
+
+    Does nothing when directory is empty or outside PROFILE_ROOT.
+    """
+    if not directory:
+        yield None
+        return
+    if not _allowed_directory(directory):
+        logger.warning(f"Not profiling into {directory}: outside PROFILE_ROOT")
+        yield None
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    session = ProfileSession(directory, name, loop).start()
+    try:
+        yield session
+    finally:
+        try:
+            session.stop()
+        except Exception as e:
+            logger.warning(f"Writing the profile to {directory} failed: {e}")
+
+
+def start_from_env(name, loop=None):
+    """
+    Profile the rest of this process if PROFILE_DIR is set (for the per-request client
+    agent); the files are written at exit.
+
+    Returns:
+        The ProfileSession, or None if profiling is off
+    """
+    directory = os.environ.get("PROFILE_DIR")
+    if not directory:
+        return None
+    session = ProfileSession(directory, name, loop).start()
+    atexit.register(session.stop)
+    return session
@@ -0,0 +1,295 @@
+"""
+Client-side rate limiting of outbound API calls.
+
+Every API (places, geocode, directions, anthropic) gets one Limiter per process, which
+combines:
+- a token bucket: calls start at most `rate` times per second on average, in bursts of
+  at most `burst`;
+- an AIMD concurrency limit: the number of calls in flight grows by one for every
+  `limit` calls that succeed in time (additive increase), up to `concurrency`. It is
+  halved when the API throttles (HTTP 429, Anthropic's 529, OVER_QUERY_LIMIT), and cut
+  by a tenth when a call takes longer than the API's target latency (multiplicative
+  decrease), at most once per DECREASE_INTERVAL seconds so that a burst of throttled
+  calls counts once. A throttled call also empties the bucket;
+- priority lanes: interactive calls (the default) start before any waiting background
+  call, and background calls may use at most BACKGROUND_SHARE of the concurrency limit,
+  so prefetching (city_pack builds) never takes all of it. Code run inside
+  `with background():` is in the background lane.
+
+Wrap each call in `with limit("places") as call:` in threads, or `async with
+limit("places") as call:` in coroutines. Exceptions with status code 429 or 529, or
+OVER_QUERY_LIMIT in their message, count as throttling; call.throttled() records a
+throttling answer that came back as a normal response (Places and Geocoding return
+OVER_QUERY_LIMIT with HTTP 200).
+
+RATE_LIMIT_<API>="rate,burst,concurrency" overrides the defaults of an API (e.g.
+RATE_LIMIT_PLACES="20,40,8"); RATE_LIMIT=0 turns limiting off.
+Waits are recorded in exploreease_rate_limit_wait_seconds{api,lane}, throttled calls
+in exploreease_rate_limit_throttled_total{api} and the current concurrency limits in
+exploreease_rate_limit_concurrency{api}.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BACKGROUND)
+
+# rate per second, burst, concurrency, target latency in seconds (None: not latency driven,
+# e.g. LLM calls whose duration depends on the length of the answer)
+DEFAULT_LIMITS = {
+    "places": (50, 50, 32, 3.0),
+    "geocode": (50, 50, 16, 2.0),
+    "directions": (50, 50, 16, 3.0),
+    "anthropic": (10, 20, 16, None),
+}
+BACKGROUND_SHARE = 0.5
+OVERLOAD_DECREASE = 0.5
+SLOW_DECREASE = 0.9
+DECREASE_INTERVAL = 1.0
+# Longest a waiting call sleeps before checking again
+MAX_WAIT_STEP = 0.1
+THROTTLED_STATUS_CODES = {429, 529}
+
+ENABLED = os.environ.get("RATE_LIMIT", "1") != "0"
+
+RATE_LIMIT_WAIT_SECONDS = metrics.Histogram("exploreease_rate_limit_wait_seconds",
+                                            "Time outbound calls waited for the rate limiter.", ["api", "lane"])
+RATE_LIMIT_THROTTLED = metrics.Counter("exploreease_rate_limit_throttled_total",
+                                       "Outbound calls the API answered with a throttling error.", ["api"])
+RATE_LIMIT_CONCURRENCY = metrics.Gauge("exploreease_rate_limit_concurrency",
+                                       "Current AIMD concurrency limit of outbound calls.", ["api"])
+
+_lane = contextvars.ContextVar("rate_limit_lane", default=INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """Run the calls made inside the block in the background lane."""
+    token = _lane.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def is_throttled(exception):
+    """Whether an exception is an API's answer that the client is sending too much."""
+    status_code = getattr(exception, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(exception, "response", None), "status_code", None)
+    return status_code in THROTTLED_STATUS_CODES or "OVER_QUERY_LIMIT" in str(exception)
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average, in bursts of at most `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Take a token; if there is none, return the seconds until there is one."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0.0)
+
+
+class AIMDLimit:
+    """A concurrency limit with additive increase and multiplicative decrease."""
+
+    def __init__(self, maximum, target_latency=None, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.target_latency = target_latency
+        self.limit = float(maximum)
+        self._decreased_at = float("-inf")
+
+    def succeeded(self, latency, now):
+        if self.target_latency is not None and latency > self.target_latency:
+            self._decrease(SLOW_DECREASE, now)
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def throttled(self, now):
+        self._decrease(OVERLOAD_DECREASE, now)
+
+    def _decrease(self, factor, now):
+        if now - self._decreased_at < DECREASE_INTERVAL:
+            return
+        self._decreased_at = now
+        self.limit = max(self.minimum, self.limit * factor)
+
+
+class Limiter:
+    """Token bucket, AIMD concurrency limit and priority lanes for the calls to one API."""
+
+    def __init__(self, name, rate, burst, concurrency, target_latency=None):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AIMDLimit(concurrency, target_latency)
+        self.in_flight = dict.fromkeys(LANES, 0)
+        self.waiting = dict.fromkeys(LANES, 0)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        RATE_LIMIT_CONCURRENCY.labels(name).set(concurrency)
+
+    def _try_start(self, lane, now):
+        """
+        Start a call in a lane if the limits allow it (with the lock held).
+
+        Returns:
+            0 if the call started, else the seconds to wait before trying again (None:
+            until another call ends)
+        """
+        limit = max(1, int(self.concurrency.limit))
+        if sum(self.in_flight.values()) >= limit:
+            return None
+        if lane == BACKGROUND and (self.waiting[INTERACTIVE]
+                                   or self.in_flight[BACKGROUND] >= max(1, int(limit * BACKGROUND_SHARE))):
+            return None
+        wait = self.bucket.take(now)
+        if wait:
+            return wait
+        self.in_flight[lane] += 1
+        return 0
+
+    def acquire(self, lane=None):
+        """Wait until a call may start (in threads). Returns its lane."""
+        lane = lane or _lane.get()
+        started = time.monotonic()
+        with self._changed:
+            self.waiting[lane] += 1
+            try:
+                while True:
+                    wait = self._try_start(lane, time.monotonic())
+                    if wait == 0:
+                        break
+                    self._changed.wait(min(wait or MAX_WAIT_STEP, MAX_WAIT_STEP))
+            finally:
+                self.waiting[lane] -= 1
+        RATE_LIMIT_WAIT_SECONDS.labels(self.name, lane).observe(time.monotonic() - started)
+        return lane
+
+    async def acquire_async(self, lane=None):
+        """Wait until a call may start (in coroutines), without blocking the event loop."""
+        lane = lane or _lane.get()
+        started = time.monotonic()
+        with self._lock:
+            self.waiting[lane] += 1
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_start(lane, time.monotonic())
+                if wait == 0:
+                    break
+                await asyncio.sleep(min(wait or MAX_WAIT_STEP, MAX_WAIT_STEP))
+        finally:
+            with self._lock:
+                self.waiting[lane] -= 1
+        RATE_LIMIT_WAIT_SECONDS.labels(self.name, lane).observe(time.monotonic() - started)
+        return lane
+
+    def release(self, lane, latency, throttled=False, failed=False):
+        """
+        End a call started with acquire. A throttled call decreases the concurrency
+        limit; a call that failed otherwise leaves it as it is.
+        """
+        now = time.monotonic()
+        with self._changed:
+            self.in_flight[lane] -= 1
+            if throttled:
+                self.concurrency.throttled(now)
+                self.bucket.drain()
+            elif not failed:
+                self.concurrency.succeeded(latency, now)
+            self._changed.notify_all()
+        if throttled:
+            RATE_LIMIT_THROTTLED.labels(self.name).inc()
+            logger.warning(f"{self.name} throttled us; concurrency limit is now {self.concurrency.limit:.1f}")
+        RATE_LIMIT_CONCURRENCY.labels(self.name).set(self.concurrency.limit)
+
+
+class _Call:
+    """One rate-limited call; a context manager for both `with` and `async with`."""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.lane = None
+        self.started = None
+        self._throttled = False
+
+    def throttled(self):
+        """Record that the API answered this call with a throttling response."""
+        self._throttled = True
+
+    def __enter__(self):
+        if self.limiter is not None:
+            self.lane = self.limiter.acquire()
+        self.started = time.monotonic()
+        return self
+
+    async def __aenter__(self):
+        if self.limiter is not None:
+            self.lane = await self.limiter.acquire_async()
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.limiter is not None:
+            throttled = self._throttled or (exc is not None and is_throttled(exc))
+            self.limiter.release(self.lane, time.monotonic() - self.started, throttled, failed=exc is not None)
+        return False
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _settings(api):
+    rate, burst, concurrency, target_latency = DEFAULT_LIMITS.get(api, DEFAULT_LIMITS["places"])
+    override = os.environ.get(f"RATE_LIMIT_{api.upper()}")
+    if override:
+        try:
+            values = [float(value) for value in override.split(",")]
+            # Values left out keep their defaults
+            rate, burst, concurrency = values + [rate, burst, concurrency][len(values):]
+        except ValueError:
+            logger.error(f"Invalid RATE_LIMIT_{api.upper()}={override!r}; using the defaults")
+    return rate, burst, int(concurrency), target_latency
+
+
+def get_limiter(api):
+    """The (shared) Limiter of an API."""
+    limiter = _limiters.get(api)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(api)
+            if limiter is None:
+                limiter = _limiters[api] = Limiter(api, *_settings(api))
+    return limiter
+
+
+def limit(api):
+    """Context manager around one call to an API, see the module docstring."""
+    return _Call(get_limiter(api) if ENABLED else None)
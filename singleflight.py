@@ -0,0 +1,57 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+When several requests plan trips to the same city at once, they issue the same geocode,
+Places and Directions queries in parallel. A SingleFlight runs one call per key at a
+time: the first caller (the leader) makes it, and every caller that arrives with the
+same key while it is in flight waits for that call and gets its result, or its
+exception. Nothing is cached: once the call returns, the next caller makes a new one.
+
+Callers share the result object, so they must not modify it. do(key, fn, *args) is for
+threads (the Maps helpers, the LLM client, the Calendar workers); coroutines reach it
+through run_in_executor. A waiter cannot abandon the call; the calls have their own
+timeouts.
+
+Coalesced calls are counted in exploreease_singleflight_calls_total{name,role}.
+"""
+import threading
+from concurrent.futures import Future
+
+import metrics
+
+SINGLEFLIGHT_CALLS = metrics.Counter("exploreease_singleflight_calls_total",
+                                     "Calls made (leader) or shared with an identical call in flight (shared).",
+                                     ["name", "role"])
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its outcome with concurrent callers."""
+
+    def __init__(self, name):
+        self.name = name
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs), or wait for the identical call in flight for key."""
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = self._futures[key] = Future()
+        if not leader:
+            SINGLEFLIGHT_CALLS.labels(self.name, "shared").inc()
+            return future.result()
+
+        SINGLEFLIGHT_CALLS.labels(self.name, "leader").inc()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._futures[key]
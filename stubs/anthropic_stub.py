@@ -0,0 +1,247 @@
+"""
+Local stand-in for the Anthropic Messages API (POST /v1/messages), including streaming.
+
+Answers are either scripted (first matching entry of a --script file) or generated from
+templates that understand the prompts this repo sends: the InfoAgent keyword prompt,
+the MapAgent itinerary prompt and the frontend TravelAgent itinerary prompt. Model time
+is shaped by a time-to-first-token distribution and a tokens/sec rate, so pipeline
+benchmarks measure our own overhead against a known, controllable model latency.
+
+Usage:
+    python stubs/anthropic_stub.py --port 8200 --ttft lognormal:600:0.3 --tokens-per-sec 80
+
+    export ANTHROPIC_BASE_URL=http://127.0.0.1:8200
+    export CLAUDE_API=stub ANTHROPIC_API_KEY=stub
+"""
+import re
+import json
+import uuid
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from stub_common import add_behaviour_arguments, behaviour_from_args, add_stats_routes, parse_latency
+
+# Rough characters-per-token ratio used for usage numbers and pacing
+CHARS_PER_TOKEN = 4
+# Tokens sent per streamed content_block_delta
+TOKENS_PER_DELTA = 8
+
+
+def _prompt_text(body):
+    """Flatten the system prompt and all user message content into one string."""
+    parts = []
+    system = body.get("system")
+    if isinstance(system, str):
+        parts.append(system)
+    elif isinstance(system, list):
+        parts.extend(block.get("text", "") for block in system)
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(block.get("text", "") for block in content if isinstance(block, dict))
+    return "\n".join(parts)
+
+
+def _json_after(text, heading):
+    """Decode the first JSON array that follows a heading in the prompt."""
+    index = text.find(heading)
+    if index == -1:
+        return []
+    start = text.find("[", index)
+    if start == -1:
+        return []
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text[start:])
+        return value
+    except json.JSONDecodeError:
+        return []
+
+
+def keyword_response(prompt):
+    """Answer the InfoAgent "Nearby Search query" prompt."""
+    return json.dumps({
+        "attractions": [["museum", "historic landmark", "scenic viewpoint"], 0, 3],
+        "events": [["live music", "cultural festival"], 0, 3],
+        "lunch": ["local cuisine restaurant", 1, 3],
+        "dinner": ["popular dinner restaurant", 2, 4],
+    }, indent=2)
+
+
+def map_itinerary_response(prompt):
+    """Answer the MapAgent planner prompt by scheduling the offered places into each slot."""
+    slots = _json_after(prompt, "## Free Time Slots")
+    attractions = [a["name"] for a in _json_after(prompt, "Available Attractions")]
+    lunches = [r["name"] for r in _json_after(prompt, "Lunch Options")]
+    dinners = [r["name"] for r in _json_after(prompt, "Dinner Options")]
+    fmt = "%Y-%m-%d %H:%M"
+
+    itinerary = []
+    for slot in slots:
+        cursor = datetime.strptime(slot["start"], fmt)
+        slot_end = datetime.strptime(slot["end"], fmt)
+        itinerary.append({
+            "type": "start", "time": slot["start"], "location": slot["start_location"]["name"],
+            "coordinates": slot["start_location"]["coordinates"], "description": "Starting point",
+        })
+        had_lunch = had_dinner = False
+        while True:
+            cursor += timedelta(minutes=20)  # travel between stops
+            lunch_window = cursor.replace(hour=11, minute=30) <= cursor <= cursor.replace(hour=14, minute=0)
+            dinner_window = cursor.replace(hour=18, minute=0) <= cursor <= cursor.replace(hour=21, minute=0)
+            if lunch_window and lunches and not had_lunch:
+                kind, name, duration = "lunch", lunches.pop(0), timedelta(hours=1)
+                had_lunch = True
+            elif dinner_window and dinners and not had_dinner:
+                kind, name, duration = "dinner", dinners.pop(0), timedelta(minutes=90)
+                had_dinner = True
+            elif attractions:
+                kind, name, duration = "attraction", attractions[0], timedelta(hours=2)
+            else:
+                break
+            if cursor + duration > slot_end:
+                break
+            if kind == "attraction":
+                attractions.pop(0)
+            itinerary.append({
+                "type": kind, "time": cursor.strftime(fmt), "end_time": (cursor + duration).strftime(fmt),
+                "location": name, "coordinates": {"lat": 0.0, "lng": 0.0},
+                "description": f"{kind.capitalize()} at {name}",
+            })
+            cursor += duration
+        itinerary.append({
+            "type": "end", "time": slot["end"], "location": slot["end_location"]["name"],
+            "coordinates": slot["end_location"]["coordinates"], "description": "End of free time",
+        })
+    return json.dumps(itinerary, indent=2)
+
+
+def travel_agent_response(prompt):
+    """Answer the frontend TravelAgent prompt with a plausible multi-day plan."""
+    location_match = re.search(r"trip to (.+?) from (\w+ \d{2}, \d{4}) to (\w+ \d{2}, \d{4})", prompt)
+    location = location_match.group(1) if location_match else "the city"
+    start = datetime.strptime(location_match.group(2), "%B %d, %Y") if location_match else datetime(2025, 1, 1)
+    end = datetime.strptime(location_match.group(3), "%B %d, %Y") if location_match else start
+
+    points = []
+    day = start
+    while day <= end:
+        for hour, length, kind, label in ((9, 3, "attraction", "Morning visit"), (12, 1, "food", "Lunch"),
+                                         (14, 3, "attraction", "Afternoon visit"), (19, 2, "food", "Dinner")):
+            begin = day.replace(hour=hour)
+            points.append({
+                "type": kind, "time": begin.isoformat(), "end_time": (begin + timedelta(hours=length)).isoformat(),
+                "location": f"{label} spot in {location}", "coordinates": {"lat": 50.0875, "lng": 14.4213},
+                "description": f"{label} in {location}", "rating": 4.5,
+            })
+        day += timedelta(days=1)
+    return json.dumps(points, indent=2)
+
+
+def generate_text(prompt, script):
+    """Pick the scripted answer for a prompt, or generate one from the matching template."""
+    for entry in script:
+        if entry.get("match", "") in prompt:
+            return entry["response"]
+    if "Nearby Search" in prompt:
+        return keyword_response(prompt)
+    if "## Free Time Slots" in prompt:
+        return map_itinerary_response(prompt)
+    if "THE RESPONSE MUST BE IN THE FOLLOWING JSON FORMAT" in prompt:
+        return travel_agent_response(prompt)
+    return "OK"
+
+
+def create_app(behaviour, script, ttft, tokens_per_sec):
+    app = FastAPI(title="Anthropic Messages API stand-in")
+    add_stats_routes(app, behaviour)
+
+    def error_response(outcome):
+        if outcome == "rate_limited":
+            error = {"type": "rate_limit_error", "message": "Number of requests has exceeded your rate limit"}
+            return JSONResponse({"type": "error", "error": error}, status_code=429)
+        return JSONResponse({"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}},
+                            status_code=529)
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        outcome = await behaviour.apply("messages")
+        if outcome:
+            return error_response(outcome)
+
+        body = await request.json()
+        prompt = _prompt_text(body)
+        text = generate_text(prompt, script)
+        max_chars = int(body.get("max_tokens", 1024)) * CHARS_PER_TOKEN
+        stop_reason = "end_turn" if len(text) <= max_chars else "max_tokens"
+        text = text[:max_chars]
+
+        message_id = f"msg_stub_{uuid.uuid4().hex[:24]}"
+        input_tokens = max(1, len(prompt) // CHARS_PER_TOKEN)
+        output_tokens = max(1, len(text) // CHARS_PER_TOKEN)
+        behaviour.count("messages.output_tokens", output_tokens)
+        message = {
+            "id": message_id, "type": "message", "role": "assistant", "model": body.get("model"),
+            "stop_reason": None, "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": 0},
+        }
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft() + output_tokens / tokens_per_sec)
+            message.update(content=[{"type": "text", "text": text}], stop_reason=stop_reason,
+                           usage={"input_tokens": input_tokens, "output_tokens": output_tokens})
+            return message
+
+        async def events():
+            def sse(event, data):
+                return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+            await asyncio.sleep(ttft())
+            yield sse("message_start", {"type": "message_start", "message": dict(message, content=[])})
+            yield sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                              "content_block": {"type": "text", "text": ""}})
+            chunk = TOKENS_PER_DELTA * CHARS_PER_TOKEN
+            for start in range(0, len(text), chunk):
+                await asyncio.sleep(TOKENS_PER_DELTA / tokens_per_sec)
+                yield sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                  "delta": {"type": "text_delta", "text": text[start:start + chunk]}})
+            yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+            yield sse("message_delta", {"type": "message_delta",
+                                        "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                                        "usage": {"output_tokens": output_tokens}})
+            yield sse("message_stop", {"type": "message_stop"})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Anthropic Messages API")
+    add_behaviour_arguments(parser)
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--ttft", default="lognormal:600:0.3",
+                        help="Time-to-first-token distribution (ms), e.g. fixed:500")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0,
+                        help="Output token rate after the first token")
+    parser.add_argument("--script", default=None,
+                        help='JSON list of {"match": "...", "response": "..."} canned answers')
+    args = parser.parse_args()
+
+    script = []
+    if args.script:
+        with open(args.script, "r") as f:
+            script = json.load(f)
+
+    app = create_app(behaviour_from_args(args), script, parse_latency(args.ttft), args.tokens_per_sec)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""
+Local stand-in for the Google APIs used by MapAgent/map_utils.py and InfoAgent/calendar_api.py.
+
+Serves Places Nearby Search, Geocoding, Directions and Calendar v3 (including batch
+requests) from fixture files, with configurable latency, error rate and rate limits,
+so caching, concurrency and retry behaviour can be benchmarked without using quota.
+
+Usage:
+    python stubs/google_stub.py --port 8100 --latency lognormal:150:0.5 --api-rate-limit places=20
+
+    # Then point the agents at it (googlemaps still wants a key that looks like one)
+    export GOOGLE_MAPS_BASE_URL=http://127.0.0.1:8100
+    export GOOGLE_CALENDAR_BASE_URL=http://127.0.0.1:8100
+    export GOOGLE_PLACES_API_KEY=AIzaStubKey
+"""
+import os
+import sys
+import json
+import math
+import uuid
+import zlib
+import base64
+import random
+import argparse
+from email.parser import Parser
+from datetime import datetime, timezone
+
+import dateutil.parser
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+from stub_common import add_behaviour_arguments, behaviour_from_args, add_stats_routes, StubBehaviour
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "InfoAgent"))
+from recurrence import RecurrenceCache
+
+DEFAULT_ATTRACTIONS_FIXTURE = os.path.join(ROOT_DIR, "MapAgent", "attractions.json")
+PAGE_SIZE = 20
+RESTAURANT_TYPES = {"restaurant", "food", "cafe", "bar", "meal_takeaway"}
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great circle distance in meters."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+def _stable_fraction(*parts):
+    """Deterministic pseudo-random number in [0, 1) derived from the given strings."""
+    return (zlib.crc32("|".join(str(p) for p in parts).encode("utf-8")) % 10000) / 10000
+
+
+def synthesize_restaurants(bounds, count=6000, seed=7):
+    """Generate deterministic restaurant results spread over the fixture area (the fixtures have none)."""
+    rng = random.Random(seed)
+    min_lat, max_lat, min_lng, max_lng = bounds
+    cuisines = ["Ramen", "Sushi", "Bistro", "Trattoria", "Taqueria", "Curry House", "Grill",
+                "Noodle Bar", "Brasserie", "Dumpling House", "Vegan Kitchen", "Izakaya"]
+    restaurants = []
+    for i in range(count):
+        restaurants.append({
+            "place_id": f"stub_restaurant_{i}",
+            "name": f"{rng.choice(cuisines)} {i}",
+            "geometry": {"location": {"lat": rng.uniform(min_lat, max_lat), "lng": rng.uniform(min_lng, max_lng)}},
+            "rating": round(rng.uniform(3.2, 4.9), 1),
+            "user_ratings_total": int(rng.lognormvariate(5, 1.2)),
+            "price_level": rng.randint(1, 4),
+            "types": ["restaurant", "food", "point_of_interest", "establishment"],
+            "vicinity": f"{i} Stub Street",
+            "business_status": "OPERATIONAL",
+            "photos": [{"photo_reference": f"stub_photo_{i}", "height": 400, "width": 600,
+                        "html_attributions": []}],
+        })
+    return restaurants
+
+
+class GoogleStub:
+    """In-memory state behind the stand-in endpoints."""
+
+    def __init__(self, attractions, calendars, calendar_timezone, geocode_fixture, behaviour):
+        self.attractions = attractions
+        lats = [p["geometry"]["location"]["lat"] for p in attractions] or [0.0]
+        lngs = [p["geometry"]["location"]["lng"] for p in attractions] or [0.0]
+        self.bounds = (min(lats), max(lats), min(lngs), max(lngs))
+        self.restaurants = synthesize_restaurants(self.bounds)
+        self.calendars = calendars
+        self.calendar_timezone = calendar_timezone
+        self.geocode_fixture = geocode_fixture
+        self.behaviour = behaviour
+        self.recurrence = RecurrenceCache()
+
+    # --- Places ---
+
+    def nearby(self, params):
+        if params.get("pagetoken"):
+            token = json.loads(base64.urlsafe_b64decode(params["pagetoken"].encode()).decode())
+            params, offset = token["params"], token["offset"]
+        else:
+            offset = 0
+
+        try:
+            lat, lng = (float(v) for v in params["location"].split(","))
+            radius = float(params.get("radius", 1500))
+        except (KeyError, ValueError):
+            return {"status": "INVALID_REQUEST", "results": []}
+
+        place_type = params.get("type")
+        keyword = (params.get("keyword") or "").lower()
+        pool = self.restaurants if place_type in RESTAURANT_TYPES else self.attractions
+        min_price = int(params["minprice"]) if params.get("minprice") not in (None, "") else None
+        max_price = int(params["maxprice"]) if params.get("maxprice") not in (None, "") else None
+
+        matches = []
+        for place in pool:
+            if place_type and place_type not in place.get("types", []):
+                continue
+            location = place["geometry"]["location"]
+            if haversine_m(lat, lng, location["lat"], location["lng"]) > radius:
+                continue
+            price = place.get("price_level")
+            if price is not None and ((min_price is not None and price < min_price) or
+                                      (max_price is not None and price > max_price)):
+                continue
+            # Keywords match loosely in the real API; keep a stable subset per keyword
+            if keyword and keyword not in place["name"].lower() and _stable_fraction(keyword, place["place_id"]) > 0.6:
+                continue
+            matches.append(place)
+
+        matches.sort(key=lambda p: p.get("user_ratings_total", 0) or 0, reverse=True)
+        page = matches[offset:offset + PAGE_SIZE]
+        response = {"status": "OK" if page else "ZERO_RESULTS", "results": page, "html_attributions": []}
+        if offset + PAGE_SIZE < len(matches):
+            token = {"params": params, "offset": offset + PAGE_SIZE}
+            response["next_page_token"] = base64.urlsafe_b64encode(json.dumps(token).encode()).decode()
+        return response
+
+    # --- Geocoding / Directions ---
+
+    def geocode(self, address):
+        if not address:
+            return {"status": "INVALID_REQUEST", "results": []}
+        if address in self.geocode_fixture:
+            lat, lng = self.geocode_fixture[address]
+        else:
+            # Any address lands somewhere inside the fixture area, always at the same spot
+            min_lat, max_lat, min_lng, max_lng = self.bounds
+            lat = min_lat + (max_lat - min_lat) * _stable_fraction("lat", address)
+            lng = min_lng + (max_lng - min_lng) * _stable_fraction("lng", address)
+        return {"status": "OK", "results": [{
+            "formatted_address": address,
+            "geometry": {"location": {"lat": lat, "lng": lng}, "location_type": "APPROXIMATE"},
+            "place_id": f"stub_geocode_{zlib.crc32(address.encode())}",
+            "types": ["locality", "political"],
+        }]}
+
+    def _resolve_point(self, value):
+        try:
+            lat, lng = (float(v) for v in value.split(","))
+            return lat, lng
+        except ValueError:
+            location = self.geocode(value)["results"][0]["geometry"]["location"]
+            return location["lat"], location["lng"]
+
+    def directions(self, params):
+        if not params.get("origin") or not params.get("destination"):
+            return {"status": "INVALID_REQUEST", "routes": []}
+        origin = self._resolve_point(params["origin"])
+        destination = self._resolve_point(params["destination"])
+        distance = haversine_m(*origin, *destination) * 1.3  # Roads aren't straight
+        duration = distance / (30 / 3.6)  # 30 km/h urban average
+        leg = {
+            "distance": {"value": int(distance), "text": f"{distance / 1000:.1f} km"},
+            "duration": {"value": int(duration), "text": f"{int(duration // 60)} mins"},
+            "start_location": {"lat": origin[0], "lng": origin[1]},
+            "end_location": {"lat": destination[0], "lng": destination[1]},
+            "steps": [],
+        }
+        return {"status": "OK", "geocoded_waypoints": [], "routes": [{"legs": [leg], "summary": "stub"}]}
+
+    # --- Calendar ---
+
+    def _calendar(self, calendar_id):
+        return self.calendars.setdefault(calendar_id, {})
+
+    def calendar_get(self, calendar_id):
+        return 200, {"kind": "calendar#calendar", "id": calendar_id, "timeZone": self.calendar_timezone}
+
+    def calendar_list(self, calendar_id, params):
+        time_min = dateutil.parser.isoparse(params["timeMin"]) if params.get("timeMin") else None
+        time_max = dateutil.parser.isoparse(params["timeMax"]) if params.get("timeMax") else None
+        single_events = str(params.get("singleEvents", "false")).lower() == "true"
+        events = list(self._calendar(calendar_id).values())
+
+        if single_events:
+            expanded = []
+            exceptions = {}
+            for event in events:
+                if event.get("recurringEventId"):
+                    exceptions.setdefault(event["recurringEventId"], []).append(event)
+            window_start = time_min or datetime(1970, 1, 1, tzinfo=timezone.utc)
+            window_end = time_max or datetime(2100, 1, 1, tzinfo=timezone.utc)
+            for event in events:
+                if event.get("recurrence"):
+                    expanded.extend(self.recurrence.expand_master(
+                        event, exceptions.get(event["id"], []), window_start, window_end,
+                        self.calendar_timezone) or [])
+                elif not event.get("recurringEventId") and event.get("status") != "cancelled":
+                    expanded.append(event)
+            events = expanded
+
+        def in_window(event):
+            if event.get("recurrence"):
+                return True
+            start = event.get("start", {}).get("dateTime") or event.get("start", {}).get("date")
+            end = event.get("end", {}).get("dateTime") or event.get("end", {}).get("date")
+            if not start or not end:
+                return False
+            start, end = dateutil.parser.isoparse(start), dateutil.parser.isoparse(end)
+            if start.tzinfo is None:
+                start, end = start.replace(tzinfo=timezone.utc), end.replace(tzinfo=timezone.utc)
+            return (time_max is None or start < time_max) and (time_min is None or end > time_min)
+
+        events = [e for e in events if in_window(e)]
+        if params.get("orderBy") == "startTime":
+            events.sort(key=lambda e: e.get("start", {}).get("dateTime") or e.get("start", {}).get("date"))
+
+        offset = int(params.get("pageToken") or 0)
+        page_size = int(params.get("maxResults") or 250)
+        result = {"kind": "calendar#events", "timeZone": self.calendar_timezone,
+                  "items": events[offset:offset + page_size]}
+        if offset + page_size < len(events):
+            result["nextPageToken"] = str(offset + page_size)
+        return 200, result
+
+    def calendar_instances(self, calendar_id, event_id, params):
+        master = self._calendar(calendar_id).get(event_id)
+        if not master:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        window_start = dateutil.parser.isoparse(params.get("timeMin", "1970-01-01T00:00:00Z"))
+        window_end = dateutil.parser.isoparse(params.get("timeMax", "2100-01-01T00:00:00Z"))
+        items = self.recurrence.expand_master(master, [], window_start, window_end, self.calendar_timezone) or []
+        return 200, {"kind": "calendar#events", "items": items}
+
+    def calendar_insert(self, calendar_id, body):
+        events = self._calendar(calendar_id)
+        event_id = body.get("id") or uuid.uuid4().hex
+        if event_id in events:
+            return 409, {"error": {"code": 409, "message": "The requested identifier already exists."}}
+        event = dict(body, id=event_id, status="confirmed",
+                     htmlLink=f"https://calendar.stub/event?eid={event_id}",
+                     updated=datetime.now(timezone.utc).isoformat())
+        events[event_id] = event
+        return 200, event
+
+    def dispatch_calendar(self, method, path, params, body):
+        """Route one Calendar v3 call (used by both the HTTP routes and batch requests)."""
+        parts = [p for p in path.split("?")[0].split("/") if p]
+        # ['calendar', 'v3', 'calendars', <id>, 'events', <eventId>, 'instances']
+        if len(parts) < 4 or parts[:3] != ["calendar", "v3", "calendars"]:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        calendar_id = parts[3]
+        rest = parts[4:]
+        if method == "GET" and not rest:
+            return self.calendar_get(calendar_id)
+        if rest == ["events"] and method == "GET":
+            return self.calendar_list(calendar_id, params)
+        if rest == ["events"] and method == "POST":
+            return self.calendar_insert(calendar_id, body or {})
+        if len(rest) == 3 and rest[0] == "events" and rest[2] == "instances" and method == "GET":
+            return self.calendar_instances(calendar_id, rest[1], params)
+        if len(rest) == 2 and rest[0] == "events" and method == "GET":
+            event = self._calendar(calendar_id).get(rest[1])
+            return (200, event) if event else (404, {"error": {"code": 404, "message": "Not Found"}})
+        return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+
+def _parse_http_part(payload):
+    """Split a batch part (an embedded HTTP request) into method, path, params and JSON body."""
+    head, _, body = payload.replace("\r\n", "\n").partition("\n\n")
+    request_line = head.split("\n", 1)[0]
+    method, target, _ = request_line.split(" ", 2)
+    path, _, query = target.partition("?")
+    params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+    body = body.strip()
+    return method, path, params, json.loads(body) if body else None
+
+
+def create_app(stub: GoogleStub, behaviour: StubBehaviour):
+    app = FastAPI(title="Google API stand-in")
+    add_stats_routes(app, behaviour)
+
+    def maps_failure(outcome):
+        if outcome == "rate_limited":
+            return {"status": "OVER_QUERY_LIMIT", "results": [],
+                    "error_message": "You have exceeded your rate-limit for this API."}
+        return {"status": "UNKNOWN_ERROR", "results": []}
+
+    def calendar_failure(outcome):
+        if outcome == "rate_limited":
+            return JSONResponse({"error": {"code": 429, "message": "Rate Limit Exceeded"}}, status_code=429)
+        return JSONResponse({"error": {"code": 500, "message": "Backend Error"}}, status_code=500)
+
+    @app.get("/maps/api/place/nearbysearch/json")
+    async def nearby_search(request: Request):
+        outcome = await behaviour.apply("places")
+        if outcome:
+            return maps_failure(outcome)
+        return stub.nearby(dict(request.query_params))
+
+    @app.get("/maps/api/geocode/json")
+    async def geocode(request: Request):
+        outcome = await behaviour.apply("geocode")
+        if outcome:
+            return maps_failure(outcome)
+        return stub.geocode(request.query_params.get("address"))
+
+    @app.get("/maps/api/directions/json")
+    async def directions(request: Request):
+        outcome = await behaviour.apply("directions")
+        if outcome:
+            response = maps_failure(outcome)
+            response["routes"] = response.pop("results")
+            return response
+        return stub.directions(dict(request.query_params))
+
+    @app.api_route("/calendar/v3/{path:path}", methods=["GET", "POST"])
+    async def calendar(path: str, request: Request):
+        outcome = await behaviour.apply("calendar")
+        if outcome:
+            return calendar_failure(outcome)
+        raw = await request.body()
+        body = json.loads(raw) if raw else None
+        status, payload = stub.dispatch_calendar(request.method, request.url.path,
+                                                 dict(request.query_params), body)
+        return JSONResponse(payload, status_code=status)
+
+    @app.post("/batch/calendar/v3")
+    async def calendar_batch(request: Request):
+        outcome = await behaviour.apply("calendar_batch")
+        if outcome:
+            return calendar_failure(outcome)
+        content_type = request.headers.get("content-type", "")
+        raw = (await request.body()).decode("utf-8")
+        message = Parser().parsestr(f"Content-Type: {content_type}\r\n\r\n{raw}")
+
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for part in message.get_payload():
+            content_id = part.get("Content-ID", "<0+0>").strip()
+            method, path, params, body = _parse_http_part(part.get_payload())
+            behaviour.count("calendar.batched_calls")
+            status, payload = stub.dispatch_calendar(method, path, params, body)
+            reason = {200: "OK", 404: "Not Found", 409: "Conflict"}.get(status, "Error")
+            parts.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id[1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        return Response("".join(parts), media_type=f"multipart/mixed; boundary={boundary}")
+
+    return app
+
+
+def load_calendars(path):
+    """Load calendar fixtures: a list of events (for 'primary') or {calendar_id: [events]}."""
+    if not path:
+        return {}
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"primary": data}
+    return {calendar_id: {e.get("id") or uuid.uuid4().hex: e for e in events}
+            for calendar_id, events in data.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Google Maps and Calendar APIs")
+    add_behaviour_arguments(parser)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--attractions", default=DEFAULT_ATTRACTIONS_FIXTURE,
+                        help="Places fixture (list of Nearby Search results)")
+    parser.add_argument("--calendar-fixture", default=None,
+                        help="Calendar events fixture (list, or {calendar_id: [events]})")
+    parser.add_argument("--calendar-timezone", default="America/Los_Angeles")
+    parser.add_argument("--geocode-fixture", default=None,
+                        help="JSON mapping of address -> [lat, lng]")
+    args = parser.parse_args()
+
+    with open(args.attractions, "r") as f:
+        attractions = json.load(f)
+    geocode_fixture = {}
+    if args.geocode_fixture:
+        with open(args.geocode_fixture, "r") as f:
+            geocode_fixture = json.load(f)
+
+    behaviour = behaviour_from_args(args)
+    stub = GoogleStub(attractions, load_calendars(args.calendar_fixture), args.calendar_timezone,
+                      geocode_fixture, behaviour)
+    uvicorn.run(create_app(stub, behaviour), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
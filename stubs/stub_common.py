@@ -0,0 +1,182 @@
+"""
+Shared behaviour for the local API stand-in servers: latency distributions, injected
+errors, rate limiting and call statistics.
+"""
+import math
+import time
+import random
+import asyncio
+import threading
+from collections import Counter
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution spec into a sampler returning seconds.
+
+    Supported specs (all values in milliseconds):
+    - "0" or "none": no added latency
+    - "fixed:50": always 50 ms
+    - "uniform:20:200": uniformly between 20 and 200 ms
+    - "normal:120:30": mean 120 ms, standard deviation 30 ms (clamped at 0)
+    - "lognormal:120:0.5": median 120 ms, sigma 0.5 (long right tail, like real APIs)
+    """
+    if not spec or spec in ("0", "none"):
+        return lambda: 0.0
+    kind, *args = spec.split(":")
+    values = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1])) / 1000
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1]) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def parse_overrides(items):
+    """Parse repeated "api=value" command line options into a dictionary."""
+    overrides = {}
+    for item in items or []:
+        api, _, value = item.partition("=")
+        overrides[api.strip()] = value.strip()
+    return overrides
+
+
+class TokenBucket:
+    """Simple thread-safe token bucket used to emulate per-API quotas."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class StubBehaviour:
+    """
+    Decides how each simulated API call behaves.
+
+    Args:
+        latency: Default latency spec (see parse_latency)
+        error_rate: Default probability of a server error
+        rate_limit: Default allowed requests per second (None for unlimited)
+        api_latency / api_error_rate / api_rate_limit: Per-API overrides, keyed by API name
+        seed: Random seed, for reproducible runs
+    """
+
+    def __init__(self, latency="0", error_rate=0.0, rate_limit=None,
+                 api_latency=None, api_error_rate=None, api_rate_limit=None, seed=None):
+        if seed is not None:
+            random.seed(seed)
+        self.default_latency = parse_latency(latency)
+        self.default_error_rate = error_rate
+        self.default_rate_limit = rate_limit
+        self.api_latency = {api: parse_latency(spec) for api, spec in (api_latency or {}).items()}
+        self.api_error_rate = {api: float(rate) for api, rate in (api_error_rate or {}).items()}
+        self.api_rate_limit = {api: float(rate) for api, rate in (api_rate_limit or {}).items()}
+        self.buckets = {}
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def _bucket(self, api):
+        rate = self.api_rate_limit.get(api, self.default_rate_limit)
+        if not rate:
+            return None
+        with self.lock:
+            if api not in self.buckets:
+                self.buckets[api] = TokenBucket(rate)
+            return self.buckets[api]
+
+    async def apply(self, api):
+        """
+        Simulate one call to `api`: sleep for the sampled latency, then decide its outcome.
+
+        Returns:
+            None for a normal response, "rate_limited" or "error" otherwise
+        """
+        self.count(f"{api}.calls")
+
+        bucket = self._bucket(api)
+        if bucket is not None and not bucket.try_acquire():
+            self.count(f"{api}.rate_limited")
+            return "rate_limited"
+
+        delay = self.api_latency.get(api, self.default_latency)()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if random.random() < self.api_error_rate.get(api, self.default_error_rate):
+            self.count(f"{api}.errors")
+            return "error"
+        return None
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.stats[name] += n
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+
+def add_behaviour_arguments(parser):
+    """Add the common latency/error/rate-limit options to an argparse parser."""
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", default="0",
+                        help="Default latency distribution, e.g. lognormal:120:0.5 (ms)")
+    parser.add_argument("--api-latency", action="append", default=[],
+                        help="Per-API latency, e.g. places=lognormal:250:0.4 (repeatable)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Probability of a server error per call")
+    parser.add_argument("--api-error-rate", action="append", default=[],
+                        help="Per-API error rate, e.g. directions=0.05 (repeatable)")
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="Requests per second allowed per API before rate limiting")
+    parser.add_argument("--api-rate-limit", action="append", default=[],
+                        help="Per-API requests per second, e.g. places=10 (repeatable)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+    return parser
+
+
+def behaviour_from_args(args):
+    return StubBehaviour(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        api_latency=parse_overrides(args.api_latency),
+        api_error_rate=parse_overrides(args.api_error_rate),
+        api_rate_limit=parse_overrides(args.api_rate_limit),
+        seed=args.seed
+    )
+
+
+def add_stats_routes(app, behaviour):
+    """Expose call statistics so benchmarks can count API calls per run."""
+
+    @app.get("/_stats")
+    async def get_stats():
+        return behaviour.snapshot()
+
+    @app.post("/_stats/reset")
+    async def reset_stats():
+        behaviour.reset()
+        return {"reset": True}
@@ -0,0 +1,383 @@
+"""
+Request tracing across the FastAPI layer, the client agent, InfoAgent and MapAgent.
+
+Spans are kept in a context variable, so nested `with span(...)` blocks (and the stage
+timers and API call wrappers in metrics.py) form a tree per request. The trace context
+crosses process boundaries in two ways:
+- app.py -> client_agent.py: the W3C TRACEPARENT environment variable
+- between agents: the trace_id / parent_span_id fields of the models.py messages
+
+Finished spans are exported in the background according to TRACE_EXPORTER:
+- "none" (default): context is still propagated, nothing is written
+- "jsonl": one JSON object per span appended to TRACE_FILE (default traces/spans.jsonl)
+- "otlp": OTLP/HTTP JSON to OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318)
+- "jsonl,otlp": both
+
+The service name comes from TRACE_SERVICE_NAME (or OTEL_SERVICE_NAME, or the script name).
+
+To see where a request spent its time:
+    python tracing.py traces/spans.jsonl --trace <trace_id>
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import secrets
+import argparse
+import threading
+import contextvars
+import urllib.request
+from collections import namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces", "spans.jsonl")
+DEFAULT_OTLP_ENDPOINT = "http://localhost:4318"
+# Span kinds as numbered by OTLP
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+EXPORT_BATCH_SIZE = 256
+EXPORT_INTERVAL = 2.0
+
+SpanContext = namedtuple("SpanContext", ["trace_id", "span_id"])
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def new_trace_id():
+    return secrets.token_hex(16)
+
+
+def new_span_id():
+    return secrets.token_hex(8)
+
+
+def _service_name():
+    name = os.environ.get("TRACE_SERVICE_NAME") or os.environ.get("OTEL_SERVICE_NAME")
+    return name or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+
+
+class Span:
+    """One timed operation in a trace."""
+
+    def __init__(self, name, trace_id, parent_span_id=None, kind="internal", attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.service = _service_name()
+        self.attributes = {k: v for k, v in (attributes or {}).items() if v is not None}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    @property
+    def context(self):
+        return SpanContext(self.trace_id, self.span_id)
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def end(self, error=None):
+        """Finish the span (only the first call counts) and hand it to the exporters."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        _processor.submit(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "service": self.service,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def current_span():
+    return _current_span.get()
+
+
+def start_span(name, parent=None, kind="internal", attributes=None):
+    """
+    Start a span without making it current; call span.end() when done.
+
+    Args:
+        name: Operation name
+        parent: A Span or SpanContext; defaults to the current span, and a new trace
+            is started if there is none
+        kind: "internal", "server" or "client"
+        attributes: Extra key/value pairs to record
+
+    Returns:
+        The started Span
+    """
+    if parent is None:
+        parent = current_span()
+    if parent is None:
+        return Span(name, new_trace_id(), None, kind, attributes)
+    context = parent.context if isinstance(parent, Span) else parent
+    return Span(name, context.trace_id, context.span_id, kind, attributes)
+
+
+@contextmanager
+def span(name, parent=None, kind="internal", **attributes):
+    """Run a block inside a new span that is current for nested spans."""
+    current = start_span(name, parent, kind, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+@contextmanager
+def use_span(active):
+    """Make an already started span current for a block, without ending it."""
+    token = _current_span.set(active)
+    try:
+        yield active
+    finally:
+        _current_span.reset(token)
+
+
+def message_context(active=None):
+    """The trace fields to put on an outgoing models.py message."""
+    active = active or current_span()
+    if active is None:
+        return {}
+    return {"trace_id": active.trace_id, "parent_span_id": active.span_id}
+
+
+def context_from_message(msg):
+    """The SpanContext carried by an incoming message, or None if it has none."""
+    trace_id = getattr(msg, "trace_id", None)
+    if not trace_id:
+        return None
+    return SpanContext(trace_id, getattr(msg, "parent_span_id", None))
+
+
+def to_traceparent(active=None):
+    """Format the current span as a W3C traceparent header value."""
+    active = active or current_span()
+    if active is None:
+        return None
+    return f"00-{active.trace_id}-{active.span_id}-01"
+
+
+def context_from_traceparent(value):
+    """Parse a W3C traceparent value; returns None if it is missing or malformed."""
+    parts = (value or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return SpanContext(parts[1], parts[2])
+
+
+class _JsonlExporter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, spans):
+        # One write per batch; appends of whole lines interleave safely between processes
+        lines = "".join(json.dumps(s.to_dict()) + "\n" for s in spans)
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+
+class _OtlpExporter:
+    def __init__(self, endpoint):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _encode(self, s):
+        encoded = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": SPAN_KINDS.get(s.kind, 1),
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": self._value(v)} for k, v in s.attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_span_id:
+            encoded["parentSpanId"] = s.parent_span_id
+        return encoded
+
+    def export(self, spans):
+        by_service = {}
+        for s in spans:
+            by_service.setdefault(s.service, []).append(self._encode(s))
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+            "scopeSpans": [{"scope": {"name": "exploreease"}, "spans": encoded}],
+        } for service, encoded in by_service.items()]}
+        # urllib (not requests/httpx) so exports never show up in HTTP cassettes
+        request = urllib.request.Request(self.url, data=json.dumps(body).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+
+def _exporters_from_env():
+    exporters = []
+    for name in os.environ.get("TRACE_EXPORTER", "none").split(","):
+        name = name.strip().lower()
+        if name == "jsonl":
+            exporters.append(_JsonlExporter(os.environ.get("TRACE_FILE", DEFAULT_TRACE_FILE)))
+        elif name == "otlp":
+            exporters.append(_OtlpExporter(os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", DEFAULT_OTLP_ENDPOINT)))
+        elif name not in ("", "none"):
+            logger.warning(f"Unknown TRACE_EXPORTER: {name}")
+    return exporters
+
+
+class _BatchProcessor:
+    """Exports finished spans from a background thread so tracing never blocks a request."""
+
+    def __init__(self):
+        self.exporters = None
+        self.queue = queue.Queue(maxsize=10000)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.exporters is None:
+                self.exporters = _exporters_from_env()
+                if self.exporters:
+                    self.thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self.thread.start()
+                    atexit.register(self.flush)
+
+    def submit(self, finished):
+        if self.exporters is None:
+            self._start()
+        if not self.exporters:
+            return
+        try:
+            self.queue.put_nowait(finished)
+        except queue.Full:
+            pass  # Drop spans rather than slow the pipeline down
+
+    def _drain(self):
+        batch = []
+        while len(batch) < EXPORT_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch):
+        for exporter in self.exporters:
+            try:
+                exporter.export(batch)
+            except Exception as e:
+                logger.warning(f"Exporting {len(batch)} spans with {type(exporter).__name__} failed: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(EXPORT_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """Export everything queued so far (also runs at interpreter exit)."""
+        if not self.exporters:
+            return
+        with self.lock:
+            batch = self._drain()
+            while batch:
+                self._export(batch)
+                batch = self._drain()
+
+
+_processor = _BatchProcessor()
+
+
+def flush():
+    """Export all finished spans now, e.g. before sys.exit() in an agent."""
+    _processor.flush()
+
+
+def load_spans(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def print_trace(spans, trace_id):
+    """Print one trace as an indented tree with durations and offsets."""
+    spans = [s for s in spans if s["trace_id"] == trace_id]
+    if not spans:
+        print(f"No spans for trace {trace_id}")
+        return
+    ids = {s["span_id"] for s in spans}
+    children = {}
+    for s in spans:
+        parent = s["parent_span_id"] if s["parent_span_id"] in ids else None
+        children.setdefault(parent, []).append(s)
+    trace_start = min(s["start_ns"] for s in spans)
+
+    def walk(parent, depth):
+        for s in sorted(children.get(parent, []), key=lambda s: s["start_ns"]):
+            offset = (s["start_ns"] - trace_start) / 1e6
+            error = f"  ERROR {s['error']}" if s.get("error") else ""
+            print(f"{offset:>10.1f} ms {s['duration_ms']:>10.1f} ms  {'  ' * depth}{s['name']} [{s['service']}]{error}")
+            walk(s["span_id"], depth + 1)
+
+    print(f"Trace {trace_id}")
+    print(f"{'start':>13} {'duration':>13}  span")
+    walk(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show traces recorded with TRACE_EXPORTER=jsonl")
+    parser.add_argument("file", nargs="?", default=DEFAULT_TRACE_FILE)
+    parser.add_argument("--trace", default=None, help="Trace id to show (default: list the slowest traces)")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    spans = load_spans(args.file)
+    if args.trace:
+        print_trace(spans, args.trace)
+        return
+
+    traces = {}
+    for s in spans:
+        start, end = traces.get(s["trace_id"], (s["start_ns"], s["end_ns"]))
+        traces[s["trace_id"]] = (min(start, s["start_ns"]), max(end, s["end_ns"]))
+    slowest = sorted(traces.items(), key=lambda item: item[1][0] - item[1][1])[:args.limit]
+    for trace_id, (start, end) in slowest:
+        print(f"{trace_id}  {(end - start) / 1e6:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()